@@ -6,6 +6,7 @@ from rest_framework.views import APIView
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework import status
 from users.models import User
+from users.services.presence_service import PresenceService
 from chat.models import Message, Conversation
 from django.db.models import Count, Q
 from django.utils import timezone
@@ -34,7 +35,7 @@ class DashboardStatsView(APIView):
             # User statistics
             total_users = User.objects.count()
             active_users = User.objects.filter(status='active').count()
-            online_users = User.objects.filter(online_status='online').count()
+            online_users = PresenceService.online_count('online')
 
             users_created_current = User.objects.filter(created_at__gte=current_start, created_at__lte=now).count()
             users_created_previous = User.objects.filter(created_at__gte=previous_start, created_at__lt=previous_end).count()
@@ -5,6 +5,7 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from users.models import UserActivity, IPAddress, SuspiciousActivity
+from users.services.presence_service import PresenceService
 from django.db.models import Count, Q
 from datetime import datetime, timedelta
 from django.utils import timezone
@@ -19,7 +20,7 @@ def dashboard_stats(request):
         users = User.objects.all()
         total_users = users.count()
         active_users = users.filter(status='active').count()
-        online_users = users.filter(online_status='online').count()
+        online_users = PresenceService.online_count('online')
         
         # Calculate message stats
         total_messages = sum(user.message_count or 0 for user in users)
@@ -47,7 +48,7 @@ def dashboard_stats(request):
 
         # Online Growth (this is harder to track historically without a dedicated logging system)
         # For now, we can calculate growth based on active users, assuming online status is indicative of recent activity
-        online_users_today = users.filter(online_status='online').count()
+        online_users_today = online_users
         online_users_seven_days_ago = User.objects.filter(last_activity__date=seven_days_ago, online_status='online').count()
         online_growth = ((online_users_today - online_users_seven_days_ago) / max(online_users_seven_days_ago, 1)) * 100 if online_users_seven_days_ago else 0
         
@@ -92,10 +93,12 @@ def analytics_data(request):
         }
         
         # Online statistics
+        online_count = PresenceService.online_count('online')
+        away_count = PresenceService.online_count('away')
         online_stats = {
-            'online': users.filter(online_status='online').count(),
-            'away': users.filter(online_status='away').count(),
-            'offline': users.filter(online_status='offline').count()
+            'online': online_count,
+            'away': away_count,
+            'offline': max(user_stats['total'] - online_count - away_count, 0)
         }
         
         # Security statistics
@@ -3,23 +3,236 @@ Django Channels consumers for real-time chat functionality.
 """
 import json
 import asyncio
+import logging
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.utils import timezone
 from .models import Conversation, Message, Group, GroupMember
 from users.models import UserActivity
+from chat.services.contact_service import ContactService
+from chat.services.message_buffer import MessageWriteBuffer
+from chat.services.send_queue import OutboundQueueMixin, PRIORITY_PRESENCE, PRIORITY_TYPING
+from chat.services.typing_aggregator import TypingAggregator
+from users.consumers import PresenceDiffMixin
+from users.services.notification_inbox import NotificationInbox
+from users.services.presence_service import PresenceService
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
 
 
-class ChatConsumer(AsyncWebsocketConsumer):
+class TypingMixin:
+    """
+    Throttled typing indicators delivered as combined ``typing_state`` frames.
+
+    Outgoing typing events are limited per user and room by the
+    TypingAggregator; incoming ``user_typing``/``user_stop_typing`` events
+    only update its state, which is sent to the room's listeners on a tick.
+    """
+
+    def join_typing(self, room):
+        TypingAggregator.get().add_listener(room, self)
+
+    def leave_typing(self, room):
+        TypingAggregator.get().remove_listener(room, self)
+
+    async def publish_typing(self, room, is_typing):
+        aggregator = TypingAggregator.get()
+        if is_typing:
+            if not aggregator.should_publish(room, self.user.id):
+                return
+            event = {
+                'type': 'user_typing',
+                'room': room,
+                'user_id': self.user.id,
+                'username': self.user.username,
+            }
+        else:
+            aggregator.reset_publish(room, self.user.id)
+            event = {
+                'type': 'user_stop_typing',
+                'room': room,
+                'user_id': self.user.id,
+            }
+        await self.channel_layer.group_send(room, event)
+
+    async def user_typing(self, event):
+        TypingAggregator.get().observe_typing(event['room'], event['user_id'], event['username'])
+
+    async def user_stop_typing(self, event):
+        TypingAggregator.get().observe_stop(event['room'], event['user_id'])
+
+    async def send_typing_state(self, room, users, text_data):
+        await self.send(text_data=text_data, priority=PRIORITY_TYPING, coalesce_key=('typing', room))
+
+
+class BufferedMessageMixin:
+    """
+    Send chat messages through the per-process MessageWriteBuffer.
+
+    Once the batch holding a message commits, the message is broadcast to
+    the room with its sequence number and the sender gets an ``ack``
+    echoing its ``temp_id``; if the insert fails the sender gets a ``nack``.
+    """
+
+    def build_message(self, conversation_id, content, message_type):
+        return Message(
+            conversation_id=conversation_id,
+            sender=self.user,
+            content=content,
+            message_type=message_type,
+        )
+
+    def message_payload(self, message, temp_id=None):
+        payload = {
+            'id': str(message.id),
+            'conversation_id': str(message.conversation_id),
+            'seq': message.seq,
+            'content': message.content,
+            'sender': {
+                'id': self.user.id,
+                'username': self.user.username,
+            },
+            'timestamp': message.timestamp.isoformat(),
+            'message_type': message.message_type,
+        }
+        if temp_id is not None:
+            payload['temp_id'] = temp_id
+        return payload
+
+    async def send_buffered_message(self, room, message, temp_id=None):
+        """Queue a message for insert and broadcast it to the room once stored."""
+        future = MessageWriteBuffer.get().submit(message)
+        future.add_done_callback(
+            lambda done: asyncio.ensure_future(self.deliver_message(done, room, message, temp_id))
+        )
+
+    async def deliver_message(self, future, room, message, temp_id):
+        if future.cancelled() or future.exception() is not None:
+            try:
+                await self.send(text_data=json.dumps({
+                    'type': 'nack',
+                    'temp_id': temp_id,
+                    'message_id': str(message.id),
+                    'error': 'Message could not be stored',
+                }))
+            except Exception as e:
+                logger.debug(f"Could not deliver nack for message {message.id}: {str(e)}")
+            return
+
+        await self.channel_layer.group_send(
+            room,
+            {
+                'type': 'new_message',
+                'room': room,
+                'message': self.message_payload(message, temp_id),
+            }
+        )
+        try:
+            await self.send(text_data=json.dumps({
+                'type': 'ack',
+                'temp_id': temp_id,
+                'message_id': str(message.id),
+                'seq': message.seq,
+                'timestamp': message.timestamp.isoformat(),
+            }))
+        except Exception as e:
+            # The socket may have closed while the batch was being written
+            logger.debug(f"Could not deliver ack for message {message.id}: {str(e)}")
+
+
+class ResumeMixin:
+    """
+    Replay what a client missed while disconnected.
+
+    Every message carries ``seq`` (assigned at insert) and ``updated_seq``
+    (bumped by every later edit or delete). Given the highest sequence
+    number the client has seen, the replay is a range query on
+    ``(conversation, updated_seq)``. Replay runs after the socket has
+    joined the live room, so a message can arrive both ways; clients
+    de-duplicate by ``id``/``updated_seq``.
+    """
+
+    RESUME_LIMIT = 500
+
+    async def send_replay(self, conversation_id, last_seq, **extra):
+        try:
+            last_seq = int(last_seq)
+        except (TypeError, ValueError):
+            last_seq = 0
+        replay = await self.get_replay(conversation_id, last_seq)
+        await self.send(text_data=json.dumps({
+            'type': 'replay',
+            'conversation_id': str(conversation_id),
+            **replay,
+            **extra,
+        }))
+
+    @database_sync_to_async
+    def get_replay(self, conversation_id, last_seq):
+        rows = list(
+            Message.objects.filter(
+                conversation_id=conversation_id,
+                updated_seq__gt=last_seq
+            ).order_by('updated_seq').values(
+                'id', 'seq', 'updated_seq', 'content', 'message_type', 'sender_id',
+                'sender__username', 'timestamp', 'is_edited', 'edited_at', 'is_deleted'
+            )[:self.RESUME_LIMIT + 1]
+        )
+        has_more = len(rows) > self.RESUME_LIMIT
+        rows = rows[:self.RESUME_LIMIT]
+
+        if has_more:
+            next_seq = rows[-1]['updated_seq']
+        else:
+            next_seq = Conversation.objects.filter(id=conversation_id).values_list('last_seq', flat=True).first() or last_seq
+
+        messages = []
+        for row in rows:
+            messages.append({
+                'id': str(row['id']),
+                'seq': row['seq'],
+                'updated_seq': row['updated_seq'],
+                'content': '' if row['is_deleted'] else row['content'],
+                'message_type': row['message_type'],
+                'sender': {
+                    'id': row['sender_id'],
+                    'username': row['sender__username'],
+                },
+                'timestamp': row['timestamp'].isoformat(),
+                'is_edited': row['is_edited'],
+                'edited_at': row['edited_at'].isoformat() if row['edited_at'] else None,
+                'is_deleted': row['is_deleted'],
+            })
+        return {'messages': messages, 'last_seq': next_seq, 'has_more': has_more}
+
+
+def get_group_conversation_id(group_id):
+    """Return the id of a group's conversation, creating the conversation if needed."""
+    conversation_id = Conversation.objects.filter(group_id=group_id).values_list('id', flat=True).first()
+    if conversation_id is not None:
+        return conversation_id
+    try:
+        group = Group.objects.get(id=group_id)
+    except (Group.DoesNotExist, ValueError, ValidationError):
+        return None
+    return Conversation.objects.create(
+        conversation_type='group',
+        group=group,
+        title=group.name
+    ).id
+
+
+class ChatConsumer(OutboundQueueMixin, TypingMixin, AsyncWebsocketConsumer):
     """
     WebSocket consumer for general chat functionality.
     """
     
     async def connect(self):
+        self.user = self.scope["user"]
         self.conversation_id = self.scope['url_route']['kwargs']['conversation_id']
         self.conversation_group_name = f'chat_{self.conversation_id}'
         
@@ -28,10 +241,12 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.conversation_group_name,
             self.channel_name
         )
+        self.join_typing(self.conversation_group_name)
         
         await self.accept()
     
     async def disconnect(self, close_code):
+        self.leave_typing(self.conversation_group_name)
         # Leave conversation group
         await self.channel_layer.group_discard(
             self.conversation_group_name,
@@ -42,37 +257,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
         text_data_json = json.loads(text_data)
         message_type = text_data_json['type']
         
-        if message_type == 'typing':
-            await self.channel_layer.group_send(
-                self.conversation_group_name,
-                {
-                    'type': 'user_typing',
-                    'user_id': self.scope["user"].id,
-                    'username': self.scope["user"].username,
-                }
-            )
-        
-        elif message_type == 'stop_typing':
-            await self.channel_layer.group_send(
-                self.conversation_group_name,
-                {
-                    'type': 'user_stop_typing',
-                    'user_id': self.scope["user"].id,
-                }
-            )
-    
-    async def user_typing(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'typing',
-            'user_id': event['user_id'],
-            'username': event['username'],
-        }))
-    
-    async def user_stop_typing(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'stop_typing',
-            'user_id': event['user_id'],
-        }))
+        if message_type in ('typing', 'stop_typing'):
+            await self.publish_typing(self.conversation_group_name, message_type == 'typing')
     
     async def new_message(self, event):
         await self.send(text_data=json.dumps({
@@ -81,7 +267,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
         }))
 
 
-class IndividualChatConsumer(AsyncWebsocketConsumer):
+class IndividualChatConsumer(OutboundQueueMixin, TypingMixin, BufferedMessageMixin, ResumeMixin, AsyncWebsocketConsumer):
     """
     WebSocket consumer for individual chat between two users.
     """
@@ -93,16 +279,20 @@ class IndividualChatConsumer(AsyncWebsocketConsumer):
         # Create individual conversation room name
         user_ids = sorted([self.user.id, int(self.user_id)])
         self.room_group_name = f'individual_{user_ids[0]}_{user_ids[1]}'
+        self.conversation_id = None
         
         # Join room group
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
+        self.join_typing(self.room_group_name)
         
         await self.accept()
     
     async def disconnect(self, close_code):
+        if hasattr(self, 'room_group_name'):
+            self.leave_typing(self.room_group_name)
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
@@ -116,53 +306,30 @@ class IndividualChatConsumer(AsyncWebsocketConsumer):
         if message_type == 'send_message':
             await self.handle_send_message(text_data_json)
         
-        elif message_type == 'typing':
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_typing',
-                    'user_id': self.user.id,
-                    'username': self.user.username,
-                }
-            )
-        
-        elif message_type == 'stop_typing':
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_stop_typing',
-                    'user_id': self.user.id,
-                }
-            )
+        elif message_type == 'resume':
+            if self.conversation_id is None:
+                conversation = await self.get_or_create_individual_conversation()
+                if conversation is None:
+                    return
+                self.conversation_id = conversation.id
+            await self.send_replay(self.conversation_id, text_data_json.get('last_seq'))
+        
+        elif message_type in ('typing', 'stop_typing'):
+            await self.publish_typing(self.room_group_name, message_type == 'typing')
     
     async def handle_send_message(self, text_data_json):
         content = text_data_json['content']
         message_type = text_data_json.get('message_type', 'text')
         
-        # Find or create conversation
-        conversation = await self.get_or_create_individual_conversation()
-        
-        if conversation:
-            # Create message
-            message = await self.create_message(conversation, content, message_type)
-            
-            # Send message to room group
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'new_message',
-                    'message': {
-                        'id': str(message['id']),
-                        'content': message['content'],
-                        'sender': {
-                            'id': message['sender']['id'],
-                            'username': message['sender']['username'],
-                        },
-                        'timestamp': message['timestamp'],
-                        'message_type': message['message_type'],
-                    },
-                }
-            )
+        # Find or create conversation once per socket
+        if self.conversation_id is None:
+            conversation = await self.get_or_create_individual_conversation()
+            if conversation is None:
+                return
+            self.conversation_id = conversation.id
+        
+        message = self.build_message(self.conversation_id, content, message_type)
+        await self.send_buffered_message(self.room_group_name, message, text_data_json.get('temp_id'))
     
     async def new_message(self, event):
         await self.send(text_data=json.dumps({
@@ -170,76 +337,18 @@ class IndividualChatConsumer(AsyncWebsocketConsumer):
             'message': event['message'],
         }))
     
-    async def user_typing(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'typing',
-            'user_id': event['user_id'],
-            'username': event['username'],
-        }))
-    
-    async def user_stop_typing(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'stop_typing',
-            'user_id': event['user_id'],
-        }))
     
     @database_sync_to_async
     def get_or_create_individual_conversation(self):
         """Get or create individual conversation between two users."""
-        try:
-            other_user = User.objects.get(id=self.user_id)
-            
-            # Check if conversation already exists
-            conversations = Conversation.objects.filter(
-                conversation_type='individual',
-                participants=self.user
-            ).filter(
-                participants=other_user
-            )
-            
-            if conversations.exists():
-                conversation = conversations.first()
-                # Ensure both participants are in the conversation
-                if not conversation.participants.filter(id=self.user.id).exists():
-                    conversation.participants.add(self.user)
-                if not conversation.participants.filter(id=other_user.id).exists():
-                    conversation.participants.add(other_user)
-                return conversation
-            
-            # Create new conversation
-            conversation = Conversation.objects.create(
-                conversation_type='individual'
-            )
-            conversation.participants.add(self.user, other_user)
-            
-            return conversation
-            
-        except User.DoesNotExist:
+        if not User.objects.filter(id=self.user_id).exists():
             return None
+        conversation, _ = Conversation.get_or_create_individual(self.user.id, self.user_id)
+        return conversation
     
-    @database_sync_to_async
-    def create_message(self, conversation, content, message_type):
-        """Create a new message."""
-        message = Message.objects.create(
-            conversation=conversation,
-            sender=self.user,
-            content=content,
-            message_type=message_type
-        )
-        
-        return {
-            'id': message.id,
-            'content': message.content,
-            'sender': {
-                'id': message.sender.id,
-                'username': message.sender.username,
-            },
-            'timestamp': message.timestamp.isoformat(),
-            'message_type': message.message_type,
-        }
 
 
-class GroupChatConsumer(AsyncWebsocketConsumer):
+class GroupChatConsumer(OutboundQueueMixin, TypingMixin, BufferedMessageMixin, ResumeMixin, AsyncWebsocketConsumer):
     """
     WebSocket consumer for group chat functionality.
     """
@@ -256,12 +365,14 @@ class GroupChatConsumer(AsyncWebsocketConsumer):
             return
         
         self.room_group_name = f'group_{self.group_id}'
+        self.conversation_id = None
         
         # Join room group
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
+        self.join_typing(self.room_group_name)
         
         # Update user's online status
         await self.update_user_status(True)
@@ -269,6 +380,8 @@ class GroupChatConsumer(AsyncWebsocketConsumer):
         await self.accept()
     
     async def disconnect(self, close_code):
+        if hasattr(self, 'room_group_name'):
+            self.leave_typing(self.room_group_name)
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
@@ -285,70 +398,48 @@ class GroupChatConsumer(AsyncWebsocketConsumer):
         if message_type == 'send_message':
             await self.handle_send_message(text_data_json)
         
-        elif message_type == 'typing':
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_typing',
-                    'user_id': self.user.id,
-                    'username': self.user.username,
-                }
-            )
-        
-        elif message_type == 'stop_typing':
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_stop_typing',
-                    'user_id': self.user.id,
-                }
-            )
+        elif message_type == 'resume':
+            if self.conversation_id is None:
+                self.conversation_id = await self.get_group_conversation_id()
+                if self.conversation_id is None:
+                    return
+            await self.send_replay(self.conversation_id, text_data_json.get('last_seq'))
+        
+        elif message_type in ('typing', 'stop_typing'):
+            await self.publish_typing(self.room_group_name, message_type == 'typing')
     
     async def handle_send_message(self, text_data_json):
         content = text_data_json['content']
         message_type = text_data_json.get('message_type', 'text')
         
-        # Create message in group
-        message = await self.create_group_message(content, message_type)
-        
-        if message:
-            # Send message to room group
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'new_message',
-                    'message': {
-                        'id': str(message['id']),
-                        'content': message['content'],
-                        'sender': {
-                            'id': message['sender']['id'],
-                            'username': message['sender']['username'],
-                        },
-                        'timestamp': message['timestamp'],
-                        'message_type': message['message_type'],
-                    },
-                }
-            )
+        # Resolve the group's conversation once per socket
+        if self.conversation_id is None:
+            self.conversation_id = await self.get_group_conversation_id()
+            if self.conversation_id is None:
+                return
+        
+        message = self.build_message(self.conversation_id, content, message_type)
+        await self.send_buffered_message(self.room_group_name, message, text_data_json.get('temp_id'))
     
     async def new_message(self, event):
         await self.send(text_data=json.dumps({
             'type': 'new_message',
             'message': event['message'],
         }))
-    
-    async def user_typing(self, event):
+
+    async def user_online(self, event):
         await self.send(text_data=json.dumps({
-            'type': 'typing',
+            'type': 'user_online',
             'user_id': event['user_id'],
             'username': event['username'],
-        }))
-    
-    async def user_stop_typing(self, event):
+        }), priority=PRIORITY_PRESENCE)
+
+    async def user_offline(self, event):
         await self.send(text_data=json.dumps({
-            'type': 'stop_typing',
+            'type': 'user_offline',
             'user_id': event['user_id'],
-        }))
-    
+        }), priority=PRIORITY_PRESENCE)
+
     @database_sync_to_async
     def check_group_membership(self):
         """Check if user is a member of the group."""
@@ -359,52 +450,18 @@ class GroupChatConsumer(AsyncWebsocketConsumer):
             return False
     
     @database_sync_to_async
-    def create_group_message(self, content, message_type):
-        """Create a new message in the group."""
-        try:
-            group = Group.objects.get(id=self.group_id)
-            
-            # Get or create conversation for this group
-            conversation = group.conversation
-            if not conversation:
-                conversation = Conversation.objects.create(
-                    conversation_type='group',
-                    group=group,
-                    title=group.name
-                )
-            
-            # Create message
-            message = Message.objects.create(
-                conversation=conversation,
-                sender=self.user,
-                content=content,
-                message_type=message_type
-            )
-            
-            return {
-                'id': message.id,
-                'content': message.content,
-                'sender': {
-                    'id': message.sender.id,
-                    'username': message.sender.username,
-                },
-                'timestamp': message.timestamp.isoformat(),
-                'message_type': message.message_type,
-            }
-            
-        except Group.DoesNotExist:
-            return None
+    def get_group_conversation_id(self):
+        """Get or create the conversation backing the group."""
+        return get_group_conversation_id(self.group_id)
     
-    async def update_user_status(self, is_online):
-        """Update user's online status."""
-        cache_key = f'user_online_{self.user.id}'
+    @database_sync_to_async
+    def update_user_status(self, is_online):
+        """Refresh the user's presence; going offline is left to presence expiry."""
         if is_online:
-            cache.set(cache_key, True, timeout=300)  # 5 minutes
-        else:
-            cache.delete(cache_key)
+            PresenceService.heartbeat(self.user.id)
 
 
-class UserStatusConsumer(AsyncWebsocketConsumer):
+class UserStatusConsumer(OutboundQueueMixin, AsyncWebsocketConsumer):
     """
     WebSocket consumer for user online/offline status tracking.
     """
@@ -455,95 +512,40 @@ class UserStatusConsumer(AsyncWebsocketConsumer):
             'type': 'user_online',
             'user_id': event['user_id'],
             'username': event['username'],
-        }))
+        }), priority=PRIORITY_PRESENCE)
     
     async def user_offline(self, event):
         await self.send(text_data=json.dumps({
             'type': 'user_offline',
             'user_id': event['user_id'],
-        }))
+        }), priority=PRIORITY_PRESENCE)
     
     @database_sync_to_async
     def update_online_status(self, is_online):
-        """Update user's online status in cache and database."""
-        cache_key = f'user_online_{self.user.id}'
-        
+        """Update user's online status in the presence store."""
         if is_online:
-            cache.set(cache_key, True, timeout=300)  # 5 minutes timeout
-            # Update last seen
-            self.user.last_seen = timezone.now()
-            self.user.save(update_fields=['last_seen'])
+            PresenceService.heartbeat(self.user.id)
         else:
-            cache.delete(cache_key)
-            # Update last seen
-            self.user.last_seen = timezone.now()
-            self.user.save(update_fields=['last_seen'])
+            PresenceService.mark_offline(self.user.id)
     
-    @database_sync_to_async
-    def broadcast_online_status(self):
+    async def broadcast_online_status(self):
         """Broadcast user's online status to their contacts."""
-        # Get user's conversations and groups
-        conversations = Conversation.objects.filter(
-            participants=self.user
-        ).select_related()
-        
-        groups = Group.objects.filter(
-            members__user=self.user,
-            members__status='active'
-        ).select_related()
-        
-        # Broadcast to all participants in individual conversations
-        for conversation in conversations:
-            if conversation.conversation_type == 'individual':
-                for participant in conversation.participants.exclude(id=self.user.id):
-                    asyncio.create_task(self.send_status_to_user(
-                        participant.id,
-                        'user_online',
-                        {
-                            'user_id': self.user.id,
-                            'username': self.user.username,
-                        }
-                    ))
-        
-        # Broadcast to all group members
-        for group in groups:
-            asyncio.create_task(self.send_status_to_group(
-                group.id,
-                'user_online',
-                {
-                    'user_id': self.user.id,
-                    'username': self.user.username,
-                }
-            ))
+        await self.broadcast_status('user_online', {
+            'user_id': self.user.id,
+            'username': self.user.username,
+        })
     
-    @database_sync_to_async
-    def broadcast_offline_status(self):
+    async def broadcast_offline_status(self):
         """Broadcast user's offline status to their contacts."""
-        # Similar to broadcast_online_status but with offline status
-        conversations = Conversation.objects.filter(
-            participants=self.user
-        ).select_related()
-        
-        groups = Group.objects.filter(
-            members__user=self.user,
-            members__status='active'
-        ).select_related()
-        
-        for conversation in conversations:
-            if conversation.conversation_type == 'individual':
-                for participant in conversation.participants.exclude(id=self.user.id):
-                    asyncio.create_task(self.send_status_to_user(
-                        participant.id,
-                        'user_offline',
-                        {'user_id': self.user.id}
-                    ))
-        
-        for group in groups:
-            asyncio.create_task(self.send_status_to_group(
-                group.id,
-                'user_offline',
-                {'user_id': self.user.id}
-            ))
+        await self.broadcast_status('user_offline', {'user_id': self.user.id})
+    
+    async def broadcast_status(self, status_type, data):
+        """Send a status event to individual-conversation partners and the user's groups."""
+        graph = await self.get_contact_graph()
+        for user_id in graph['direct']:
+            await self.send_status_to_user(user_id, status_type, data)
+        for group_id in graph['groups']:
+            await self.send_status_to_group(group_id, status_type, data)
     
     async def send_status_to_user(self, user_id, status_type, data):
         """Send status update to a specific user."""
@@ -551,6 +553,7 @@ class UserStatusConsumer(AsyncWebsocketConsumer):
             f'user_status_{user_id}',
             {
                 'type': status_type,
+                'room': f'user_status_{user_id}',
                 **data,
             }
         )
@@ -561,46 +564,40 @@ class UserStatusConsumer(AsyncWebsocketConsumer):
             f'group_{group_id}',
             {
                 'type': status_type,
+                'room': f'group_{group_id}',
                 **data,
             }
         )
     
+    @database_sync_to_async
+    def get_contact_graph(self):
+        return ContactService.get_graph(self.user.id)
+    
     @database_sync_to_async
     def get_friends_online_status(self):
-        """Get online status of user's friends/contacts."""
-        friends_status = []
-        
-        # Get users from conversations
-        conversations = Conversation.objects.filter(
-            participants=self.user
-        ).select_related()
-        
-        contacted_users = set()
-        for conversation in conversations:
-            if conversation.conversation_type == 'individual':
-                for participant in conversation.participants.exclude(id=self.user.id):
-                    contacted_users.add(participant.id)
-        
-        # Get online status from cache
-        for user_id in contacted_users:
-            cache_key = f'user_online_{user_id}'
-            is_online = cache.get(cache_key, False)
-            
-            if is_online:
-                try:
-                    user = User.objects.get(id=user_id)
-                    friends_status.append({
-                        'user_id': user_id,
-                        'username': user.username,
-                        'is_online': True,
-                    })
-                except User.DoesNotExist:
-                    continue
-        
-        return friends_status
-
-
-class AdminMonitorConsumer(AsyncWebsocketConsumer):
+        """Get online status of user's individual-conversation partners."""
+        contacted_users = ContactService.get_graph(self.user.id)['direct']
+        
+        # Get online status from the presence store
+        statuses = PresenceService.get_statuses(contacted_users)
+        online_ids = [
+            user_id for user_id, entry in statuses.items()
+            if entry['online_status'] in PresenceService.STATUSES
+        ]
+        if not online_ids:
+            return []
+        
+        return [
+            {
+                'user_id': user_id,
+                'username': username,
+                'is_online': True,
+            }
+            for user_id, username in User.objects.filter(id__in=online_ids).values_list('id', 'username')
+        ]
+
+
+class AdminMonitorConsumer(OutboundQueueMixin, AsyncWebsocketConsumer):
     """
     WebSocket consumer for admin monitoring and real-time updates.
     """
@@ -649,4 +646,376 @@ class AdminMonitorConsumer(AsyncWebsocketConsumer):
         await self.send(text_data=json.dumps({
             'type': 'chat_statistics',
             'statistics': event['statistics'],
-        }))
\ No newline at end of file
+        }))
+
+class MultiplexConsumer(OutboundQueueMixin, TypingMixin, BufferedMessageMixin, ResumeMixin, PresenceDiffMixin, AsyncWebsocketConsumer):
+    """
+    Single WebSocket per client that multiplexes many subscriptions.
+
+    Clients send ``subscribe``/``unsubscribe`` frames naming a ``kind`` and an
+    ``id``. Each kind maps onto the same channel-layer group the dedicated
+    consumers use, so sockets on the old routes and multiplexed sockets see
+    each other's events during the migration:
+
+    - ``conversation`` -> ``chat_{conversation_id}`` (ChatConsumer) and the
+      room its messages are broadcast on (one of the two below); staff
+      watching a conversation they are not in join both but cannot send
+    - ``individual``   -> ``individual_{low_id}_{high_id}`` (IndividualChatConsumer)
+    - ``group``        -> ``group_{group_id}`` (GroupChatConsumer)
+    - ``presence``     -> ``presence_{user_id}`` and ``user_status_{user_id}``
+    - ``notifications`` -> ``notifications_{user_id}`` (NotificationInbox pushes)
+
+    Subscriptions may share a room (a group conversation and its group);
+    the room is left only when the last subscription holding it goes.
+    Outgoing frames carry ``kind`` and ``id`` so the client can route them,
+    tagged with the oldest subscription on the room they arrived through.
+    After a reconnect a ``resume`` frame re-subscribes and replays missed
+    messages per conversation (see ResumeMixin).
+    """
+
+    MAX_SUBSCRIPTIONS = 200
+    SUBSCRIPTION_KINDS = ('conversation', 'individual', 'group', 'presence', 'notifications')
+    # Kinds that always refer to the connected user and take no id
+    USER_KINDS = ('presence', 'notifications')
+
+    async def connect(self):
+        self.user = self.scope["user"]
+
+        if not self.user.is_authenticated:
+            await self.close(code=4001)
+            return
+
+        # channel-layer group name -> subscriptions holding it, oldest first
+        # ({(kind, id): None}); the room is left when the last one goes
+        self.rooms = {}
+        # (kind, id) -> the rooms it joined
+        self.subscriptions = {}
+        # (kind, id) -> (conversation id, broadcast room), resolved on first send
+        self.send_targets = {}
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        self.cancel_presence_diff()
+        for room in list(getattr(self, 'rooms', {})):
+            self.leave_typing(room)
+            await self.channel_layer.group_discard(room, self.channel_name)
+        self.rooms = {}
+        self.subscriptions = {}
+
+    async def receive(self, text_data):
+        try:
+            data = json.loads(text_data)
+        except (TypeError, ValueError):
+            await self.send_error('invalid_json', 'Frame is not valid JSON')
+            return
+
+        frame_type = data.get('type')
+
+        if frame_type == 'ping':
+            await self.send(text_data=json.dumps({'type': 'pong'}))
+            return
+
+        if frame_type == 'resume':
+            await self.handle_resume(data.get('conversations'))
+            return
+
+        if frame_type not in ('subscribe', 'unsubscribe', 'send_message', 'typing', 'stop_typing'):
+            await self.send_error('unknown_type', f'Unknown frame type: {frame_type}')
+            return
+
+        kind = data.get('kind')
+        target_id = '' if kind in self.USER_KINDS else str(data.get('id', ''))
+        if kind not in self.SUBSCRIPTION_KINDS or (kind not in self.USER_KINDS and not target_id):
+            await self.send_error('invalid_subscription', 'A valid kind and id are required', kind=kind)
+            return
+
+        if frame_type == 'subscribe':
+            await self.subscribe(kind, target_id)
+        elif frame_type == 'unsubscribe':
+            await self.unsubscribe(kind, target_id)
+        elif frame_type == 'send_message':
+            await self.handle_send_message(kind, target_id, data)
+        else:
+            await self.handle_typing(kind, target_id, frame_type)
+
+    async def subscribe(self, kind, target_id):
+        """Join a subscription's rooms; returns False after sending an error frame if refused."""
+        subscription = (kind, target_id)
+        if subscription not in self.subscriptions:
+            rooms = await self.resolve_rooms(kind, target_id)
+            if rooms is None:
+                await self.send_error('forbidden', 'Subscription not allowed', kind=kind, id=target_id)
+                return False
+
+            new_rooms = [room for room in rooms if room not in self.rooms]
+            if len(self.rooms) + len(new_rooms) > self.MAX_SUBSCRIPTIONS:
+                await self.send_error('too_many_subscriptions', 'Subscription limit reached', kind=kind, id=target_id)
+                return False
+
+            for room in rooms:
+                if room not in self.rooms:
+                    await self.channel_layer.group_add(room, self.channel_name)
+                    self.rooms[room] = {}
+                    if kind not in self.USER_KINDS:
+                        self.join_typing(room)
+                self.rooms[room][subscription] = None
+            self.subscriptions[subscription] = rooms
+
+        await self.send(text_data=json.dumps({
+            'type': 'subscribed',
+            'kind': kind,
+            'id': target_id,
+        }))
+        return True
+
+    async def handle_resume(self, positions):
+        """
+        Handle ``{"type": "resume", "conversations": {conversation_id: last_seq}}``.
+
+        Each conversation is subscribed to (through the room its messages are
+        broadcast on) unless a subscription already covers that room, and then
+        everything after ``last_seq`` is replayed tagged like the live frames.
+        """
+        if not isinstance(positions, dict):
+            await self.send_error('invalid_resume', 'conversations must map conversation ids to sequence numbers')
+            return
+
+        for conversation_id, last_seq in positions.items():
+            resolved = await self.resolve_conversation_subscription(conversation_id)
+            if resolved is None:
+                await self.send_error('forbidden', 'Resume not allowed', conversation_id=conversation_id)
+                continue
+            (kind, target_id), room = resolved
+            if self.rooms.get(room):
+                kind, target_id = self.subscription_for(room)
+            elif not await self.subscribe(kind, target_id):
+                continue
+            await self.send_replay(conversation_id, last_seq, kind=kind, id=target_id)
+
+    async def unsubscribe(self, kind, target_id):
+        subscription = (kind, target_id)
+        for room in self.subscriptions.pop(subscription, ()):
+            holders = self.rooms.get(room, {})
+            holders.pop(subscription, None)
+            if not holders:
+                self.rooms.pop(room, None)
+                self.leave_typing(room)
+                await self.channel_layer.group_discard(room, self.channel_name)
+
+        await self.send(text_data=json.dumps({
+            'type': 'unsubscribed',
+            'kind': kind,
+            'id': target_id,
+        }))
+
+    def room_for(self, kind, target_id):
+        """Return the broadcast room of a subscription, or None if not subscribed."""
+        for room in self.subscriptions.get((kind, target_id), ()):
+            if not room.startswith('user_status_'):
+                return room
+        return None
+
+    def subscription_for(self, room):
+        """The subscription a room's frames are tagged with: the oldest one holding it."""
+        holders = self.rooms.get(room)
+        return next(iter(holders)) if holders else None
+
+    async def handle_send_message(self, kind, target_id, data):
+        room = self.room_for(kind, target_id)
+        content = data.get('content')
+        if room is None or kind in self.USER_KINDS:
+            await self.send_error('not_subscribed', 'Subscribe before sending', kind=kind, id=target_id)
+            return
+        if not content:
+            await self.send_error('invalid_message', 'Message content is required', kind=kind, id=target_id)
+            return
+
+        target = self.send_targets.get((kind, target_id))
+        if target is None:
+            if kind == 'conversation':
+                target = await self.resolve_conversation_target(target_id)
+                if target is None:
+                    await self.send_error('forbidden', 'Only participants can send messages', kind=kind, id=target_id)
+                    return
+            else:
+                conversation_id = await self.get_conversation_id(kind, target_id)
+                if conversation_id is None:
+                    await self.send_error('send_failed', 'Message could not be stored', kind=kind, id=target_id)
+                    return
+                target = (conversation_id, room)
+            self.send_targets[(kind, target_id)] = target
+        conversation_id, room = target
+
+        message = self.build_message(conversation_id, content, data.get('message_type', 'text'))
+        await self.send_buffered_message(room, message, data.get('temp_id'))
+
+    async def handle_typing(self, kind, target_id, frame_type):
+        room = self.room_for(kind, target_id)
+        if room is None or kind in self.USER_KINDS:
+            return
+        await self.publish_typing(room, frame_type == 'typing')
+
+    async def send_error(self, code, message, **extra):
+        await self.send(text_data=json.dumps({
+            'type': 'error',
+            'code': code,
+            'message': message,
+            **extra,
+        }))
+
+    async def forward(self, event, frame, **send_options):
+        """Send a channel-layer event to the client tagged with its subscription."""
+        subscription = self.subscription_for(event.get('room'))
+        if subscription is None:
+            return
+        frame['kind'], frame['id'] = subscription
+        await self.send(text_data=json.dumps(frame), **send_options)
+
+    # Channel-layer event handlers
+
+    async def new_message(self, event):
+        await self.forward(event, {
+            'type': 'new_message',
+            'message': event['message'],
+        })
+
+    async def send_typing_state(self, room, users, text_data):
+        await self.forward({'room': room}, {
+            'type': 'typing_state',
+            'users': users,
+        }, priority=PRIORITY_TYPING, coalesce_key=('typing', room))
+
+    async def user_online(self, event):
+        await self.forward(event, {
+            'type': 'user_online',
+            'user_id': event['user_id'],
+            'username': event['username'],
+        }, priority=PRIORITY_PRESENCE)
+
+    async def user_offline(self, event):
+        await self.forward(event, {
+            'type': 'user_offline',
+            'user_id': event['user_id'],
+        }, priority=PRIORITY_PRESENCE)
+
+    async def notification_new(self, event):
+        await self.forward(event, {
+            'type': 'notification',
+            'notification': event['notification'],
+            'unread_count': event['unread_count'],
+        })
+
+    async def notification_read(self, event):
+        await self.forward(event, {
+            'type': 'notification_read',
+            'notification_ids': event['notification_ids'],
+            'unread_count': event['unread_count'],
+        })
+
+    async def send_presence_diff(self, changes):
+        await self.forward({'room': f'presence_{self.user.id}'}, {
+            'type': 'presence_diff',
+            'changes': changes,
+        }, priority=PRIORITY_PRESENCE)
+
+    @database_sync_to_async
+    def resolve_rooms(self, kind, target_id):
+        """Check access and return the channel-layer groups for a subscription."""
+        if kind == 'presence':
+            return [f'presence_{self.user.id}', f'user_status_{self.user.id}']
+
+        if kind == 'notifications':
+            return [NotificationInbox.GROUP.format(user_id=self.user.id)]
+
+        if kind == 'individual':
+            try:
+                other_id = int(target_id)
+            except ValueError:
+                return None
+            if other_id == self.user.id or not User.objects.filter(id=other_id).exists():
+                return None
+            low_id, high_id = sorted([self.user.id, other_id])
+            return [f'individual_{low_id}_{high_id}']
+
+        if kind == 'group':
+            try:
+                group = Group.objects.get(id=target_id, is_deleted=False)
+            except (Group.DoesNotExist, ValueError, ValidationError):
+                return None
+            return [f'group_{group.id}'] if group.is_member(self.user) else None
+
+        try:
+            conversation = Conversation.objects.select_related('group').get(id=target_id, is_deleted=False)
+        except (Conversation.DoesNotExist, ValueError, ValidationError):
+            return None
+        # Staff may watch a conversation they are not in, but not post into it
+        if not (conversation.is_participant(self.user) or self.user.is_staff):
+            return None
+        return list(dict.fromkeys([self.broadcast_room(conversation), f'chat_{conversation.id}']))
+
+    @database_sync_to_async
+    def resolve_conversation_subscription(self, conversation_id):
+        """
+        Map a conversation to ``((kind, id), broadcast room)``: the group or
+        individual subscription for participants, the conversation itself
+        for staff watching from outside.
+        """
+        try:
+            conversation = Conversation.objects.select_related('group').get(id=conversation_id, is_deleted=False)
+        except (Conversation.DoesNotExist, ValueError, ValidationError):
+            return None
+        room = self.broadcast_room(conversation)
+        if conversation.is_participant(self.user):
+            return self.canonical_subscription(conversation), room
+        if self.user.is_staff:
+            return ('conversation', str(conversation.id)), room
+        return None
+
+    @database_sync_to_async
+    def resolve_conversation_target(self, conversation_id):
+        """Return (conversation id, broadcast room) for a participant sending by conversation id."""
+        try:
+            conversation = Conversation.objects.select_related('group').get(id=conversation_id, is_deleted=False)
+        except (Conversation.DoesNotExist, ValueError, ValidationError):
+            return None
+        if not conversation.is_participant(self.user):
+            return None
+        return conversation.id, self.broadcast_room(conversation)
+
+    def canonical_subscription(self, conversation):
+        """The (kind, id) subscription whose room carries a participant's conversation."""
+        if conversation.group_id:
+            return ('group', str(conversation.group_id))
+        if conversation.conversation_type == Conversation.ConversationType.INDIVIDUAL:
+            other_id = conversation.participants.exclude(id=self.user.id).values_list('id', flat=True).first()
+            if other_id is not None:
+                return ('individual', str(other_id))
+        return ('conversation', str(conversation.id))
+
+    @staticmethod
+    def broadcast_room(conversation):
+        """The room the dedicated consumers broadcast a conversation's messages on."""
+        if conversation.group_id:
+            return f'group_{conversation.group_id}'
+        if conversation.conversation_type == Conversation.ConversationType.INDIVIDUAL:
+            if conversation.pair_low is not None:
+                return f'individual_{conversation.pair_low}_{conversation.pair_high}'
+            member_ids = sorted(conversation.participants.values_list('id', flat=True))
+            if len(member_ids) == 2:
+                return f'individual_{member_ids[0]}_{member_ids[1]}'
+        return f'chat_{conversation.id}'
+
+    @database_sync_to_async
+    def get_conversation_id(self, kind, target_id):
+        """Resolve (creating if needed) the conversation an individual or group subscription sends to."""
+        if kind == 'individual':
+            try:
+                other_user_id = int(target_id)
+            except ValueError:
+                return None
+            if not User.objects.filter(id=other_user_id).exists():
+                return None
+            conversation, _ = Conversation.get_or_create_individual(self.user.id, other_user_id)
+            return conversation.id
+
+        return get_group_conversation_id(target_id)
@@ -0,0 +1,42 @@
+"""
+Conditional GET for the polled chat endpoints.
+
+Each endpoint derives a weak ETag from version stamps it can read cheaply
+(conversation sequence numbers and ``updated_at``, inbox and membership
+watermarks, the notification list) plus the requesting user and the query
+string. When the client's ``If-None-Match`` matches, the view returns 304
+without serializing anything.
+"""
+import hashlib
+from typing import Optional
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def make_etag(request, *stamps) -> str:
+    """Weak ETag over the user, the full path and ``stamps``."""
+    raw = '|'.join(str(part) for part in (request.user.pk, request.get_full_path(), *stamps))
+    return 'W/' + quote_etag(hashlib.blake2b(raw.encode(), digest_size=16).hexdigest())
+
+
+def _opaque(etag: str) -> str:
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def not_modified(request, etag: str) -> Optional[Response]:
+    """Return a 304 response if ``If-None-Match`` matches ``etag`` (weak comparison)."""
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return None
+    candidates = parse_etags(header)
+    if '*' not in candidates and _opaque(etag) not in {_opaque(candidate) for candidate in candidates}:
+        return None
+    return with_etag(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
+
+
+def with_etag(response, etag: str):
+    # Private and always revalidated: the stamps are per user and change often
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+import time
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.management.base import BaseCommand
+from chat.media_handler import MediaHandler
+from chat.services.media_ingest import MediaIngest
+
+
+class Command(BaseCommand):
+    help = 'Compare time of the multi-pass upload validation and the single-pass MediaIngest'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb', type=int, default=20, help='Size of the sample upload')
+        parser.add_argument('--iterations', type=int, default=5, help='Timed uploads per path')
+
+    def handle(self, *args, **options):
+        root = tempfile.mkdtemp(prefix='benchmark-ingest-')
+        try:
+            storage = FileSystemStorage(location=os.path.join(root, 'media'))
+            self.run(storage, options['size_mb'] * 1024 * 1024, options['iterations'])
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+    def create_sample(self, size):
+        # A spooled upload, as Django hands over anything above FILE_UPLOAD_MAX_MEMORY_SIZE
+        upload = TemporaryUploadedFile('sample.pdf', 'application/pdf', size, None)
+        upload.write(b'%PDF-1.7\n' + b'\0' * (size - 9))
+        upload.seek(0)
+        return upload
+
+    def run(self, storage, size, iterations):
+        def multi_pass(upload):
+            # Copy to a temp file, re-read it for the signature and hash, save the upload
+            with tempfile.NamedTemporaryFile(delete=False) as tmp:
+                for chunk in upload.chunks():
+                    tmp.write(chunk)
+            try:
+                MediaHandler.validate_file(tmp.name, upload.content_type, upload.size)
+                MediaHandler.get_file_info(tmp.name, upload.content_type)
+            finally:
+                os.unlink(tmp.name)
+            return storage.save('attachments/sample.pdf', upload)
+
+        def single_pass(upload):
+            processors = MediaIngest.processors_for(upload.content_type)
+            return MediaIngest.ingest(upload, 'attachments/sample.pdf', storage, processors)['name']
+
+        self.stdout.write(f'{"path":<20}{"ms/upload":>12}{"cpu ms/upload":>16}')
+        for name, ingest in {'multi-pass': multi_pass, 'single-pass': single_pass}.items():
+            elapsed = cpu = 0
+            for _ in range(iterations):
+                upload = self.create_sample(size)
+                started, cpu_started = time.perf_counter(), time.process_time()
+                stored = ingest(upload)
+                elapsed += time.perf_counter() - started
+                cpu += time.process_time() - cpu_started
+                upload.close()
+                storage.delete(stored)
+            self.stdout.write(f'{name:<20}{elapsed * 1000 / iterations:>12.2f}{cpu * 1000 / iterations:>16.2f}')
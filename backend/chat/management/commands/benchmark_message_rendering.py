@@ -0,0 +1,73 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, reset_queries, transaction
+from django.test.utils import CaptureQueriesContext
+from chat.models import Attachment, Conversation, Message
+from chat.serializers import MessageSerializer
+from chat.services.message_renderer import MessageRenderer
+from users.models import User
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare queries and CPU time of MessageSerializer and MessageRenderer on a page of messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=50, help='Messages per page')
+        parser.add_argument('--attachments', type=int, default=2, help='Attachments per message')
+        parser.add_argument('--iterations', type=int, default=20, help='Timed renders per path')
+
+    def handle(self, *args, **options):
+        # Sample data lives in a transaction that is rolled back at the end
+        try:
+            with transaction.atomic():
+                conversation = self.create_sample(options['page_size'], options['attachments'])
+                self.run(conversation, options['page_size'], options['iterations'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def create_sample(self, page_size, attachments):
+        alice = User.objects.create_user(username='benchmark-alice', email='benchmark-alice@example.com')
+        bob = User.objects.create_user(username='benchmark-bob', email='benchmark-bob@example.com')
+        conversation = Conversation.objects.create(conversation_type='individual')
+        conversation.participants.add(alice, bob)
+        previous = None
+        for index in range(page_size):
+            previous = Message.objects.create(
+                conversation=conversation, sender=alice if index % 2 else bob,
+                content=f'message {index}', reply_to=previous if index % 3 == 0 else None
+            )
+            Attachment.objects.bulk_create([
+                Attachment(message=previous, file=f'attachments/benchmark/{index}-{number}.png',
+                           file_name=f'{index}-{number}.png', file_type='image',
+                           file_size=1024 * (number + 1), mime_type='image/png')
+                for number in range(attachments)
+            ])
+        return conversation
+
+    def run(self, conversation, page_size, iterations):
+        def page():
+            return conversation.messages.filter(is_deleted=False).order_by('-timestamp', '-id')
+
+        paths = {
+            'serializer': lambda: MessageSerializer(page()[:page_size], many=True).data,
+            'serializer (select/prefetch)': lambda: MessageSerializer(page().select_related(
+                'sender', 'reply_to__sender', 'forwarded_from__sender'
+            ).prefetch_related('attachments')[:page_size], many=True).data,
+            'renderer': lambda: MessageRenderer.render(MessageRenderer.values(page())[:page_size]),
+        }
+        self.stdout.write(f'{"path":<30}{"queries":>10}{"ms/page":>12}{"cpu ms/page":>14}')
+        for name, render in paths.items():
+            reset_queries()
+            with CaptureQueriesContext(connection) as queries:
+                render()
+            started, cpu_started = time.perf_counter(), time.process_time()
+            for _ in range(iterations):
+                render()
+            elapsed = (time.perf_counter() - started) * 1000 / iterations
+            cpu = (time.process_time() - cpu_started) * 1000 / iterations
+            self.stdout.write(f'{name:<30}{len(queries):>10}{elapsed:>12.2f}{cpu:>14.2f}')
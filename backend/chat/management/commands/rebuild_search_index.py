@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from chat.services.message_search import MessageSearch
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text message search index in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Messages indexed per transaction')
+
+    def handle(self, *args, **options):
+        total = MessageSearch.backend().rebuild(chunk_size=options['chunk_size'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} messages'))
@@ -217,21 +217,25 @@ class MediaHandler:
         try:
             with open(file_path, 'rb') as f:
                 header = f.read(16)
-            
-            for magic, mime in MediaHandler.MAGIC_NUMBERS.items():
-                if header.startswith(magic):
-                    # Allow if matches or if expected is generic
-                    if mime == expected_mime or expected_mime == 'application/octet-stream':
-                        return True
-            
-            # If no magic number matched, allow if it's a text-based format
-            if expected_mime.startswith('text/') or 'json' in expected_mime or 'xml' in expected_mime:
-                return True
-            
-            return False
+            return MediaHandler.matches_signature(header, expected_mime)
         except Exception:
             return True  # Allow if can't read
     
+    @staticmethod
+    def matches_signature(header: bytes, expected_mime: str) -> bool:
+        """Validate the first bytes of a file against its declared type"""
+        for magic, mime in MediaHandler.MAGIC_NUMBERS.items():
+            if header.startswith(magic):
+                # Allow if matches or if expected is generic
+                if mime == expected_mime or expected_mime == 'application/octet-stream':
+                    return True
+        
+        # If no magic number matched, allow if it's a text-based format
+        if expected_mime.startswith('text/') or 'json' in expected_mime or 'xml' in expected_mime:
+            return True
+        
+        return False
+    
     @staticmethod
     def get_file_extension(file_path: str) -> str:
         """Get file extension"""
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.7 on 2026-10-17 05:02
+
+from django.db import migrations, models
+
+
+def backfill_seq(apps, schema_editor):
+    """Number existing messages per conversation in timestamp order."""
+    Conversation = apps.get_model('chat', 'Conversation')
+    Message = apps.get_model('chat', 'Message')
+
+    for conversation_id in Conversation.objects.values_list('id', flat=True).iterator():
+        messages = []
+        for seq, message in enumerate(
+            Message.objects.filter(conversation_id=conversation_id).order_by('timestamp').only('id').iterator(),
+            start=1
+        ):
+            message.seq = message.updated_seq = seq
+            messages.append(message)
+        if messages:
+            Message.objects.bulk_update(messages, ['seq', 'updated_seq'], batch_size=500)
+            Conversation.objects.filter(id=conversation_id).update(last_seq=len(messages))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_rename_conversations_conver_type_idx_conversatio_convers_29a8ff_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_seq',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='seq',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='updated_seq',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'updated_seq'], name='messages_convers_2a7b94_idx'),
+        ),
+        migrations.RunPython(backfill_seq, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,104 @@
+# Generated by Django 4.2.7 on 2026-10-17 05:18
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_inbox(apps, schema_editor):
+    """Build inbox entries and the conversation projection for existing data."""
+    Conversation = apps.get_model('chat', 'Conversation')
+    ConversationParticipant = apps.get_model('chat', 'ConversationParticipant')
+    GroupMember = apps.get_model('chat', 'GroupMember')
+    InboxEntry = apps.get_model('chat', 'InboxEntry')
+    Message = apps.get_model('chat', 'Message')
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+
+    for conversation in Conversation.objects.iterator():
+        if conversation.group_id:
+            user_ids = list(GroupMember.objects.filter(
+                group_id=conversation.group_id, status='active'
+            ).values_list('user_id', flat=True))
+        else:
+            user_ids = list(ConversationParticipant.objects.filter(
+                conversation_id=conversation.id
+            ).values_list('user_id', flat=True))
+
+        last_activity_at = conversation.last_message_at or conversation.created_at
+        InboxEntry.objects.bulk_create([
+            InboxEntry(user_id=user_id, conversation_id=conversation.id, last_activity_at=last_activity_at)
+            for user_id in set(user_ids)
+        ], ignore_conflicts=True)
+
+        messages = Message.objects.filter(conversation_id=conversation.id, is_deleted=False)
+        latest = messages.select_related('sender').order_by('-timestamp').first()
+        members = [
+            {
+                'id': str(user.id),
+                'username': user.username or user.first_name or user.email.split('@')[0] or 'Unknown',
+                'email': user.email,
+                'avatar': user.avatar.url if user.avatar else None,
+                'status': user.status,
+                'display_status': 'inactive' if not user.is_active else user.status,
+                'is_active': user.is_active,
+            }
+            for user in User.objects.filter(id__in=user_ids[:50])
+        ]
+        Conversation.objects.filter(id=conversation.id).update(
+            message_count=messages.count(),
+            participant_summary={'count': len(user_ids), 'members': members},
+            last_message_summary={
+                'id': str(latest.id),
+                'sender_id': latest.sender_id,
+                'sender': latest.sender.username,
+                'content': latest.content[:200],
+                'message_type': latest.message_type,
+                'timestamp': latest.timestamp.isoformat(),
+                'seq': latest.seq,
+            } if latest else None,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chat', '0008_message_seq'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_summary',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='participant_summary',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.CreateModel(
+            name='InboxEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_activity_at', models.DateTimeField()),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to='chat.conversation')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Inbox Entry',
+                'verbose_name_plural': 'Inbox Entries',
+                'db_table': 'inbox_entries',
+                'ordering': ['-last_activity_at'],
+                'indexes': [models.Index(fields=['user', '-last_activity_at'], name='inbox_entri_user_id_c00da4_idx'), models.Index(fields=['conversation'], name='inbox_entri_convers_2e3ca6_idx')],
+                'unique_together': {('user', 'conversation')},
+            },
+        ),
+        migrations.RunPython(backfill_inbox, migrations.RunPython.noop),
+    ]
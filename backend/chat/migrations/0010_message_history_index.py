@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 05:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_inbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'is_deleted', 'timestamp', 'id'], name='messages_convers_b58551_idx'),
+        ),
+    ]
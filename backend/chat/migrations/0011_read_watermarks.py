@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-17 05:24
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_watermarks(apps, schema_editor):
+    """Existing inbox entries start with no unread messages, so mark them read."""
+    Conversation = apps.get_model('chat', 'Conversation')
+    InboxEntry = apps.get_model('chat', 'InboxEntry')
+    InboxEntry.objects.update(last_read_seq=Subquery(
+        Conversation.objects.filter(pk=OuterRef('conversation_id')).values('last_seq')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_message_history_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inboxentry',
+            name='last_read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='inboxentry',
+            name='last_read_seq',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'seq'], name='messages_convers_b6df6a_idx'),
+        ),
+        migrations.RunPython(backfill_watermarks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-17 05:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5(content)')
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS message_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_read_watermarks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageSearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='chat.conversation')),
+                ('message', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='search_document', to='chat.message')),
+            ],
+            options={
+                'verbose_name': 'Message Search Document',
+                'verbose_name_plural': 'Message Search Documents',
+                'db_table': 'message_search_documents',
+                'indexes': [models.Index(fields=['conversation'], name='message_sea_convers_edb8f6_idx')],
+            },
+        ),
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
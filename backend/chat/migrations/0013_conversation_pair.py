@@ -0,0 +1,56 @@
+# Generated by Django 4.2.7 on 2026-10-17 05:33
+
+from django.db import migrations, models
+
+
+def backfill_pairs(apps, schema_editor):
+    """
+    Key existing 1:1 conversations by their user pair. When duplicates exist
+    the oldest conversation gets the key; the others stay unkeyed.
+    """
+    Conversation = apps.get_model('chat', 'Conversation')
+    ConversationParticipant = apps.get_model('chat', 'ConversationParticipant')
+
+    members = {}
+    for conversation_id, user_id in ConversationParticipant.objects.filter(
+        conversation__conversation_type='individual'
+    ).values_list('conversation_id', 'user_id').iterator():
+        members.setdefault(conversation_id, set()).add(user_id)
+
+    seen = set()
+    for conversation_id in Conversation.objects.filter(
+        conversation_type='individual', id__in=list(members)
+    ).order_by('created_at').values_list('id', flat=True):
+        user_ids = members[conversation_id]
+        if len(user_ids) != 2:
+            continue
+        low, high = min(user_ids), max(user_ids)
+        if (low, high) in seen:
+            continue
+        seen.add((low, high))
+        Conversation.objects.filter(id=conversation_id).update(pair_low=low, pair_high=high)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_message_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='pair_high',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='pair_low',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='conversation',
+            constraint=models.UniqueConstraint(condition=models.Q(('pair_low__isnull', False)), fields=('pair_low', 'pair_high'), name='unique_individual_conversation_pair'),
+        ),
+        migrations.RunPython(backfill_pairs, migrations.RunPython.noop),
+    ]
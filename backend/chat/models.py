@@ -1,7 +1,8 @@
 """
 Chat models - MINIMAL FIX
 """
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q
 from django.conf import settings
 from django.utils import timezone
 import uuid
@@ -66,14 +67,12 @@ class Group(models.Model):
             return False
     
     def is_member(self, user):
-        return self.members.filter(user=user, status='active').exists()
+        from chat.services.membership_cache import MembershipCache
+        return user.pk is not None and MembershipCache.is_member(user.pk, self.pk)
     
     def get_member_role(self, user):
-        try:
-            member = self.members.get(user=user)
-            return member.role
-        except GroupMember.DoesNotExist:
-            return None
+        from chat.services.membership_cache import MembershipCache
+        return MembershipCache.member_role(user.pk, self.pk) if user.pk is not None else None
     
     def can_manage(self, user):
         role = self.get_member_role(user)
@@ -142,6 +141,14 @@ class Conversation(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     is_deleted = models.BooleanField(default=False)
     deleted_at = models.DateTimeField(null=True, blank=True)
+    last_seq = models.PositiveBigIntegerField(default=0)
+    # Inbox projection, maintained by InboxService
+    message_count = models.PositiveIntegerField(default=0)
+    last_message_summary = models.JSONField(null=True, blank=True)
+    participant_summary = models.JSONField(default=dict, blank=True)
+    # Canonical user pair of an individual conversation (lower id first)
+    pair_low = models.BigIntegerField(null=True, blank=True)
+    pair_high = models.BigIntegerField(null=True, blank=True)
     
     class Meta:
         db_table = 'conversations'
@@ -149,6 +156,13 @@ class Conversation(models.Model):
         verbose_name_plural = 'Conversations'
         ordering = ['-last_message_at', '-created_at']
         indexes = [models.Index(fields=['conversation_type']), models.Index(fields=['last_message_at']), models.Index(fields=['created_at']), models.Index(fields=['is_deleted']), models.Index(fields=['conversation_status'])]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['pair_low', 'pair_high'],
+                condition=Q(pair_low__isnull=False),
+                name='unique_individual_conversation_pair'
+            ),
+        ]
     
     def __str__(self):
         if self.conversation_type == self.ConversationType.GROUP:
@@ -171,11 +185,21 @@ class Conversation(models.Model):
     
     def add_participant(self, user):
         if self.conversation_type == self.ConversationType.INDIVIDUAL:
-            if self.participants.count() >= 2:
+            member_ids = list(self.participants.values_list('id', flat=True))
+            if len(member_ids) >= 2 or user.id in member_ids:
                 return False
-            if self.participants.filter(id=user.id).exists():
+            if not member_ids:
+                ConversationParticipant.objects.create(conversation=self, user=user)
+                return True
+            # Completing the pair keys the conversation; an existing pair wins
+            low, high = sorted((member_ids[0], user.id))
+            try:
+                with transaction.atomic():
+                    Conversation.objects.filter(pk=self.pk).update(pair_low=low, pair_high=high)
+                    ConversationParticipant.objects.create(conversation=self, user=user)
+            except IntegrityError:
                 return False
-            ConversationParticipant.objects.create(conversation=self, user=user)
+            self.pair_low, self.pair_high = low, high
             return True
         return False
     
@@ -190,9 +214,44 @@ class Conversation(models.Model):
         return False
     
     def is_participant(self, user):
+        from chat.services.membership_cache import MembershipCache
+        if user.pk is None:
+            return False
         if self.conversation_type == self.ConversationType.GROUP:
-            return self.group.is_member(user) if self.group else False
-        return self.participants.filter(id=user.id).exists()
+            return MembershipCache.is_member(user.pk, self.group_id) if self.group_id else False
+        return MembershipCache.is_participant(user.pk, self.pk)
+    
+    @classmethod
+    def get_or_create_individual(cls, user_id, other_user_id):
+        """
+        Return ``(conversation, created)`` for the 1:1 conversation between
+        two users, looked up by its canonical pair. Concurrent creators race
+        on the unique pair constraint and the loser returns the winner's row.
+        """
+        low, high = sorted((int(user_id), int(other_user_id)))
+        conversation = cls.objects.filter(pair_low=low, pair_high=high).first()
+        if conversation is not None:
+            return conversation, False
+        try:
+            with transaction.atomic():
+                conversation = cls.objects.create(
+                    conversation_type=cls.ConversationType.INDIVIDUAL, pair_low=low, pair_high=high
+                )
+                conversation.participants.add(low, high)
+        except IntegrityError:
+            return cls.objects.get(pair_low=low, pair_high=high), False
+        return conversation, True
+    
+    @classmethod
+    def allocate_seq(cls, conversation_id, count=1):
+        """
+        Reserve ``count`` sequence numbers and return the last one.
+
+        Call inside the transaction that writes the messages: the row lock
+        taken by the UPDATE keeps sequence numbers committing in order.
+        """
+        cls.objects.filter(pk=conversation_id).update(last_seq=F('last_seq') + count)
+        return cls.objects.filter(pk=conversation_id).values_list('last_seq', flat=True).get()
     
     def update_activity(self):
         self.last_message_at = timezone.now()
@@ -246,6 +305,28 @@ class ConversationParticipant(models.Model):
         self.save(update_fields=['last_read_at', 'unread_count'])
 
 
+class InboxEntry(models.Model):
+    """A conversation as it appears in one user's inbox."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='inbox_entries')
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='inbox_entries')
+    last_activity_at = models.DateTimeField()
+    unread_count = models.PositiveIntegerField(default=0)
+    # Read watermark: seq of the last message the user has read
+    last_read_seq = models.PositiveBigIntegerField(default=0)
+    last_read_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'inbox_entries'
+        verbose_name = 'Inbox Entry'
+        verbose_name_plural = 'Inbox Entries'
+        unique_together = ['user', 'conversation']
+        ordering = ['-last_activity_at']
+        indexes = [models.Index(fields=['user', '-last_activity_at']), models.Index(fields=['conversation'])]
+    
+    def __str__(self):
+        return f"{self.conversation_id} in {self.user_id}'s inbox"
+
+
 class Message(models.Model):
     class MessageType(models.TextChoices):
         TEXT = 'text', 'Text'
@@ -267,17 +348,32 @@ class Message(models.Model):
     is_deleted = models.BooleanField(default=False)
     deleted_at = models.DateTimeField(null=True, blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
+    # Per-conversation sequence number assigned at insert, and the sequence
+    # number of the latest change (insert, edit, delete) used for resume.
+    seq = models.PositiveBigIntegerField(null=True, blank=True)
+    updated_seq = models.PositiveBigIntegerField(null=True, blank=True)
     
     class Meta:
         db_table = 'messages'
         verbose_name = 'Message'
         verbose_name_plural = 'Messages'
         ordering = ['timestamp']
-        indexes = [models.Index(fields=['conversation']), models.Index(fields=['sender']), models.Index(fields=['timestamp']), models.Index(fields=['message_type']), models.Index(fields=['is_deleted']), models.Index(fields=['reply_to'])]
+        indexes = [models.Index(fields=['conversation']), models.Index(fields=['sender']), models.Index(fields=['timestamp']), models.Index(fields=['message_type']), models.Index(fields=['is_deleted']), models.Index(fields=['reply_to']), models.Index(fields=['conversation', 'updated_seq']), models.Index(fields=['conversation', 'is_deleted', 'timestamp', 'id']), models.Index(fields=['conversation', 'seq'])]
     
     def __str__(self):
         return f"Message from {self.sender.username} at {self.timestamp}"
     
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            seq = Conversation.allocate_seq(self.conversation_id)
+            if self._state.adding and self.seq is None:
+                self.seq = seq
+            self.updated_seq = seq
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'updated_seq'}
+            super().save(*args, **kwargs)
+    
     def edit_content(self, new_content):
         self.content = new_content
         self.is_edited = True
@@ -295,6 +391,18 @@ class Message(models.Model):
         self.save(update_fields=['is_deleted', 'deleted_at'])
 
 
+class MessageSearchDocument(models.Model):
+    """Maps full-text index rowids to messages; see chat.services.message_search."""
+    message = models.OneToOneField(Message, on_delete=models.CASCADE, related_name='search_document')
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='+')
+    
+    class Meta:
+        db_table = 'message_search_documents'
+        verbose_name = 'Message Search Document'
+        verbose_name_plural = 'Message Search Documents'
+        indexes = [models.Index(fields=['conversation'])]
+
+
 class Attachment(models.Model):
     class FileType(models.TextChoices):
         IMAGE = 'image', 'Image'
@@ -361,3 +469,40 @@ class Attachment(models.Model):
         minutes = self.duration // 60
         seconds = self.duration % 60
         return f"{minutes}:{seconds:02d}"
+
+
+class UploadSession(models.Model):
+    """A resumable chunked upload; see chat.services.chunked_upload."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='upload_sessions')
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='upload_sessions')
+    file_name = models.CharField(max_length=255)
+    mime_type = models.CharField(max_length=100)
+    file_size = models.PositiveBigIntegerField()
+    # Bytes received so far; the next chunk must start here
+    offset = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'upload_sessions'
+        verbose_name = 'Upload Session'
+        verbose_name_plural = 'Upload Sessions'
+        indexes = [models.Index(fields=['updated_at'])]
+    
+    def __str__(self):
+        return f"{self.file_name} ({self.offset}/{self.file_size} bytes)"
+
+
+class OutboxEvent(models.Model):
+    """A side effect recorded in the transaction that caused it; applied by chat.services.outbox."""
+    kind = models.CharField(max_length=32)
+    payload = models.JSONField(default=dict)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'outbox_events'
+        verbose_name = 'Outbox Event'
+        verbose_name_plural = 'Outbox Events'
+        ordering = ['id']
@@ -0,0 +1,113 @@
+"""
+Keyset pagination for message history.
+
+Pages are addressed by an opaque ``(timestamp, id)`` cursor instead of a page
+number, so fetching older history costs one range scan on the
+``(conversation, is_deleted, timestamp, id)`` index no matter how deep the
+page is, and no COUNT(*) is issued.
+"""
+import base64
+import binascii
+import uuid
+from datetime import datetime
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class MessageCursorPagination:
+    """
+    Paginate messages newest first with ``before``/``after`` cursors.
+
+    ``?before=<cursor>`` returns the page of messages older than the cursor,
+    ``?after=<cursor>`` the page newer than it; both come back newest first.
+    """
+
+    page_size = 50
+    max_page_size = 200
+    before_query_param = 'before'
+    after_query_param = 'after'
+    page_size_query_param = 'limit'
+
+    @staticmethod
+    def encode_cursor(message):
+        # Pages hold either Message instances or MessageRenderer rows
+        if isinstance(message, dict):
+            timestamp, message_id = message['timestamp'], message['id']
+        else:
+            timestamp, message_id = message.timestamp, message.id
+        raw = f'{timestamp.isoformat()}|{message_id}'
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            timestamp, message_id = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+            return datetime.fromisoformat(timestamp), uuid.UUID(message_id)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise ValidationError({'cursor': 'Invalid cursor.'})
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request):
+        """Return one page of ``queryset`` (unordered messages or their rows) for the request's cursor."""
+        self.request = request
+        page_size = self.get_page_size(request)
+        before = request.query_params.get(self.before_query_param)
+        after = request.query_params.get(self.after_query_param)
+
+        if after:
+            timestamp, message_id = self.decode_cursor(after)
+            queryset = queryset.filter(
+                Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=message_id)
+            ).order_by('timestamp', 'id')
+        else:
+            if before:
+                timestamp, message_id = self.decode_cursor(before)
+                queryset = queryset.filter(
+                    Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id)
+                )
+            queryset = queryset.order_by('-timestamp', '-id')
+
+        # One extra row tells us whether there is another page
+        page = list(queryset[:page_size + 1])
+        self.has_more = len(page) > page_size
+        page = page[:page_size]
+        if after:
+            page.reverse()
+
+        # Walking backwards (default/before), "more" means older messages;
+        # walking forwards (after), it means newer ones.
+        self.has_older = self.has_more if not after else True
+        self.has_newer = bool(before) or (bool(after) and self.has_more)
+        self.page = page
+        return page
+
+    def get_next_link(self):
+        """Link to older messages."""
+        if not self.page or not self.has_older:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.after_query_param)
+        return replace_query_param(url, self.before_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_previous_link(self):
+        """Link to newer messages."""
+        if not self.page or not self.has_newer:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.before_query_param)
+        return replace_query_param(url, self.after_query_param, self.encode_cursor(self.page[0]))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'has_more': self.has_more,
+            'results': data,
+        })
@@ -5,6 +5,7 @@ from django.urls import re_path
 from . import consumers
 
 websocket_urlpatterns = [
+    re_path(r'ws/connect/$', consumers.MultiplexConsumer.as_asgi()),
     re_path(r'ws/chat/(?P<conversation_id>\w+)/$', consumers.ChatConsumer.as_asgi()),
     re_path(r'ws/chat/individual/(?P<user_id>\w+)/$', consumers.IndividualChatConsumer.as_asgi()),
     re_path(r'ws/chat/group/(?P<group_id>\w+)/$', consumers.GroupChatConsumer.as_asgi()),
@@ -4,12 +4,38 @@ Serializers for chat app - FIXED VERSION 2
 from rest_framework import serializers
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from .models import Group, GroupMember, Conversation, ConversationParticipant, Message, Attachment
+from .models import Group, GroupMember, Conversation, ConversationParticipant, InboxEntry, Message, Attachment
 from users.serializers import UserSerializer
+from .services.message_renderer import MessageRenderer
 
 User = get_user_model()
 
 
+def render_last_message(serializer, conversation):
+    """
+    A conversation's last message as ``MessageSerializer`` renders it, taken
+    from the page batch in ``context['last_messages']`` when there is one.
+    """
+    summary = conversation.last_message_summary
+    if not summary:
+        return None
+    rendered = serializer.context.get('last_messages')
+    if rendered is None:
+        rendered = MessageRenderer.render_last_messages([conversation], serializer.context.get('request'))
+    return rendered.get(summary['id'])
+
+
+class LastMessageListSerializer(serializers.ListSerializer):
+    """Renders the last messages of a whole page in one batch before its rows."""
+
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, 'all') else data)
+        self.context['last_messages'] = MessageRenderer.render_last_messages(
+            [self.child.conversation_of(item) for item in items], self.context.get('request')
+        )
+        return super().to_representation(items)
+
+
 class GroupMemberSerializer(serializers.ModelSerializer):
     user = serializers.StringRelatedField()
     
@@ -135,9 +161,9 @@ class MessageSerializer(serializers.ModelSerializer):
         model = Message
         fields = ['id', 'conversation', 'sender', 'content', 'message_type',
                   'reply_to', 'forwarded_from', 'is_edited', 'edited_at',
-                  'is_deleted', 'deleted_at', 'timestamp', 'attachments']
+                  'is_deleted', 'deleted_at', 'timestamp', 'seq', 'updated_seq', 'attachments']
         read_only_fields = ['id', 'sender', 'is_edited', 'edited_at', 'is_deleted',
-                            'deleted_at', 'timestamp', 'attachments']
+                            'deleted_at', 'timestamp', 'seq', 'updated_seq', 'attachments']
 
 class MessageCreateSerializer(serializers.ModelSerializer):
     attachments = serializers.ListField(child=serializers.FileField(), required=False, write_only=True)
@@ -187,6 +213,11 @@ class ConversationSerializer(serializers.ModelSerializer):
                   'participant_count', 'participants', 'last_message', 'message_count']
         read_only_fields = ['id', 'last_message_at', 'conversation_status', 'created_at', 'updated_at',
                             'is_deleted', 'deleted_at']
+        list_serializer_class = LastMessageListSerializer
+    
+    @staticmethod
+    def conversation_of(obj):
+        return obj
     
     def get_participants(self, obj):
         try:
@@ -235,18 +266,83 @@ class ConversationSerializer(serializers.ModelSerializer):
             return []
     
     def get_last_message(self, obj):
-        last_msg = obj.last_message
-        if last_msg:
-            return MessageSerializer(last_msg).data
-        return None
+        return render_last_message(self, obj)
     
     def get_message_count(self, obj):
-        return obj.messages.filter(is_deleted=False).count()
+        return obj.message_count
     
     def get_is_active(self, obj):
         return obj.is_active()
 
 
+class InboxEntrySerializer(serializers.ModelSerializer):
+    """
+    Sidebar row rendered from an InboxEntry and its conversation's stored
+    projection. Expects ``select_related('conversation__group__created_by')``
+    and live presence in ``context['presence']``. Listing a page costs two
+    queries, for its last messages and their attachments.
+    """
+    id = serializers.UUIDField(source='conversation_id', read_only=True)
+    conversation_type = serializers.CharField(source='conversation.conversation_type', read_only=True)
+    group = serializers.SerializerMethodField()
+    title = serializers.CharField(source='conversation.title', read_only=True)
+    description = serializers.CharField(source='conversation.description', read_only=True)
+    last_message_at = serializers.DateTimeField(source='conversation.last_message_at', read_only=True)
+    conversation_status = serializers.CharField(source='conversation.conversation_status', read_only=True)
+    is_active = serializers.SerializerMethodField()
+    created_at = serializers.DateTimeField(source='conversation.created_at', read_only=True)
+    updated_at = serializers.DateTimeField(source='conversation.updated_at', read_only=True)
+    participant_count = serializers.SerializerMethodField()
+    participants = serializers.SerializerMethodField()
+    last_message = serializers.SerializerMethodField()
+    message_count = serializers.IntegerField(source='conversation.message_count', read_only=True)
+    
+    class Meta:
+        model = InboxEntry
+        fields = ['id', 'conversation_type', 'group', 'title', 'description', 'last_message_at',
+                  'conversation_status', 'is_active', 'created_at', 'updated_at', 'participant_count',
+                  'participants', 'last_message', 'message_count', 'unread_count', 'last_read_seq',
+                  'last_activity_at']
+        read_only_fields = fields
+        list_serializer_class = LastMessageListSerializer
+    
+    @staticmethod
+    def conversation_of(obj):
+        return obj.conversation
+    
+    def get_last_message(self, obj):
+        return render_last_message(self, obj.conversation)
+    
+    def get_group(self, obj):
+        group = obj.conversation.group
+        if group is None:
+            return None
+        return {
+            'id': str(group.id),
+            'name': group.name,
+            'description': group.description,
+            'avatar': group.avatar.url if group.avatar else None,
+            'group_type': group.group_type,
+            'is_private': group.is_private,
+            'created_by': str(group.created_by),
+            'last_activity': group.last_activity,
+        }
+    
+    def get_participant_count(self, obj):
+        return (obj.conversation.participant_summary or {}).get('count', 0)
+    
+    def get_participants(self, obj):
+        presence = self.context.get('presence', {})
+        participants = []
+        for member in (obj.conversation.participant_summary or {}).get('members', []):
+            entry = presence.get(int(member['id']))
+            participants.append({**member, 'online_status': entry['online_status'] if entry else 'offline'})
+        return participants
+    
+    def get_is_active(self, obj):
+        return any(p['online_status'] == 'online' for p in self.get_participants(obj))
+
+
 class ConversationCreateSerializer(serializers.ModelSerializer):
     participant_ids = serializers.ListField(child=serializers.IntegerField(),
                                            required=False, write_only=True)
@@ -260,8 +356,12 @@ class ConversationCreateSerializer(serializers.ModelSerializer):
         conversation_type = attrs.get('conversation_type', 'individual')
         if conversation_type == 'individual':
             participant_ids = attrs.get('participant_ids', [])
-            if len(participant_ids) > 1:
-                raise serializers.ValidationError("Individual conversations can only have 2 participants.")
+            if len(participant_ids) != 1:
+                raise serializers.ValidationError("Individual conversations need exactly one other participant.")
+            if participant_ids[0] == self.context['request'].user.id:
+                raise serializers.ValidationError("You cannot start a conversation with yourself.")
+            if not User.objects.filter(id=participant_ids[0]).exists():
+                raise serializers.ValidationError("Participant not found.")
         elif conversation_type == 'group':
             if 'group_data' not in attrs:
                 raise serializers.ValidationError("Group data is required for group conversations.")
@@ -270,6 +370,17 @@ class ConversationCreateSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         participant_ids = validated_data.pop('participant_ids', [])
         group_data = validated_data.pop('group_data', None)
+        request_user = self.context['request'].user
+        
+        if validated_data.get('conversation_type', 'individual') == 'individual':
+            # 1:1 conversations are unique per user pair
+            conversation, created = Conversation.get_or_create_individual(request_user.id, participant_ids[0])
+            if created and (validated_data.get('title') or validated_data.get('description')):
+                conversation.title = validated_data.get('title', '')
+                conversation.description = validated_data.get('description', '')
+                conversation.save(update_fields=['title', 'description'])
+            return conversation
+        
         conversation = Conversation.objects.create(**validated_data)
         
         if conversation.conversation_type == 'group' and group_data:
@@ -285,7 +396,6 @@ class ConversationCreateSerializer(serializers.ModelSerializer):
                 except User.DoesNotExist:
                     continue
         else:
-            request_user = self.context['request'].user
             conversation.add_participant(request_user)
             for participant_id in participant_ids:
                 try:
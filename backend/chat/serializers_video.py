@@ -294,8 +294,12 @@ class ConversationCreateSerializer(serializers.ModelSerializer):
         
         if conversation_type == 'individual':
             participant_ids = attrs.get('participant_ids', [])
-            if len(participant_ids) > 1:
-                raise serializers.ValidationError("Individual conversations can only have 2 participants.")
+            if len(participant_ids) != 1:
+                raise serializers.ValidationError("Individual conversations need exactly one other participant.")
+            if participant_ids[0] == self.context['request'].user.id:
+                raise serializers.ValidationError("You cannot start a conversation with yourself.")
+            if not User.objects.filter(id=participant_ids[0]).exists():
+                raise serializers.ValidationError("Participant not found.")
         elif conversation_type == 'group':
             if 'group_data' not in attrs:
                 raise serializers.ValidationError("Group data is required for group conversations.")
@@ -306,6 +310,16 @@ class ConversationCreateSerializer(serializers.ModelSerializer):
         participant_ids = validated_data.pop('participant_ids', [])
         group_data = validated_data.pop('group_data', None)
         
+        if validated_data.get('conversation_type', 'individual') == 'individual':
+            # 1:1 conversations are unique per user pair
+            request_user = self.context['request'].user
+            conversation, created = Conversation.get_or_create_individual(request_user.id, participant_ids[0])
+            if created and (validated_data.get('title') or validated_data.get('description')):
+                conversation.title = validated_data.get('title', '')
+                conversation.description = validated_data.get('description', '')
+                conversation.save(update_fields=['title', 'description'])
+            return conversation
+        
         conversation = Conversation.objects.create(**validated_data)
         
         if conversation.conversation_type == 'group' and group_data:
@@ -0,0 +1,224 @@
+"""
+Resumable chunked uploads.
+
+Large files are not sent as one multipart body (which Django would buffer or
+spool as a whole). The client creates an ``UploadSession``, PUTs the file in
+chunks, each tagged with its byte offset, and finalizes the session:
+
+    POST /api/chat/uploads/                      -> session id, offset 0
+    PUT  /api/chat/uploads/<id>/  Upload-Offset  -> new offset
+    GET  /api/chat/uploads/<id>/                 -> current offset (resume)
+    POST /api/chat/uploads/<id>/complete/        -> Attachment
+
+Chunk bodies are read from the request stream in small blocks and appended
+to a staging file, so worker memory per upload is constant. The session
+offset only advances by bytes already on disk; after a dropped connection
+the client asks for the offset and continues from there. On finalize the
+staging file is moved into storage (a rename on FileSystemStorage) and the
+``Attachment`` is created.
+"""
+import logging
+import os
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+from chat.media_handler import MediaCategory, MediaHandler
+
+logger = logging.getLogger(__name__)
+
+
+class UploadError(Exception):
+    """An upload request that cannot be accepted."""
+    pass
+
+
+class OffsetMismatch(UploadError):
+    """A chunk that does not start at the session's current offset."""
+
+    def __init__(self, offset):
+        super().__init__(f'Expected offset {offset}')
+        self.offset = offset
+
+
+class UploadBusy(UploadError):
+    """Another request is writing to the same session."""
+    pass
+
+
+class StagedFile(File):
+    """A staging file that FileSystemStorage.save moves instead of copying."""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+class ChunkedUploadService:
+    """
+    Service managing upload sessions, their staging files and finalization.
+    """
+
+    MAX_CHUNK_SIZE = 8 * 1024 * 1024
+    BLOCK_SIZE = 64 * 1024  # bytes read from the request per write
+    SESSION_TTL = timedelta(hours=24)
+    LOCK_KEY = 'upload_session:{session_id}:lock'
+    LOCK_TIMEOUT = 300
+
+    FILE_TYPES = {
+        MediaCategory.IMAGE: 'image',
+        MediaCategory.VIDEO: 'video',
+        MediaCategory.AUDIO: 'audio',
+        MediaCategory.DOCUMENT: 'document',
+    }
+
+    @staticmethod
+    def staging_dir() -> str:
+        return str(getattr(settings, 'UPLOAD_STAGING_DIR', os.path.join(settings.MEDIA_ROOT, 'staging')))
+
+    @classmethod
+    def staging_path(cls, session) -> str:
+        return os.path.join(cls.staging_dir(), f'{session.id}.part')
+
+    @classmethod
+    def create(cls, user, message, file_name: str, mime_type: str, file_size: int):
+        """Open a session after checking the declared type and size."""
+        from chat.models import UploadSession
+
+        if not MediaHandler.is_supported(mime_type):
+            raise UploadError(f'File type {mime_type} is not supported')
+        category = MediaHandler.get_category(mime_type)
+        max_size = MediaHandler.DEFAULT_LIMITS.get(category, MediaHandler.DEFAULT_LIMITS[MediaCategory.OTHER])
+        if file_size <= 0:
+            raise UploadError('File size must be positive')
+        if file_size > max_size:
+            raise UploadError(f'File size exceeds limit of {max_size / (1024 * 1024)}MB for {category.value} files')
+
+        session = UploadSession.objects.create(
+            user=user, message=message, file_name=os.path.basename(file_name)[:255],
+            mime_type=mime_type, file_size=file_size
+        )
+        os.makedirs(cls.staging_dir(), exist_ok=True)
+        open(cls.staging_path(session), 'wb').close()
+        return session
+
+    @classmethod
+    def append(cls, session, offset: int, stream, length: int) -> int:
+        """
+        Append ``length`` bytes read from ``stream`` at ``offset``; returns
+        the new offset. A body cut short still advances the offset by the
+        bytes that arrived.
+        """
+        from chat.models import UploadSession
+
+        if length <= 0 or length > cls.MAX_CHUNK_SIZE:
+            raise UploadError(f'Chunks must be between 1 and {cls.MAX_CHUNK_SIZE} bytes')
+        if offset + length > session.file_size:
+            raise UploadError('Chunk extends past the declared file size')
+
+        with cls.lock(session):
+            session.refresh_from_db(fields=['offset'])
+            if offset != session.offset:
+                raise OffsetMismatch(session.offset)
+
+            written = 0
+            with open(cls.staging_path(session), 'r+b') as staging:
+                # Drop bytes past the offset left by an interrupted chunk
+                staging.seek(offset)
+                staging.truncate()
+                while written < length:
+                    block = stream.read(min(cls.BLOCK_SIZE, length - written))
+                    if not block:
+                        break
+                    staging.write(block)
+                    written += len(block)
+
+            session.offset = offset + written
+            UploadSession.objects.filter(pk=session.pk).update(offset=session.offset, updated_at=timezone.now())
+        return session.offset
+
+    @classmethod
+    def finalize(cls, session):
+        """Move the complete staging file into storage and create its Attachment."""
+        from chat.models import Attachment
+
+        with cls.lock(session):
+            session.refresh_from_db(fields=['offset'])
+            if session.offset != session.file_size:
+                raise OffsetMismatch(session.offset)
+
+            path = cls.staging_path(session)
+            with open(path, 'rb') as staging:
+                header = staging.read(16)
+            if not MediaHandler.matches_signature(header, session.mime_type):
+                cls.discard(session)
+                raise UploadError('File content does not match declared type')
+
+            category = MediaHandler.get_category(session.mime_type)
+            attachment = Attachment(
+                message_id=session.message_id,
+                file_name=session.file_name,
+                file_type=cls.FILE_TYPES.get(category, 'other'),
+                file_size=session.file_size,
+                mime_type=session.mime_type,
+            )
+            name = Attachment._meta.get_field('file').generate_filename(attachment, session.file_name)
+            storage = attachment.file.storage
+            with open(path, 'rb') as staging:
+                attachment.file.name = storage.save(name, StagedFile(staging))
+
+            try:
+                with transaction.atomic():
+                    attachment.save()
+                    session.delete()
+            except Exception:
+                storage.delete(attachment.file.name)
+                raise
+        cls._remove_staging(path)
+        return attachment
+
+    @classmethod
+    def discard(cls, session) -> None:
+        """Abort a session and remove its staging file."""
+        path = cls.staging_path(session)
+        session.delete()
+        cls._remove_staging(path)
+
+    @classmethod
+    def cleanup_stale(cls, now=None) -> int:
+        """Discard sessions with no chunk for SESSION_TTL; returns how many were removed."""
+        from chat.models import UploadSession
+
+        cutoff = (now or timezone.now()) - cls.SESSION_TTL
+        stale = list(UploadSession.objects.filter(updated_at__lt=cutoff))
+        for session in stale:
+            cls.discard(session)
+        return len(stale)
+
+    @classmethod
+    def lock(cls, session):
+        return _SessionLock(cls.LOCK_KEY.format(session_id=session.id), cls.LOCK_TIMEOUT)
+
+    @staticmethod
+    def _remove_staging(path) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class _SessionLock:
+    """Cache lock so one request at a time writes to a session."""
+
+    def __init__(self, key, timeout):
+        self.key = key
+        self.timeout = timeout
+
+    def __enter__(self):
+        if not cache.add(self.key, True, self.timeout):
+            raise UploadBusy('Another chunk for this upload is in progress')
+        return self
+
+    def __exit__(self, *exc_info):
+        cache.delete(self.key)
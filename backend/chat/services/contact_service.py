@@ -0,0 +1,110 @@
+"""
+Contact graph used for presence and status fan-out.
+
+For each user the cache holds the ids of everyone they share a conversation
+or an active group membership with, the partners of their one-to-one
+conversations, and the groups they belong to. Entries are built with a fixed
+number of queries on first use and invalidated by the membership signals in
+``chat.signals``, so WebSocket connects and disconnects never have to walk
+the user's conversation history.
+"""
+import logging
+from typing import Dict, Iterable, Set
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class ContactService:
+    """
+    Service for resolving which users should see each other's presence.
+    """
+
+    CACHE_TIMEOUT = 60 * 60 * 24  # kept fresh by membership signals
+    CACHE_KEY = 'contact_graph:{user_id}'
+
+    @classmethod
+    def cache_key(cls, user_id: int) -> str:
+        return cls.CACHE_KEY.format(user_id=user_id)
+
+    @classmethod
+    def get_graph(cls, user_id: int) -> Dict[str, Set]:
+        """
+        Return ``{'contacts': ..., 'direct': ..., 'groups': ...}`` for a user.
+
+        ``contacts`` is everyone sharing a conversation or group with the user,
+        ``direct`` the partners of their individual conversations and
+        ``groups`` the ids of their active groups.
+        """
+        key = cls.cache_key(user_id)
+        graph = cache.get(key)
+        if graph is None:
+            graph = cls.compute_graph(user_id)
+            cache.set(key, graph, cls.CACHE_TIMEOUT)
+        return graph
+
+    @classmethod
+    def get_contact_ids(cls, user_id: int) -> Set[int]:
+        """Return ids of users sharing a conversation or group with the user."""
+        return set(cls.get_graph(user_id)['contacts'])
+
+    @classmethod
+    def compute_graph(cls, user_id: int) -> Dict[str, Set]:
+        """Build a user's graph entry from ConversationParticipant and GroupMember."""
+        from chat.models import Conversation, ConversationParticipant, GroupMember
+
+        contacts, direct, groups = set(), set(), set()
+
+        conversation_ids = ConversationParticipant.objects.filter(
+            user_id=user_id,
+            conversation__is_deleted=False
+        ).values('conversation_id')
+        participants = ConversationParticipant.objects.filter(
+            conversation_id__in=conversation_ids
+        ).values_list('user_id', 'conversation__conversation_type')
+        for participant_id, conversation_type in participants:
+            contacts.add(participant_id)
+            if conversation_type == Conversation.ConversationType.INDIVIDUAL:
+                direct.add(participant_id)
+
+        group_ids = GroupMember.objects.filter(
+            user_id=user_id,
+            status=GroupMember.MemberStatus.ACTIVE,
+            group__is_deleted=False
+        ).values('group_id')
+        members = GroupMember.objects.filter(
+            group_id__in=group_ids,
+            status=GroupMember.MemberStatus.ACTIVE
+        ).values_list('user_id', 'group_id')
+        for member_id, group_id in members:
+            contacts.add(member_id)
+            groups.add(str(group_id))
+
+        contacts.discard(user_id)
+        direct.discard(user_id)
+        return {'contacts': contacts, 'direct': direct, 'groups': groups}
+
+    @classmethod
+    def invalidate(cls, user_ids: Iterable[int]) -> None:
+        """Drop cached graph entries after membership changes."""
+        keys = [cls.cache_key(user_id) for user_id in set(user_ids)]
+        if keys:
+            cache.delete_many(keys)
+
+    @classmethod
+    def invalidate_conversation(cls, conversation_id) -> None:
+        """Drop graph entries for every participant of a conversation."""
+        from chat.models import ConversationParticipant
+
+        cls.invalidate(ConversationParticipant.objects.filter(
+            conversation_id=conversation_id
+        ).values_list('user_id', flat=True))
+
+    @classmethod
+    def invalidate_group(cls, group_id) -> None:
+        """Drop graph entries for every member of a group."""
+        from chat.models import GroupMember
+
+        cls.invalidate(GroupMember.objects.filter(
+            group_id=group_id
+        ).values_list('user_id', flat=True))
@@ -0,0 +1,275 @@
+"""
+Denormalized conversation inbox.
+
+The sidebar is rendered from ``InboxEntry`` rows (one per user and visible
+conversation) joined to the conversation's stored projection: last-message
+snippet, message count and a bounded participant summary. The projection is
+maintained when messages are inserted, edited or deleted and when
+memberships change, so listing conversations never has to count messages,
+walk members or write anything.
+
+Read state is a per-entry watermark (``last_read_seq``) plus an unread
+counter that is bumped in bulk on send, lowered for members who had not
+read a message when it is deleted, and reset or recounted when the
+watermark moves.
+"""
+import logging
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class InboxService:
+    """
+    Service maintaining inbox entries and the per-conversation projection.
+    """
+
+    PREVIEW_LENGTH = 200
+    SUMMARY_MEMBERS = 50  # participants included in participant_summary
+
+    @staticmethod
+    def message_summary(message) -> dict:
+        sender = message.sender
+        return {
+            'id': str(message.id),
+            'sender_id': message.sender_id,
+            'sender': sender.username if sender else None,
+            'content': message.content[:InboxService.PREVIEW_LENGTH],
+            'message_type': message.message_type,
+            'timestamp': message.timestamp.isoformat() if message.timestamp else None,
+            'seq': message.seq,
+        }
+
+    # Messages
+
+    @classmethod
+    def record_messages(cls, messages: List) -> None:
+        """
+        Apply newly inserted messages to the projection and the inbox entries.
+
+        Runs one set of bulk updates per conversation in the batch; call it in
+        the transaction that inserted the messages.
+        """
+        from chat.models import Conversation, InboxEntry
+
+        by_conversation = {}
+        for message in messages:
+            by_conversation.setdefault(message.conversation_id, []).append(message)
+
+        for conversation_id, batch in by_conversation.items():
+            latest = max(batch, key=lambda message: (message.seq or 0, message.timestamp))
+            last_message_at = latest.timestamp or timezone.now()
+            Conversation.objects.filter(pk=conversation_id).update(
+                message_count=F('message_count') + len(batch),
+                last_message_summary=cls.message_summary(latest),
+                last_message_at=last_message_at,
+                conversation_status=Conversation.ConversationStatus.ACTIVE,
+            )
+
+            entries = InboxEntry.objects.filter(conversation_id=conversation_id)
+            entries.update(last_activity_at=last_message_at)
+            # Every member's unread count grows by the messages others sent
+            sent = Counter(message.sender_id for message in batch)
+            entries.exclude(user_id__in=sent).update(unread_count=F('unread_count') + len(batch))
+            for sender_id, count in sent.items():
+                if count < len(batch):
+                    entries.filter(user_id=sender_id).update(
+                        unread_count=F('unread_count') + len(batch) - count
+                    )
+
+    @classmethod
+    def message_changed(cls, message, update_fields=None) -> None:
+        """Apply an edit, delete or restore of an existing message."""
+        from chat.models import Conversation
+
+        conversation_id = message.conversation_id
+        if update_fields is None:
+            cls.refresh_messages(conversation_id)
+            return
+
+        if 'is_deleted' in update_fields:
+            delta = -1 if message.is_deleted else 1
+            Conversation.objects.filter(pk=conversation_id).update(
+                message_count=F('message_count') + delta
+            )
+            cls.adjust_unread(message, delta)
+            cls.refresh_last_message(conversation_id)
+        elif 'content' in update_fields:
+            summary = Conversation.objects.filter(pk=conversation_id).values_list(
+                'last_message_summary', flat=True
+            ).first()
+            if summary and summary.get('id') == str(message.id):
+                Conversation.objects.filter(pk=conversation_id).update(
+                    last_message_summary=cls.message_summary(message)
+                )
+
+    @classmethod
+    def adjust_unread(cls, message, delta: int) -> None:
+        """Move the unread count of members who have not read ``message`` by ``delta``."""
+        from chat.models import InboxEntry
+
+        if message.seq is None:
+            return
+        entries = InboxEntry.objects.filter(
+            conversation_id=message.conversation_id, last_read_seq__lt=message.seq
+        ).exclude(user_id=message.sender_id)
+        if delta < 0:
+            entries = entries.filter(unread_count__gt=0)
+        entries.update(unread_count=F('unread_count') + delta)
+
+    @classmethod
+    def refresh_last_message(cls, conversation_id) -> None:
+        from chat.models import Conversation, Message
+
+        latest = Message.objects.filter(
+            conversation_id=conversation_id, is_deleted=False
+        ).select_related('sender').order_by('-timestamp').first()
+        Conversation.objects.filter(pk=conversation_id).update(
+            last_message_summary=cls.message_summary(latest) if latest else None
+        )
+
+    @classmethod
+    def refresh_messages(cls, conversation_id) -> None:
+        """Recompute message count and last message from the messages table."""
+        from chat.models import Conversation, Message
+
+        count = Message.objects.filter(conversation_id=conversation_id, is_deleted=False).count()
+        Conversation.objects.filter(pk=conversation_id).update(message_count=count)
+        cls.refresh_last_message(conversation_id)
+
+    # Membership
+
+    @classmethod
+    def member_ids(cls, conversation) -> List[int]:
+        from chat.models import ConversationParticipant, GroupMember
+
+        if conversation.group_id:
+            return list(GroupMember.objects.filter(
+                group_id=conversation.group_id, status=GroupMember.MemberStatus.ACTIVE
+            ).values_list('user_id', flat=True))
+        return list(ConversationParticipant.objects.filter(
+            conversation_id=conversation.pk
+        ).values_list('user_id', flat=True))
+
+    @classmethod
+    def add_members(cls, conversation, user_ids: Iterable[int]) -> None:
+        """Create inbox entries for users who can now see the conversation."""
+        from chat.models import InboxEntry
+
+        last_activity_at = conversation.last_message_at or conversation.created_at or timezone.now()
+        InboxEntry.objects.bulk_create([
+            # New members start with the existing history marked read
+            InboxEntry(user_id=user_id, conversation_id=conversation.pk,
+                       last_activity_at=last_activity_at, last_read_seq=conversation.last_seq)
+            for user_id in set(user_ids)
+        ], ignore_conflicts=True)
+        cls.refresh_participants(conversation)
+
+    @classmethod
+    def remove_members(cls, conversation, user_ids: Iterable[int]) -> None:
+        from chat.models import InboxEntry
+
+        InboxEntry.objects.filter(conversation_id=conversation.pk, user_id__in=set(user_ids)).delete()
+        cls.refresh_participants(conversation)
+
+    @classmethod
+    def refresh_participants(cls, conversation) -> None:
+        """Store the participant count and the first SUMMARY_MEMBERS participants."""
+        from django.contrib.auth import get_user_model
+        from chat.models import Conversation
+
+        user_ids = cls.member_ids(conversation)
+        users = get_user_model().objects.filter(id__in=user_ids[:cls.SUMMARY_MEMBERS]).only(
+            'id', 'username', 'first_name', 'email', 'avatar', 'status', 'is_active'
+        )
+        members = [
+            {
+                'id': str(user.id),
+                'username': user.username or user.first_name or user.email.split('@')[0] or 'Unknown',
+                'email': user.email,
+                'avatar': user.avatar.url if user.avatar else None,
+                'status': user.status,
+                'display_status': 'inactive' if not user.is_active else user.status,
+                'is_active': user.is_active,
+            }
+            for user in users
+        ]
+        Conversation.objects.filter(pk=conversation.pk).update(
+            participant_summary={'count': len(user_ids), 'members': members},
+            updated_at=timezone.now(),  # moves the inbox ETag
+        )
+
+    @classmethod
+    def group_joined(cls, group_id, user_id, active: bool) -> None:
+        from chat.models import Conversation
+
+        conversation = Conversation.objects.filter(group_id=group_id).first()
+        if conversation is None:
+            return
+        if active:
+            cls.add_members(conversation, [user_id])
+        else:
+            cls.remove_members(conversation, [user_id])
+
+    # Read state
+
+    @classmethod
+    def mark_read(cls, user_id: int, watermarks: Dict[str, Optional[int]]) -> int:
+        """
+        Advance read watermarks for ``{conversation_id: seq}``.
+
+        ``None`` marks everything up to the latest message read in a single
+        UPDATE for all such conversations; an explicit seq recounts unread
+        messages above it with a range count. Watermarks never move back.
+        Returns the number of inbox entries updated.
+        """
+        from chat.models import Conversation, InboxEntry, Message
+
+        now = timezone.now()
+        entries = InboxEntry.objects.filter(user_id=user_id)
+        updated = 0
+
+        to_latest = [conversation_id for conversation_id, seq in watermarks.items() if seq is None]
+        if to_latest:
+            updated += entries.filter(conversation_id__in=to_latest).update(
+                last_read_seq=Subquery(
+                    Conversation.objects.filter(pk=OuterRef('conversation_id')).values('last_seq')[:1]
+                ),
+                last_read_at=now,
+                unread_count=0,
+            )
+
+        for conversation_id, seq in watermarks.items():
+            if seq is None:
+                continue
+            unread = Message.objects.filter(
+                conversation_id=conversation_id, seq__gt=seq, is_deleted=False
+            ).exclude(sender_id=user_id).count()
+            updated += entries.filter(conversation_id=conversation_id, last_read_seq__lt=seq).update(
+                last_read_seq=seq, last_read_at=now, unread_count=unread
+            )
+        return updated
+
+    @classmethod
+    def total_unread(cls, user_id: int) -> int:
+        """Unread messages across all of a user's conversations, in one query."""
+        from chat.models import InboxEntry
+
+        return InboxEntry.objects.filter(
+            user_id=user_id, conversation__is_deleted=False
+        ).aggregate(total=Sum('unread_count'))['total'] or 0
+
+    # Rebuild
+
+    @classmethod
+    def rebuild(cls, conversation) -> None:
+        """Recreate a conversation's projection and entries from scratch."""
+        from chat.models import InboxEntry
+
+        user_ids = cls.member_ids(conversation)
+        InboxEntry.objects.filter(conversation_id=conversation.pk).exclude(user_id__in=user_ids).delete()
+        cls.add_members(conversation, user_ids)
+        cls.refresh_messages(conversation.pk)
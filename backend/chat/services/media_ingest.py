@@ -0,0 +1,242 @@
+"""
+Single-pass media ingest.
+
+An upload is read exactly once. Each chunk goes through a chain of
+incremental processors and is then written to a temporary file next to its
+final storage path:
+
+- ``SizeLimit`` stops the upload as soon as it passes the category limit;
+- ``SignatureCheck`` compares the first bytes with the declared type;
+- ``Sha256`` hashes the stream;
+- ``ImageProbe`` feeds image headers to Pillow's incremental parser until
+  the dimensions are known (optional, images only).
+
+On success the temporary file is renamed over a reserved final name, so the
+stored file appears complete or not at all. On failure nothing is left in
+storage. The old path (copy to a NamedTemporaryFile, re-read for the magic
+number, re-read for the hash, copy again into storage) read and wrote the
+upload three to four times; ``manage.py benchmark_media_ingest`` compares
+the two.
+
+Storages that are not on the local filesystem get the same processors
+around ``storage.save``, which streams the file once as well.
+"""
+import hashlib
+import logging
+import os
+import uuid
+from typing import Dict, Iterable, List
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from chat.media_handler import MediaCategory, MediaHandler
+
+try:
+    from PIL import ImageFile
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+    ImageFile = None
+
+logger = logging.getLogger(__name__)
+
+
+class IngestError(Exception):
+    """An upload rejected while it was being read."""
+    pass
+
+
+class Sha256:
+    def __init__(self):
+        self.digest = hashlib.sha256()
+
+    def feed(self, chunk: bytes) -> None:
+        self.digest.update(chunk)
+
+    def result(self) -> Dict:
+        return {'hash': self.digest.hexdigest()}
+
+
+class SizeLimit:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+
+    def feed(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            raise IngestError(f'File size exceeds limit of {self.max_size / (1024 * 1024)}MB')
+
+    def result(self) -> Dict:
+        return {'size': self.size}
+
+
+class SignatureCheck:
+    HEADER_SIZE = 16
+
+    def __init__(self, mime_type: str):
+        self.mime_type = mime_type
+        self.header = b''
+        self.checked = False
+
+    def feed(self, chunk: bytes) -> None:
+        if self.checked:
+            return
+        self.header += chunk[:self.HEADER_SIZE - len(self.header)]
+        if len(self.header) >= self.HEADER_SIZE:
+            self.check()
+
+    def check(self) -> None:
+        self.checked = True
+        if not MediaHandler.matches_signature(self.header, self.mime_type):
+            raise IngestError('File content does not match declared type')
+
+    def result(self) -> Dict:
+        if not self.checked:
+            # Files shorter than the header
+            self.check()
+        return {}
+
+
+class ImageProbe:
+    """Image dimensions from the first bytes; stops parsing once they are known."""
+
+    MAX_PROBE_BYTES = 1024 * 1024
+
+    def __init__(self):
+        self.parser = ImageFile.Parser()
+        self.size = None
+        self.fed = 0
+
+    def feed(self, chunk: bytes) -> None:
+        if self.size is not None or self.fed >= self.MAX_PROBE_BYTES:
+            return
+        self.fed += len(chunk)
+        try:
+            self.parser.feed(chunk)
+        except Exception:
+            # Not an image Pillow can read; dimensions stay unknown
+            self.fed = self.MAX_PROBE_BYTES
+            return
+        if self.parser.image is not None:
+            self.size = self.parser.image.size
+
+    def result(self) -> Dict:
+        if self.size is None:
+            return {}
+        return {'width': self.size[0], 'height': self.size[1]}
+
+
+class _ProcessedFile(File):
+    """File whose chunks pass through the processors as storage reads them."""
+
+    def __init__(self, file, processors):
+        super().__init__(file, getattr(file, 'name', None))
+        self.processors = processors
+
+    def chunks(self, chunk_size=None):
+        for chunk in self.file.chunks(chunk_size):
+            for processor in self.processors:
+                processor.feed(chunk)
+            yield chunk
+
+
+class MediaIngest:
+    """
+    Service streaming an upload once through processors into storage.
+    """
+
+    @classmethod
+    def processors_for(cls, mime_type: str, probe_images: bool = True) -> List:
+        category = MediaHandler.get_category(mime_type)
+        max_size = MediaHandler.DEFAULT_LIMITS.get(category, MediaHandler.DEFAULT_LIMITS[MediaCategory.OTHER])
+        processors = [SizeLimit(max_size), SignatureCheck(mime_type), Sha256()]
+        if probe_images and PIL_AVAILABLE and category == MediaCategory.IMAGE:
+            processors.append(ImageProbe())
+        return processors
+
+    @classmethod
+    def ingest(cls, upload, name: str, storage, processors: Iterable) -> Dict:
+        """
+        Store ``upload`` (an UploadedFile) under ``name`` in ``storage`` in
+        one pass. Returns the stored name merged with the processors'
+        results; raises IngestError (leaving nothing stored) on rejection.
+        """
+        processors = list(processors)
+        if isinstance(storage, FileSystemStorage):
+            stored_name = cls._write_local(upload, name, storage, processors)
+        else:
+            processed = _ProcessedFile(upload, processors)
+            stored_name = storage.save(name, processed)
+            try:
+                results = cls._results(processors)
+            except IngestError:
+                storage.delete(stored_name)
+                raise
+            return {'name': stored_name, **results}
+        return {'name': stored_name, **cls._results(processors)}
+
+    @staticmethod
+    def _results(processors) -> Dict:
+        results = {}
+        for processor in processors:
+            results.update(processor.result())
+        return results
+
+    @classmethod
+    def _write_local(cls, upload, name: str, storage: FileSystemStorage, processors) -> str:
+        name = storage.get_available_name(name)
+        final_path = storage.path(name)
+        directory = os.path.dirname(final_path)
+        os.makedirs(directory, exist_ok=True)
+        if storage.directory_permissions_mode is not None:
+            os.chmod(directory, storage.directory_permissions_mode)
+
+        # Reserve the final name, as FileSystemStorage._save does
+        while True:
+            try:
+                os.close(os.open(final_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+                break
+            except FileExistsError:
+                name = storage.get_available_name(name)
+                final_path = storage.path(name)
+
+        partial_path = os.path.join(directory, f'.{uuid.uuid4().hex}.partial')
+        try:
+            with open(partial_path, 'wb') as partial:
+                for chunk in upload.chunks():
+                    for processor in processors:
+                        processor.feed(chunk)
+                    partial.write(chunk)
+            # Raises for files shorter than any incremental check needed
+            cls._results(processors)
+            if storage.file_permissions_mode is not None:
+                os.chmod(partial_path, storage.file_permissions_mode)
+            os.replace(partial_path, final_path)
+        except BaseException:
+            for path in (partial_path, final_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            raise
+        return name.replace('\\', '/')
+
+    @staticmethod
+    def file_info(upload, mime_type: str, result: Dict) -> Dict:
+        """The ``MediaHandler.get_file_info`` fields, from the ingest results."""
+        category = MediaHandler.get_category(mime_type)
+        info = {
+            'path': result['name'],
+            'name': os.path.basename(result['name']),
+            'extension': MediaHandler.get_file_extension(upload.name),
+            'mime_type': mime_type,
+            'category': category.value,
+            'size': result['size'],
+            'size_mb': round(result['size'] / (1024 * 1024), 2),
+            'hash': result['hash'],
+            'icon': MediaHandler.get_category_icon(category),
+            'is_supported': MediaHandler.is_supported(mime_type),
+        }
+        if 'width' in result:
+            info['width'], info['height'] = result['width'], result['height']
+        return info
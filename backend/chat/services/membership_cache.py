@@ -0,0 +1,91 @@
+"""
+Cached membership lookups for permission checks.
+
+For each user the cache holds the ids of the conversations they participate
+in and their role and status in every group they have joined. Each entry is
+built with two queries on first use and invalidated by the membership signals
+in ``chat.signals``, so ``Conversation.is_participant``, ``Group.is_member``,
+``Group.get_member_role`` and ``Group.can_manage`` cost no queries once the
+user's entry is warm.
+"""
+import logging
+from typing import Dict, Iterable, Optional
+from django.core.cache import cache
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+
+class MembershipCache:
+    """
+    Service answering "is this user in that conversation/group" from the cache.
+    """
+
+    CACHE_TIMEOUT = 60 * 60 * 24  # kept fresh by membership signals
+    CACHE_KEY = 'membership:{user_id}'
+
+    @classmethod
+    def cache_key(cls, user_id: int) -> str:
+        return cls.CACHE_KEY.format(user_id=user_id)
+
+    @classmethod
+    def get(cls, user_id: int) -> Dict:
+        """
+        Return ``{'conversations': ..., 'groups': ...}`` for a user.
+
+        ``conversations`` is the set of conversation ids the user participates
+        in directly and ``groups`` maps group ids to ``(role, status)``.
+        """
+        key = cls.cache_key(user_id)
+        entry = cache.get(key)
+        if entry is None:
+            entry = cls.compute(user_id)
+            cache.set(key, entry, cls.CACHE_TIMEOUT)
+        return entry
+
+    @classmethod
+    def compute(cls, user_id: int) -> Dict:
+        from chat.models import ConversationParticipant, GroupMember
+
+        conversations = {
+            str(conversation_id) for conversation_id in ConversationParticipant.objects.filter(
+                user_id=user_id
+            ).values_list('conversation_id', flat=True)
+        }
+        groups = {
+            str(group_id): (role, status) for group_id, role, status in GroupMember.objects.filter(
+                user_id=user_id
+            ).values_list('group_id', 'role', 'status')
+        }
+        return {'conversations': conversations, 'groups': groups}
+
+    @classmethod
+    def invalidate(cls, user_ids: Iterable[int]) -> None:
+        """
+        Drop cached entries now and again when the transaction commits, so a
+        concurrent request cannot re-cache membership that is about to change.
+        """
+        keys = [cls.cache_key(user_id) for user_id in set(user_ids)]
+        if not keys:
+            return
+        cache.delete_many(keys)
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+    # Lookups
+
+    @classmethod
+    def is_participant(cls, user_id: int, conversation_id) -> bool:
+        return str(conversation_id) in cls.get(user_id)['conversations']
+
+    @classmethod
+    def member_role(cls, user_id: int, group_id) -> Optional[str]:
+        """Role in the group whatever the membership status, like ``Group.get_member_role``."""
+        membership = cls.get(user_id)['groups'].get(str(group_id))
+        return membership[0] if membership else None
+
+    @classmethod
+    def is_member(cls, user_id: int, group_id) -> bool:
+        from chat.models import GroupMember
+
+        membership = cls.get(user_id)['groups'].get(str(group_id))
+        return membership is not None and membership[1] == GroupMember.MemberStatus.ACTIVE
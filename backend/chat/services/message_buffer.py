@@ -0,0 +1,140 @@
+"""
+Write buffer batching WebSocket message inserts.
+
+Consumers build ``Message`` instances with their UUID already set and hand
+them to the buffer. Messages submitted within FLUSH_DELAY of each other are
+written with a single ``bulk_create`` in one transaction, which also reserves
+their per-conversation sequence numbers; batches are written one after
+another in submission order, so per-conversation ordering is preserved. Each
+submission returns a future that resolves once its row is committed (or
+fails), which the consumer turns into a broadcast plus ``ack``, or a
+``nack``.
+"""
+import asyncio
+import logging
+import weakref
+from typing import List
+from channels.db import database_sync_to_async
+from django.db import transaction
+from django.db.models.signals import post_save
+
+from chat.models import Conversation, Message
+from chat.services.inbox_service import InboxService
+from chat.services.message_search import MessageSearch
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriteBuffer:
+    """
+    Per-process (per event loop) buffer for message inserts.
+    """
+
+    FLUSH_DELAY = 0.005  # seconds to wait for more messages before writing
+    MAX_BATCH_SIZE = 200
+
+    _buffers = weakref.WeakKeyDictionary()
+
+    def __init__(self):
+        self.pending = []
+        self.drain_task = None
+
+    @classmethod
+    def get(cls) -> 'MessageWriteBuffer':
+        """Return the buffer for the running event loop."""
+        loop = asyncio.get_running_loop()
+        buffer = cls._buffers.get(loop)
+        if buffer is None:
+            buffer = cls._buffers[loop] = cls()
+        return buffer
+
+    def submit(self, message: Message) -> asyncio.Future:
+        """Queue a message for insert; the future resolves to the saved message."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((message, future))
+        if self.drain_task is None or self.drain_task.done():
+            self.drain_task = loop.create_task(self.drain())
+        return future
+
+    async def drain(self):
+        await asyncio.sleep(self.FLUSH_DELAY)
+        while self.pending:
+            batch = self.pending[:self.MAX_BATCH_SIZE]
+            self.pending = self.pending[self.MAX_BATCH_SIZE:]
+            try:
+                failed = await database_sync_to_async(self.write)([message for message, _ in batch])
+            except Exception as e:
+                logger.error(f"Error writing message batch: {str(e)}")
+                failed = {message.id: e for message, _ in batch}
+
+            for message, future in batch:
+                if future.done():
+                    continue
+                if message.id in failed:
+                    future.set_exception(failed[message.id])
+                else:
+                    future.set_result(message)
+
+    @staticmethod
+    def assign_seq(messages: List[Message]) -> None:
+        """Reserve one block of sequence numbers per conversation in the batch."""
+        by_conversation = {}
+        for message in messages:
+            by_conversation.setdefault(message.conversation_id, []).append(message)
+
+        # Lock conversation rows in a stable order so concurrent batches cannot deadlock
+        for conversation_id in sorted(by_conversation, key=str):
+            batch = by_conversation[conversation_id]
+            last_seq = Conversation.allocate_seq(conversation_id, len(batch))
+            for seq, message in enumerate(batch, start=last_seq - len(batch) + 1):
+                message.seq = message.updated_seq = seq
+
+    @staticmethod
+    def record(messages: List[Message]) -> None:
+        """Update the inbox projection and search index for a stored batch."""
+        InboxService.record_messages(messages)
+        MessageSearch.index(messages)
+
+    @classmethod
+    def write(cls, messages: List[Message]) -> dict:
+        """
+        Insert a batch of messages, update the inbox projection and search
+        index, and send ``post_save`` for each.
+
+        If the batch insert fails the messages are retried one by one so a
+        single bad row only fails itself. Returns ``{message_id: exception}``
+        for the messages that could not be stored.
+        """
+        failed = {}
+        try:
+            with transaction.atomic():
+                cls.assign_seq(messages)
+                Message.objects.bulk_create(messages)
+                cls.record(messages)
+            stored = messages
+        except Exception as e:
+            logger.warning(f"Batch insert of {len(messages)} messages failed, retrying individually: {str(e)}")
+            stored = []
+            for message in messages:
+                try:
+                    with transaction.atomic():
+                        cls.assign_seq([message])
+                        Message.objects.bulk_create([message])
+                        cls.record([message])
+                    stored.append(message)
+                except Exception as row_error:
+                    failed[message.id] = row_error
+
+        # bulk_create skips model signals; receivers such as the admin
+        # activity notifier still expect one post_save per new message.
+        for message in stored:
+            message._batch_recorded = True
+            try:
+                post_save.send(
+                    sender=Message, instance=message, created=True,
+                    update_fields=None, raw=False, using=message._state.db
+                )
+            except Exception as e:
+                logger.error(f"Error in post_save receivers for message {message.id}: {str(e)}")
+        return failed
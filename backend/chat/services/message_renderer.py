@@ -0,0 +1,159 @@
+"""
+Lean read path for message lists.
+
+``MessageSerializer`` walks model instances: a related lookup per sender,
+reply and forward target, and a nested serializer with several method fields
+and a ``build_absolute_uri`` call per attachment. ``MessageRenderer`` builds
+the same JSON from two ``values()`` queries (the messages with their senders
+and reply/forward targets joined in, then their attachments) and resolves
+media URLs from a prefix computed once per response.
+
+``manage.py benchmark_message_rendering`` compares the two paths.
+"""
+import logging
+import uuid
+from typing import Callable, Dict, Iterable, List, Optional
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.utils.encoding import filepath_to_uri
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+# Formats exactly like the serializers' DateTimeFields
+_datetime = serializers.DateTimeField()
+
+
+def _describe(username, timestamp) -> Optional[str]:
+    """``str(Message)``, as rendered by StringRelatedField."""
+    if timestamp is None:
+        return None
+    return f"Message from {username} at {timestamp}"
+
+
+class MessageRenderer:
+    """
+    Render messages as ``MessageSerializer`` would, without model instances.
+    """
+
+    MESSAGE_FIELDS = (
+        'id', 'conversation_id', 'sender__username', 'content', 'message_type',
+        'reply_to__sender__username', 'reply_to__timestamp',
+        'forwarded_from__sender__username', 'forwarded_from__timestamp',
+        'is_edited', 'edited_at', 'is_deleted', 'deleted_at', 'timestamp', 'seq', 'updated_seq',
+    )
+    ATTACHMENT_FIELDS = (
+        'id', 'message_id', 'file', 'file_name', 'file_type', 'file_size', 'mime_type',
+        'duration', 'uploaded_at', 'thumbnail', 'width', 'height', 'bitrate', 'codec',
+    )
+
+    @classmethod
+    def values(cls, messages):
+        """Turn a Message queryset into the row queryset ``render`` expects."""
+        return messages.values(*cls.MESSAGE_FIELDS)
+
+    @staticmethod
+    def media_url(request=None) -> Callable[[str], str]:
+        """
+        Return ``name -> url`` matching ``FieldFile.url``, made absolute when
+        a request is given, as DRF's file fields do.
+        """
+        storage = default_storage
+        if isinstance(storage, FileSystemStorage):
+            prefix = storage.base_url
+            if request is not None:
+                prefix = request.build_absolute_uri(prefix)
+            return lambda name: prefix + filepath_to_uri(name).lstrip('/')
+        if request is not None:
+            return lambda name: request.build_absolute_uri(storage.url(name))
+        return storage.url
+
+    @classmethod
+    def render(cls, rows: Iterable[Dict], request=None) -> List[Dict]:
+        """Render message rows from ``values()``; fetches their attachments in one query."""
+        from chat.models import Attachment
+
+        rows = list(rows)
+        if not rows:
+            return []
+        datetime = _datetime.to_representation
+        url = cls.media_url(request)
+
+        attachments = {row['id']: [] for row in rows}
+        descriptions = {row['id']: _describe(row['sender__username'], row['timestamp']) for row in rows}
+        for attachment in Attachment.objects.filter(message_id__in=list(attachments)).order_by(
+            '-uploaded_at'
+        ).values(*cls.ATTACHMENT_FIELDS):
+            file_type = attachment['file_type']
+            file_url = url(attachment['file']) if attachment['file'] else None
+            thumbnail_url = url(attachment['thumbnail']) if attachment['thumbnail'] else None
+            width, height, duration = attachment['width'], attachment['height'], attachment['duration']
+            is_video = file_type == Attachment.FileType.VIDEO
+            attachments[attachment['message_id']].append({
+                'id': str(attachment['id']),
+                'message': descriptions[attachment['message_id']],
+                'file': file_url,
+                'file_name': attachment['file_name'],
+                'file_type': file_type,
+                'file_size': attachment['file_size'],
+                'mime_type': attachment['mime_type'],
+                'duration': duration,
+                'uploaded_at': datetime(attachment['uploaded_at']),
+                'file_size_mb': round(attachment['file_size'] / (1024 * 1024), 2),
+                'is_image': file_type == Attachment.FileType.IMAGE,
+                'is_audio': file_type == Attachment.FileType.AUDIO,
+                'is_video': is_video,
+                'is_document': file_type == Attachment.FileType.DOCUMENT,
+                'url': file_url,
+                'thumbnail': thumbnail_url,
+                'thumbnail_url': thumbnail_url,
+                'width': width,
+                'height': height,
+                'bitrate': attachment['bitrate'],
+                'codec': attachment['codec'],
+                'video_dimensions': (width, height) if is_video and width and height else None,
+                'duration_formatted': f"{duration // 60}:{duration % 60:02d}" if duration else None,
+            })
+
+        return [
+            {
+                'id': str(row['id']),
+                'conversation': row['conversation_id'],
+                'sender': row['sender__username'],
+                'content': row['content'],
+                'message_type': row['message_type'],
+                'reply_to': _describe(row['reply_to__sender__username'], row['reply_to__timestamp']),
+                'forwarded_from': _describe(
+                    row['forwarded_from__sender__username'], row['forwarded_from__timestamp']
+                ),
+                'is_edited': row['is_edited'],
+                'edited_at': datetime(row['edited_at']),
+                'is_deleted': row['is_deleted'],
+                'deleted_at': datetime(row['deleted_at']),
+                'timestamp': datetime(row['timestamp']),
+                'seq': row['seq'],
+                'updated_seq': row['updated_seq'],
+                'attachments': attachments[row['id']],
+            }
+            for row in rows
+        ]
+
+    @classmethod
+    def render_ids(cls, message_ids: Iterable, request=None) -> List[Dict]:
+        """Render messages by id, in the given order, skipping missing ones."""
+        from chat.models import Message
+
+        message_ids = [uuid.UUID(str(message_id)) for message_id in message_ids]
+        rows = {row['id']: row for row in cls.values(Message.objects.filter(id__in=message_ids))}
+        return cls.render([rows[message_id] for message_id in message_ids if message_id in rows], request)
+
+    @classmethod
+    def render_last_messages(cls, conversations: Iterable, request=None) -> Dict[str, Dict]:
+        """
+        Render the stored last message of each conversation in one batch,
+        keyed by message id (``last_message_summary['id']``).
+        """
+        message_ids = [
+            conversation.last_message_summary['id']
+            for conversation in conversations if conversation.last_message_summary
+        ]
+        return {message['id']: message for message in cls.render_ids(message_ids, request)}
@@ -0,0 +1,266 @@
+"""
+Full-text search over message content.
+
+Search goes through a pluggable backend chosen by the
+``MESSAGE_SEARCH_BACKEND`` setting. ``SQLiteFTSSearchBackend`` keeps an FTS5
+index (``message_search``) whose rowids are the ids of
+``MessageSearchDocument`` rows, which map them back to the message and its
+conversation. Results are restricted to the caller's conversations by joining
+the documents to their inbox entries, ranked with bm25 and paginated with a
+``(rank, document id)`` cursor. ``DatabaseSearchBackend`` is a portable
+fallback for databases without FTS5.
+
+The index is updated incrementally when messages are created, edited, deleted
+or restored; ``manage.py rebuild_search_index`` rebuilds it in chunks.
+"""
+import base64
+import binascii
+import logging
+import re
+from typing import Iterable, List, Optional, Tuple
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class MessageSearchBackend:
+    """
+    Interface for message search backends.
+
+    ``search`` returns ``(message_ids, next_cursor)`` with ids in rank order.
+    """
+
+    def index(self, messages: Iterable) -> None:
+        raise NotImplementedError
+
+    def remove(self, message_ids: Iterable) -> None:
+        raise NotImplementedError
+
+    def search(self, user_id: int, query: str, limit: int = 50,
+               cursor: Optional[str] = None) -> Tuple[List, Optional[str]]:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    def rebuild(self, chunk_size: int = 1000, stdout=None) -> int:
+        """Re-index every visible message, ``chunk_size`` rows per transaction."""
+        from chat.models import Message
+
+        self.clear()
+        total = 0
+        last_pk = None
+        while True:
+            chunk = Message.objects.filter(is_deleted=False).order_by('pk').only(
+                'id', 'conversation_id', 'content', 'is_deleted'
+            )
+            if last_pk is not None:
+                chunk = chunk.filter(pk__gt=last_pk)
+            chunk = list(chunk[:chunk_size])
+            if not chunk:
+                return total
+            with transaction.atomic():
+                self.index(chunk)
+            total += len(chunk)
+            last_pk = chunk[-1].pk
+            if stdout is not None:
+                stdout.write(f'Indexed {total} messages')
+
+    @staticmethod
+    def encode_cursor(*values) -> str:
+        raw = '|'.join(str(value) for value in values)
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> List[str]:
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            return base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        except (binascii.Error, UnicodeDecodeError):
+            raise ValueError('Invalid cursor')
+
+
+class SQLiteFTSSearchBackend(MessageSearchBackend):
+    """SQLite FTS5 index, ranked by bm25."""
+
+    TABLE = 'message_search'
+
+    @staticmethod
+    def match_expression(query: str) -> str:
+        """Quote every token so user input cannot inject FTS5 syntax; the last one matches as a prefix."""
+        tokens = TOKEN_RE.findall(query)
+        if not tokens:
+            return ''
+        quoted = ['"%s"' % token.replace('"', '""') for token in tokens]
+        quoted[-1] += '*'
+        return ' '.join(quoted)
+
+    def index(self, messages: Iterable) -> None:
+        from chat.models import MessageSearchDocument
+
+        messages = [message for message in messages if not message.is_deleted]
+        if not messages:
+            return
+        self.remove([message.id for message in messages])
+        documents = MessageSearchDocument.objects.bulk_create([
+            MessageSearchDocument(message_id=message.id, conversation_id=message.conversation_id)
+            for message in messages
+        ])
+        if documents[0].pk is None:
+            # Backends that do not return primary keys from bulk_create
+            ids = dict(MessageSearchDocument.objects.filter(
+                message_id__in=[message.id for message in messages]
+            ).values_list('message_id', 'id'))
+            for document in documents:
+                document.pk = ids[document.message_id]
+        with connection.cursor() as cursor:
+            # REPLACE drops stale rows left behind by hard-deleted documents
+            cursor.executemany(
+                f'INSERT OR REPLACE INTO {self.TABLE}(rowid, content) VALUES (%s, %s)',
+                [(document.pk, message.content) for document, message in zip(documents, messages)]
+            )
+
+    def remove(self, message_ids: Iterable) -> None:
+        from chat.models import MessageSearchDocument
+
+        documents = MessageSearchDocument.objects.filter(message_id__in=list(message_ids))
+        rowids = list(documents.values_list('id', flat=True))
+        if not rowids:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.TABLE} WHERE rowid = %s', [(rowid,) for rowid in rowids])
+        documents.delete()
+
+    def search(self, user_id, query, limit=50, cursor=None):
+        from chat.models import MessageSearchDocument
+
+        expression = self.match_expression(query)
+        if not expression:
+            return [], None
+
+        documents = MessageSearchDocument._meta.db_table
+        sql = f"""
+            SELECT * FROM (
+                SELECT d.message_id, d.id, bm25({self.TABLE}) AS score
+                FROM {self.TABLE}
+                JOIN {documents} d ON d.id = {self.TABLE}.rowid
+                JOIN inbox_entries e ON e.conversation_id = d.conversation_id AND e.user_id = %s
+                WHERE {self.TABLE} MATCH %s
+            )
+        """
+        params = [user_id, expression]
+        if cursor:
+            score, document_id = self.decode_cursor(cursor)
+            sql += ' WHERE score > %s OR (score = %s AND id < %s)'
+            params += [float(score), float(score), int(document_id)]
+        sql += ' ORDER BY score, id DESC LIMIT %s'
+        params.append(limit + 1)
+
+        with connection.cursor() as db_cursor:
+            db_cursor.execute(sql, params)
+            rows = db_cursor.fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            _, document_id, score = rows[-1]
+            next_cursor = self.encode_cursor(repr(score), document_id)
+        return [message_id for message_id, _, _ in rows], next_cursor
+
+    def clear(self) -> None:
+        from chat.models import MessageSearchDocument
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.TABLE}')
+        MessageSearchDocument.objects.all().delete()
+
+
+class DatabaseSearchBackend(MessageSearchBackend):
+    """
+    Portable fallback without a separate index: unranked, newest first.
+    """
+
+    def index(self, messages):
+        pass
+
+    def remove(self, message_ids):
+        pass
+
+    def clear(self):
+        pass
+
+    def rebuild(self, chunk_size=1000, stdout=None):
+        return 0
+
+    def search(self, user_id, query, limit=50, cursor=None):
+        from django.db.models import Q
+        from chat.models import Message
+
+        messages = Message.objects.filter(
+            conversation__inbox_entries__user_id=user_id,
+            is_deleted=False,
+            content__icontains=query
+        )
+        if cursor:
+            timestamp, message_id = self.decode_cursor(cursor)
+            messages = messages.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id))
+        rows = list(messages.order_by('-timestamp', '-id').values_list('id', 'timestamp')[:limit + 1])
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            message_id, timestamp = rows[-1]
+            next_cursor = self.encode_cursor(timestamp.isoformat(), message_id)
+        return [message_id for message_id, _ in rows], next_cursor
+
+
+class MessageSearch:
+    """
+    Entry point used by views and signals; delegates to the configured backend.
+    """
+
+    DEFAULT_BACKEND = 'chat.services.message_search.SQLiteFTSSearchBackend'
+
+    _backend = None
+
+    @classmethod
+    def backend(cls) -> MessageSearchBackend:
+        if cls._backend is None:
+            path = getattr(settings, 'MESSAGE_SEARCH_BACKEND', cls.DEFAULT_BACKEND)
+            if path == cls.DEFAULT_BACKEND and connection.vendor != 'sqlite':
+                path = 'chat.services.message_search.DatabaseSearchBackend'
+            cls._backend = import_string(path)()
+        return cls._backend
+
+    @classmethod
+    def index(cls, messages) -> None:
+        """Index messages without ever failing the write that triggered it."""
+        try:
+            with transaction.atomic():
+                cls.backend().index(messages)
+        except Exception as e:
+            logger.error(f"Error indexing messages for search: {str(e)}")
+
+    @classmethod
+    def remove(cls, message_ids) -> None:
+        try:
+            with transaction.atomic():
+                cls.backend().remove(message_ids)
+        except Exception as e:
+            logger.error(f"Error removing messages from search index: {str(e)}")
+
+    @classmethod
+    def message_changed(cls, message, update_fields=None) -> None:
+        if message.is_deleted:
+            if update_fields is None or 'is_deleted' in update_fields:
+                cls.remove([message.id])
+        elif update_fields is None or {'content', 'is_deleted'} & set(update_fields):
+            cls.index([message])
+
+    @classmethod
+    def search(cls, user_id, query, limit=50, cursor=None):
+        return cls.backend().search(user_id, query, limit=limit, cursor=cursor)
@@ -0,0 +1,219 @@
+"""
+Transactional outbox for deferred side effects.
+
+Side effects that do not have to be visible before a request returns (user
+counters, activity rows, notifications) are written as compact
+``OutboxEvent`` rows in the same transaction as the change that caused them,
+so they commit or roll back with it. After the commit a worker drains the
+table in batches: events are grouped by kind and each handler applies a whole
+batch with bulk updates and ``bulk_create``.
+
+The worker is selected by the ``OUTBOX_WORKER`` setting: ``'thread'`` runs a
+daemon thread in the web process (development), ``'celery'`` queues
+``chat.tasks.drain_outbox`` and ``'sync'`` drains in the committing thread
+right after the commit (for single-writer databases such as in-memory
+SQLite). The beat schedule also drains periodically so events survive lost
+wake-ups and restarts.
+"""
+import logging
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, List
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Case, Exists, F, OuterRef, Value, When
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_SENT = 'message_sent'
+ADMIN_ACTIVITY = 'admin_activity'
+
+
+class Outbox:
+    """
+    Records side effects and applies them in batches.
+    """
+
+    BATCH_SIZE = 500
+    MAX_ATTEMPTS = 5
+    SCHEDULE_KEY = 'outbox:scheduled'
+    SCHEDULE_DEBOUNCE = 1  # seconds between queued Celery drains
+
+    HANDLERS = {
+        MESSAGE_SENT: 'chat.services.outbox.apply_message_sent',
+        ADMIN_ACTIVITY: 'users.admin_activity_notifier.deliver_admin_activity',
+    }
+
+    _wakeup = threading.Event()
+    _thread = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def record(cls, kind: str, payload: Dict) -> None:
+        """Write an event in the current transaction and wake the worker once it commits."""
+        from chat.models import OutboxEvent
+
+        OutboxEvent.objects.create(kind=kind, payload=payload)
+        transaction.on_commit(cls.schedule)
+
+    @classmethod
+    def schedule(cls) -> None:
+        worker = getattr(settings, 'OUTBOX_WORKER', 'thread')
+        if worker == 'celery':
+            # One queued drain per debounce window, however many events commit
+            if cache.add(cls.SCHEDULE_KEY, True, cls.SCHEDULE_DEBOUNCE):
+                from chat.tasks import drain_outbox
+                try:
+                    drain_outbox.delay()
+                except Exception as e:
+                    logger.warning(f"Could not queue outbox drain, beat will pick it up: {str(e)}")
+        elif worker == 'thread':
+            cls.ensure_thread()
+            cls._wakeup.set()
+        elif worker == 'sync':
+            cls.drain_all()
+
+    @classmethod
+    def ensure_thread(cls) -> None:
+        with cls._lock:
+            if cls._thread is None or not cls._thread.is_alive():
+                cls._thread = threading.Thread(target=cls._run_thread, name='outbox-worker', daemon=True)
+                cls._thread.start()
+
+    @classmethod
+    def _run_thread(cls) -> None:
+        while True:
+            cls._wakeup.wait()
+            cls._wakeup.clear()
+            try:
+                cls.drain_all()
+            except Exception as e:
+                logger.error(f"Outbox worker failed: {str(e)}", exc_info=True)
+            finally:
+                close_old_connections()
+
+    @classmethod
+    def drain_all(cls) -> int:
+        total = 0
+        while True:
+            drained = cls.drain()
+            total += drained
+            if drained < cls.BATCH_SIZE:
+                return total
+
+    @classmethod
+    def drain(cls, batch_size: int = None) -> int:
+        """
+        Apply and delete up to ``batch_size`` events, oldest first.
+
+        Each kind runs in its own savepoint; a failing kind keeps its events
+        for a later attempt until MAX_ATTEMPTS. Returns the number of events
+        taken from the table.
+        """
+        from chat.models import OutboxEvent
+
+        batch_size = batch_size or cls.BATCH_SIZE
+        with transaction.atomic():
+            events = OutboxEvent.objects.order_by('id')
+            if connection.features.has_select_for_update_skip_locked:
+                # Concurrent workers take disjoint batches
+                events = events.select_for_update(skip_locked=True)
+            events = list(events[:batch_size])
+            if not events:
+                return 0
+
+            by_kind = defaultdict(list)
+            for event in events:
+                by_kind[event.kind].append(event)
+
+            done, failed = [], []
+            for kind, batch in by_kind.items():
+                try:
+                    handler = import_string(cls.HANDLERS[kind])
+                    with transaction.atomic():
+                        handler([event.payload for event in batch])
+                    done.extend(batch)
+                except Exception as e:
+                    logger.error(f"Outbox handler for {kind} failed on {len(batch)} events: {str(e)}", exc_info=True)
+                    failed.extend(batch)
+
+            expired = [event.id for event in failed if event.attempts + 1 >= cls.MAX_ATTEMPTS]
+            if expired:
+                logger.error(f"Dropping {len(expired)} outbox events after {cls.MAX_ATTEMPTS} attempts")
+            OutboxEvent.objects.filter(id__in=[event.id for event in done] + expired).delete()
+            OutboxEvent.objects.filter(
+                id__in=[event.id for event in failed if event.id not in expired]
+            ).update(attempts=F('attempts') + 1)
+        return len(events)
+
+
+# Handlers
+
+def apply_message_sent(payloads: List[Dict]) -> None:
+    """
+    Bookkeeping for messages sent through the REST API: sender message
+    counts, group activity, conversation status and the ``message_sent``
+    activity with its notification to the sender.
+    """
+    from chat.models import Conversation, ConversationParticipant, Group
+    from users.models import User, UserActivity
+    from users.models_notification import Notification
+    from users.services.notification_inbox import NotificationInbox
+    from users.signals import ACTIVITY_NOTIFICATION_MAP
+
+    senders_by_count = defaultdict(list)
+    for sender_id, count in Counter(payload['sender_id'] for payload in payloads).items():
+        senders_by_count[count].append(sender_id)
+    for count, sender_ids in senders_by_count.items():
+        User.objects.filter(pk__in=sender_ids).update(message_count=F('message_count') + count)
+
+    group_activity = {}
+    for payload in payloads:
+        if payload.get('group_id'):
+            sent_at = parse_datetime(payload['sent_at'])
+            group_activity[payload['group_id']] = max(group_activity.get(payload['group_id'], sent_at), sent_at)
+    for group_id, sent_at in group_activity.items():
+        Group.objects.filter(pk=group_id).update(last_activity=sent_at)
+
+    # Same rule as Conversation.update_status, for the whole batch at once
+    online = ConversationParticipant.objects.filter(
+        conversation_id=OuterRef('pk'), user__online_status='online'
+    )
+    Conversation.objects.filter(pk__in={payload['conversation_id'] for payload in payloads}).update(
+        conversation_status=Case(
+            When(Exists(online), then=Value(Conversation.ConversationStatus.ACTIVE)),
+            default=Value(Conversation.ConversationStatus.INACTIVE),
+        )
+    )
+
+    # str(conversation) walks participants; once per conversation in the batch
+    conversations = Conversation.objects.select_related('group').in_bulk(
+        {payload['conversation_id'] for payload in payloads}
+    )
+    labels = {str(pk): str(conversation) for pk, conversation in conversations.items()}
+
+    # bulk_create skips the post_save handlers that notify the sender and feed the inbox, so do it here
+    activities = UserActivity.objects.bulk_create([
+        UserActivity(
+            user_id=payload['sender_id'],
+            action='message_sent',
+            description=f"Sent message in {labels.get(payload['conversation_id'], 'a deleted conversation')}",
+            ip_address=payload.get('ip_address'),
+            user_agent=payload.get('user_agent', ''),
+        )
+        for payload in payloads
+    ])
+    config = ACTIVITY_NOTIFICATION_MAP['message_sent']
+    NotificationInbox.record(Notification.objects.bulk_create([
+        Notification(
+            user_id=activity.user_id,
+            notification_type=config['type'],
+            title=config['title'],
+            message=config['message'],
+            data={'activity_id': str(activity.id) if activity.id else None, 'action': 'message_sent'},
+        )
+        for activity in activities
+    ]))
@@ -0,0 +1,223 @@
+"""
+Bounded, prioritised outbound queues for WebSocket consumers.
+
+Consumers using OutboundQueueMixin never write to the socket from their
+channel-layer handlers. Frames go into a per-connection queue with three
+priority classes (messages > presence > typing), and a writer task drains it
+in priority order. When the queue is full, typing frames are dropped first,
+then presence frames. A connection that stays over the limit is closed with
+CLOSE_CODE_SLOW_CONSUMER so the client reconnects and resumes from its last
+sequence number.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+import weakref
+from collections import Counter, deque
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_MESSAGE = 0
+PRIORITY_PRESENCE = 1
+PRIORITY_TYPING = 2
+PRIORITY_NAMES = {
+    PRIORITY_MESSAGE: 'message',
+    PRIORITY_PRESENCE: 'presence',
+    PRIORITY_TYPING: 'typing',
+}
+
+
+class SendQueueMetrics:
+    """
+    Queue depth and drop counters for the connections in this worker process.
+    """
+
+    CACHE_KEY = 'send_queue_metrics:{worker}'
+    WORKERS_KEY = 'send_queue_metrics:workers'
+    PUBLISH_INTERVAL = 10  # seconds
+    CACHE_TIMEOUT = 60
+
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    connections = weakref.WeakSet()
+    dropped = Counter()
+    coalesced = Counter()
+    evicted = 0
+    last_published = 0.0
+
+    @classmethod
+    def register(cls, consumer):
+        cls.connections.add(consumer)
+
+    @classmethod
+    def record_drop(cls, priority):
+        cls.dropped[PRIORITY_NAMES[priority]] += 1
+
+    @classmethod
+    def record_coalesce(cls, priority):
+        cls.coalesced[PRIORITY_NAMES[priority]] += 1
+
+    @classmethod
+    def record_eviction(cls):
+        cls.evicted += 1
+
+    @classmethod
+    def snapshot(cls):
+        """Return current queue metrics for this worker."""
+        depths = [consumer.outbound_depth() for consumer in list(cls.connections)]
+        by_class = Counter()
+        for consumer in list(cls.connections):
+            for priority, queue in enumerate(getattr(consumer, 'outbound_queues', ())):
+                by_class[PRIORITY_NAMES[priority]] += len(queue)
+        return {
+            'worker': cls.worker,
+            'connections': len(depths),
+            'queued_frames': sum(depths),
+            'max_depth': max(depths, default=0),
+            'queued_by_class': dict(by_class),
+            'dropped': dict(cls.dropped),
+            'coalesced': dict(cls.coalesced),
+            'evicted': cls.evicted,
+            'timestamp': time.time(),
+        }
+
+    @classmethod
+    def publish_if_due(cls):
+        """Store this worker's snapshot in the cache so any worker can report it."""
+        now = time.monotonic()
+        if now - cls.last_published < cls.PUBLISH_INTERVAL:
+            return
+        cls.last_published = now
+        try:
+            cache.set(cls.CACHE_KEY.format(worker=cls.worker), cls.snapshot(), cls.CACHE_TIMEOUT)
+            workers = set(cache.get(cls.WORKERS_KEY) or ())
+            if cls.worker not in workers:
+                workers.add(cls.worker)
+                cache.set(cls.WORKERS_KEY, workers, None)
+        except Exception as e:
+            logger.debug(f"Could not publish send queue metrics: {str(e)}")
+
+    @classmethod
+    def all_workers(cls):
+        """Return the latest snapshot of every worker that published recently."""
+        snapshots = {cls.worker: cls.snapshot()}
+        workers = cache.get(cls.WORKERS_KEY) or ()
+        cached = cache.get_many([cls.CACHE_KEY.format(worker=worker) for worker in workers])
+        for snapshot in cached.values():
+            snapshots.setdefault(snapshot['worker'], snapshot)
+        return list(snapshots.values())
+
+
+class OutboundQueueMixin:
+    """
+    Replace direct ``send()`` with a bounded priority queue per connection.
+
+    ``send()`` keeps its signature and adds ``priority`` and
+    ``coalesce_key``; a queued frame with the same coalesce key is replaced
+    by the newer one instead of adding another.
+    """
+
+    MAX_QUEUE_SIZE = 256  # frames before lower classes are dropped
+    HARD_QUEUE_SIZE = 1024  # frames before the connection is closed outright
+    SLOW_CONSUMER_TIMEOUT = 10.0  # seconds a connection may stay over MAX_QUEUE_SIZE
+    CLOSE_CODE_SLOW_CONSUMER = 4008
+
+    async def send(self, text_data=None, bytes_data=None, close=False,
+                   priority=PRIORITY_MESSAGE, coalesce_key=None):
+        if close:
+            await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+            return
+        self.enqueue_frame((text_data, bytes_data), priority, coalesce_key)
+
+    def outbound_depth(self):
+        return sum(len(queue) for queue in getattr(self, 'outbound_queues', ()))
+
+    def enqueue_frame(self, frame, priority, coalesce_key=None):
+        if getattr(self, 'outbound_closed', False):
+            return
+        if not hasattr(self, 'outbound_queues'):
+            self.outbound_queues = (deque(), deque(), deque())
+            self.outbound_ready = asyncio.Event()
+            self.outbound_task = None
+            self.over_limit_since = None
+            SendQueueMetrics.register(self)
+
+        queue = self.outbound_queues[priority]
+        if coalesce_key is not None:
+            for index, (key, _) in enumerate(queue):
+                if key == coalesce_key:
+                    queue[index] = (coalesce_key, frame)
+                    SendQueueMetrics.record_coalesce(priority)
+                    return
+
+        if self.outbound_depth() >= self.MAX_QUEUE_SIZE and not self.make_room(priority):
+            SendQueueMetrics.record_drop(priority)
+            return
+
+        queue.append((coalesce_key, frame))
+        self.check_slow_consumer()
+
+        self.outbound_ready.set()
+        if self.outbound_task is None or self.outbound_task.done():
+            self.outbound_task = asyncio.ensure_future(self.drain_outbound())
+        SendQueueMetrics.publish_if_due()
+
+    def make_room(self, priority):
+        """Drop the oldest frame of the lowest class below ``priority``, if any."""
+        for lower in (PRIORITY_TYPING, PRIORITY_PRESENCE):
+            if lower <= priority:
+                break
+            if self.outbound_queues[lower]:
+                self.outbound_queues[lower].popleft()
+                SendQueueMetrics.record_drop(lower)
+                return True
+        # Messages are never dropped; the queue grows until eviction
+        return priority == PRIORITY_MESSAGE
+
+    def check_slow_consumer(self):
+        depth = self.outbound_depth()
+        if depth <= self.MAX_QUEUE_SIZE:
+            self.over_limit_since = None
+            return
+        now = time.monotonic()
+        if self.over_limit_since is None:
+            self.over_limit_since = now
+        if depth >= self.HARD_QUEUE_SIZE or now - self.over_limit_since >= self.SLOW_CONSUMER_TIMEOUT:
+            asyncio.ensure_future(self.evict_slow_consumer(depth))
+
+    async def evict_slow_consumer(self, depth):
+        if getattr(self, 'outbound_closed', False):
+            return
+        logger.warning(f"Closing slow WebSocket consumer {self.channel_name} with {depth} queued frames")
+        self.stop_outbound()
+        SendQueueMetrics.record_eviction()
+        await self.close(code=self.CLOSE_CODE_SLOW_CONSUMER)
+
+    async def drain_outbound(self):
+        while not getattr(self, 'outbound_closed', False):
+            frame = None
+            for queue in self.outbound_queues:
+                if queue:
+                    _, frame = queue.popleft()
+                    break
+            if frame is None:
+                self.outbound_ready.clear()
+                self.over_limit_since = None
+                await self.outbound_ready.wait()
+                continue
+            text_data, bytes_data = frame
+            await super().send(text_data=text_data, bytes_data=bytes_data)
+
+    def stop_outbound(self):
+        self.outbound_closed = True
+        task = getattr(self, 'outbound_task', None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        for queue in getattr(self, 'outbound_queues', ()):
+            queue.clear()
+
+    async def websocket_disconnect(self, message):
+        self.stop_outbound()
+        await super().websocket_disconnect(message)
@@ -0,0 +1,127 @@
+"""
+Per-process typing-indicator aggregation.
+
+Typing events are throttled on the way out (one ``user_typing`` per user and
+room every PUBLISH_INTERVAL seconds) and aggregated on the way in: consumers
+register as listeners for their rooms and, instead of forwarding each event,
+receive one combined ``typing_state`` frame per changed room every TICK
+seconds. Typists who stop refreshing are expired after EXPIRE_AFTER seconds.
+"""
+import asyncio
+import json
+import logging
+import time
+import weakref
+
+logger = logging.getLogger(__name__)
+
+
+class TypingAggregator:
+    """
+    Typing state for every room with a listener in this process (per event loop).
+    """
+
+    PUBLISH_INTERVAL = 3.0  # min seconds between published typing events per user
+    TICK = 1.0  # seconds between typing_state frames
+    EXPIRE_AFTER = 6.0  # drop typists without a refresh for this long
+
+    _aggregators = weakref.WeakKeyDictionary()
+
+    def __init__(self):
+        # room -> {user_id: (username, expires_at)}
+        self.typists = {}
+        # room -> set of consumers
+        self.listeners = {}
+        self.dirty = set()
+        # (room, user_id) -> time of the last published typing event
+        self.published = {}
+        self.tick_task = None
+
+    @classmethod
+    def get(cls) -> 'TypingAggregator':
+        """Return the aggregator for the running event loop."""
+        loop = asyncio.get_running_loop()
+        aggregator = cls._aggregators.get(loop)
+        if aggregator is None:
+            aggregator = cls._aggregators[loop] = cls()
+        return aggregator
+
+    # Listeners
+
+    def add_listener(self, room, consumer):
+        self.listeners.setdefault(room, set()).add(consumer)
+        if self.tick_task is None or self.tick_task.done():
+            self.tick_task = asyncio.get_running_loop().create_task(self.run())
+
+    def remove_listener(self, room, consumer):
+        listeners = self.listeners.get(room)
+        if listeners is None:
+            return
+        listeners.discard(consumer)
+        if not listeners:
+            del self.listeners[room]
+            self.typists.pop(room, None)
+            self.dirty.discard(room)
+
+    # Outgoing throttle
+
+    def should_publish(self, room, user_id):
+        """Return True if a typing event for this user and room is due."""
+        now = time.monotonic()
+        key = (room, user_id)
+        if now - self.published.get(key, 0) < self.PUBLISH_INTERVAL:
+            return False
+        self.published[key] = now
+        return True
+
+    def reset_publish(self, room, user_id):
+        self.published.pop((room, user_id), None)
+
+    # Incoming events
+
+    def observe_typing(self, room, user_id, username):
+        if room not in self.listeners:
+            return
+        typists = self.typists.setdefault(room, {})
+        if user_id not in typists:
+            self.dirty.add(room)
+        typists[user_id] = (username, time.monotonic() + self.EXPIRE_AFTER)
+
+    def observe_stop(self, room, user_id):
+        typists = self.typists.get(room)
+        if typists and typists.pop(user_id, None) is not None:
+            self.dirty.add(room)
+
+    # Tick
+
+    def expire(self, now):
+        for room, typists in self.typists.items():
+            stale = [user_id for user_id, (_, expires_at) in typists.items() if expires_at <= now]
+            for user_id in stale:
+                del typists[user_id]
+            if stale:
+                self.dirty.add(room)
+
+        cutoff = now - self.PUBLISH_INTERVAL
+        self.published = {key: sent for key, sent in self.published.items() if sent > cutoff}
+
+    async def run(self):
+        while self.listeners:
+            await asyncio.sleep(self.TICK)
+            self.expire(time.monotonic())
+            dirty, self.dirty = self.dirty, set()
+            for room in dirty:
+                await self.emit(room)
+
+    async def emit(self, room):
+        users = [
+            {'user_id': user_id, 'username': username}
+            for user_id, (username, _) in self.typists.get(room, {}).items()
+        ]
+        # Serialized once per room, not once per listener
+        text_data = json.dumps({'type': 'typing_state', 'users': users})
+        for consumer in list(self.listeners.get(room, ())):
+            try:
+                await consumer.send_typing_state(room, users, text_data)
+            except Exception as e:
+                logger.debug(f"Could not deliver typing state for {room}: {str(e)}")
@@ -0,0 +1,172 @@
+"""
+Signal handlers keeping the cached contact graph, the membership cache, the
+inbox projection and the message search index in step with memberships and
+messages.
+"""
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from chat.models import Attachment, Conversation, ConversationParticipant, Group, GroupMember, Message
+from chat.services.contact_service import ContactService
+from chat.services.inbox_service import InboxService
+from chat.services.membership_cache import MembershipCache
+from chat.services.message_search import MessageSearch
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=ConversationParticipant)
+@receiver(post_delete, sender=ConversationParticipant)
+def conversation_participant_changed(sender, instance, **kwargs):
+    """Invalidate the graph for everyone in the conversation, including a removed user."""
+    if kwargs.get('signal') is post_save and not kwargs.get('created'):
+        return
+    ContactService.invalidate_conversation(instance.conversation_id)
+    ContactService.invalidate([instance.user_id])
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def conversation_participants_m2m_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Handle ``conversation.participants.add()`` and friends, which bypass post_save."""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        # user.conversations.add(...): instance is the user, pk_set the conversations
+        ContactService.invalidate([instance.pk])
+        for conversation_id in pk_set or ():
+            ContactService.invalidate_conversation(conversation_id)
+    else:
+        ContactService.invalidate_conversation(instance.pk)
+        ContactService.invalidate(pk_set or ())
+
+
+@receiver(post_save, sender=GroupMember)
+@receiver(post_delete, sender=GroupMember)
+def group_member_changed(sender, instance, **kwargs):
+    """Invalidate the graph for a group's members when membership or member status changes."""
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and 'status' not in update_fields:
+        return
+    ContactService.invalidate_group(instance.group_id)
+    ContactService.invalidate([instance.user_id])
+
+
+@receiver(post_init, sender=Group)
+@receiver(post_init, sender=Conversation)
+def remember_deleted_flag(sender, instance, **kwargs):
+    instance._contact_graph_deleted = instance.is_deleted
+
+
+@receiver(post_save, sender=Group)
+def group_deleted_changed(sender, instance, created, **kwargs):
+    if not created and instance.is_deleted != instance._contact_graph_deleted:
+        ContactService.invalidate_group(instance.pk)
+    instance._contact_graph_deleted = instance.is_deleted
+
+
+@receiver(post_save, sender=Conversation)
+def conversation_deleted_changed(sender, instance, created, **kwargs):
+    if not created and instance.is_deleted != instance._contact_graph_deleted:
+        ContactService.invalidate_conversation(instance.pk)
+    instance._contact_graph_deleted = instance.is_deleted
+
+
+# Membership cache
+
+@receiver(post_save, sender=ConversationParticipant)
+@receiver(post_delete, sender=ConversationParticipant)
+def membership_participant_changed(sender, instance, **kwargs):
+    MembershipCache.invalidate([instance.user_id])
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def membership_participants_m2m_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and not reverse:
+        # pk_set is not provided for clear(); capture the participants before they go
+        MembershipCache.invalidate(instance.participants.values_list('id', flat=True))
+    elif reverse and action in ('post_add', 'post_remove', 'pre_clear'):
+        MembershipCache.invalidate([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        MembershipCache.invalidate(pk_set or ())
+
+
+@receiver(post_save, sender=GroupMember)
+@receiver(post_delete, sender=GroupMember)
+def membership_group_member_changed(sender, instance, **kwargs):
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and not {'role', 'status'} & set(update_fields):
+        return
+    MembershipCache.invalidate([instance.user_id])
+
+
+# Conditional GET
+
+@receiver(post_save, sender=Attachment)
+@receiver(post_delete, sender=Attachment)
+def attachment_changed(sender, instance, **kwargs):
+    """Attachments do not move the conversation's seq; touch updated_at so message page ETags change."""
+    Conversation.objects.filter(messages__id=instance.message_id).update(updated_at=timezone.now())
+
+
+# Inbox and search index
+
+@receiver(post_save, sender=Message)
+def message_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        # MessageWriteBuffer records its batches itself before sending post_save
+        if not getattr(instance, '_batch_recorded', False):
+            InboxService.record_messages([instance])
+            MessageSearch.index([instance])
+        return
+    InboxService.message_changed(instance, update_fields)
+    MessageSearch.message_changed(instance, update_fields)
+
+
+@receiver(post_save, sender=Conversation)
+def group_conversation_created(sender, instance, created, **kwargs):
+    if created and instance.group_id:
+        InboxService.add_members(instance, InboxService.member_ids(instance))
+
+
+@receiver(post_save, sender=ConversationParticipant)
+def inbox_participant_added(sender, instance, created, **kwargs):
+    if created:
+        InboxService.add_members(instance.conversation, [instance.user_id])
+
+
+@receiver(post_delete, sender=ConversationParticipant)
+def inbox_participant_removed(sender, instance, **kwargs):
+    conversation = Conversation.objects.filter(pk=instance.conversation_id).first()
+    if conversation is not None:
+        InboxService.remove_members(conversation, [instance.user_id])
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def inbox_participants_m2m_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        instance._inbox_cleared = list(instance.conversations.all()) if reverse else [instance]
+        return
+    if action == 'post_clear':
+        for conversation in getattr(instance, '_inbox_cleared', ()):
+            InboxService.rebuild(conversation)
+        return
+    if action not in ('post_add', 'post_remove'):
+        return
+
+    update = InboxService.add_members if action == 'post_add' else InboxService.remove_members
+    if reverse:
+        for conversation in Conversation.objects.filter(pk__in=pk_set or ()):
+            update(conversation, [instance.pk])
+    else:
+        update(instance, pk_set or ())
+
+
+@receiver(post_save, sender=GroupMember)
+@receiver(post_delete, sender=GroupMember)
+def inbox_group_member_changed(sender, instance, **kwargs):
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and 'status' not in update_fields:
+        return
+    active = kwargs.get('signal') is post_save and instance.status == GroupMember.MemberStatus.ACTIVE
+    InboxService.group_joined(instance.group_id, instance.user_id, active)
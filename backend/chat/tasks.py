@@ -0,0 +1,21 @@
+"""
+Celery tasks for the chat app.
+"""
+from celery import shared_task
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def drain_outbox():
+    """Apply pending outbox events in batches."""
+    from chat.services.outbox import Outbox
+    return Outbox.drain_all()
+
+
+@shared_task
+def cleanup_stale_uploads():
+    """Discard chunked uploads abandoned for longer than the session TTL."""
+    from chat.services.chunked_upload import ChunkedUploadService
+    return ChunkedUploadService.cleanup_stale()
@@ -1,3 +1,1012 @@
-from django.test import TestCase
+"""
+Test suite for the chat app.
+Run with: python manage.py test chat
+"""
+import asyncio
+from io import StringIO
+from asgiref.sync import async_to_sync
+from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, APITestCase
+from chat.models import Attachment, Conversation, Group, GroupMember, InboxEntry, Message, OutboxEvent
+from chat.serializers import ConversationSerializer, MessageSerializer
+from chat.services.contact_service import ContactService
+from chat.services.inbox_service import InboxService
+from chat.services.message_renderer import MessageRenderer
+from chat.services.message_search import MessageSearch
+from chat.services.outbox import Outbox
+from chat.services.message_buffer import MessageWriteBuffer
+from chat.services.send_queue import OutboundQueueMixin, PRIORITY_PRESENCE, PRIORITY_TYPING
+from chat.routing import websocket_urlpatterns
 
-# Create your tests here.
+User = get_user_model()
+
+
+# The in-memory test database cannot take writes from the outbox thread
+@override_settings(OUTBOX_WORKER='sync')
+class MultiplexConsumerTests(TransactionTestCase):
+    """Test the multiplexed WebSocket consumer."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='member',
+            email='member@test.com',
+            password='testpass123'
+        )
+        self.outsider = User.objects.create_user(
+            username='outsider',
+            email='outsider@test.com',
+            password='testpass123'
+        )
+        self.group = Group.objects.create(name='Team', created_by=self.user)
+        self.group.add_member(self.user, 'owner')
+
+    def connect(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/connect/')
+        communicator.scope['user'] = user
+        return communicator
+
+    def test_subscribe_and_receive_group_events(self):
+        """Events sent to a legacy room reach the multiplexed socket tagged with the subscription."""
+        async def scenario():
+            communicator = self.connect(self.user)
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+
+            await communicator.send_json_to({'type': 'subscribe', 'kind': 'group', 'id': str(self.group.id)})
+            reply = await communicator.receive_json_from()
+            self.assertEqual(reply['type'], 'subscribed')
+
+            await get_channel_layer().group_send(f'group_{self.group.id}', {
+                'type': 'user_typing',
+                'room': f'group_{self.group.id}',
+                'user_id': 99,
+                'username': 'someone',
+            })
+            frame = await communicator.receive_json_from(timeout=3)
+            self.assertEqual(frame['type'], 'typing_state')
+            self.assertEqual(frame['users'], [{'user_id': 99, 'username': 'someone'}])
+            self.assertEqual(frame['kind'], 'group')
+            self.assertEqual(frame['id'], str(self.group.id))
+
+            await communicator.send_json_to({'type': 'unsubscribe', 'kind': 'group', 'id': str(self.group.id)})
+            reply = await communicator.receive_json_from()
+            self.assertEqual(reply['type'], 'unsubscribed')
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_presence_changes_coalesced_into_one_diff(self):
+        """Repeated presence changes for a contact arrive as a single diff frame."""
+        async def scenario():
+            communicator = self.connect(self.user)
+            await communicator.connect()
+            await communicator.send_json_to({'type': 'subscribe', 'kind': 'presence'})
+            await communicator.receive_json_from()
+
+            room = f'presence_{self.user.id}'
+            for online_status in ('online', 'offline', 'online'):
+                await get_channel_layer().group_send(room, {
+                    'type': 'presence_update',
+                    'room': room,
+                    'user_id': '99',
+                    'username': 'someone',
+                    'online_status': online_status,
+                })
+            frame = await communicator.receive_json_from(timeout=3)
+            self.assertEqual(frame['type'], 'presence_diff')
+            self.assertEqual(frame['changes'], [
+                {'user_id': '99', 'username': 'someone', 'online_status': 'online'},
+            ])
+            self.assertTrue(await communicator.receive_nothing())
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_typing_events_throttled_per_user(self):
+        """Repeated typing frames from one user publish a single event and one combined state frame."""
+        async def scenario():
+            communicator = self.connect(self.user)
+            await communicator.connect()
+            await communicator.send_json_to({'type': 'subscribe', 'kind': 'group', 'id': str(self.group.id)})
+            await communicator.receive_json_from()
+
+            for _ in range(5):
+                await communicator.send_json_to({'type': 'typing', 'kind': 'group', 'id': str(self.group.id)})
+            frame = await communicator.receive_json_from(timeout=3)
+            self.assertEqual(frame['type'], 'typing_state')
+            self.assertEqual([user['user_id'] for user in frame['users']], [self.user.id])
+            self.assertTrue(await communicator.receive_nothing(timeout=1.5))
+
+            await communicator.send_json_to({'type': 'stop_typing', 'kind': 'group', 'id': str(self.group.id)})
+            frame = await communicator.receive_json_from(timeout=3)
+            self.assertEqual(frame['users'], [])
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_burst_of_messages_acked_and_stored_in_order(self):
+        """Nothing goes out before the buffered write commits; then each message is broadcast with its seq and acked, in send order."""
+        async def scenario():
+            communicator = self.connect(self.user)
+            await communicator.connect()
+            await communicator.send_json_to({'type': 'subscribe', 'kind': 'group', 'id': str(self.group.id)})
+            await communicator.receive_json_from()
+
+            for index in range(3):
+                await communicator.send_json_to({
+                    'type': 'send_message',
+                    'kind': 'group',
+                    'id': str(self.group.id),
+                    'content': f'message {index}',
+                    'temp_id': f'tmp-{index}',
+                })
+
+            frames = [await communicator.receive_json_from(timeout=3) for _ in range(6)]
+            broadcasts = [frame for frame in frames if frame['type'] == 'new_message']
+            acks = [frame for frame in frames if frame['type'] == 'ack']
+            self.assertEqual([frame['message']['temp_id'] for frame in broadcasts], ['tmp-0', 'tmp-1', 'tmp-2'])
+            self.assertEqual([frame['temp_id'] for frame in acks], ['tmp-0', 'tmp-1', 'tmp-2'])
+            self.assertEqual([frame['message']['seq'] for frame in broadcasts], [1, 2, 3])
+            await communicator.disconnect()
+            return [frame['message']['id'] for frame in broadcasts]
+
+        message_ids = async_to_sync(scenario)()
+        stored = list(Message.objects.order_by('timestamp').values_list('id', 'content'))
+        self.assertEqual([str(message_id) for message_id, _ in stored], message_ids)
+        self.assertEqual([content for _, content in stored], ['message 0', 'message 1', 'message 2'])
+
+    def test_conversation_send_broadcast_on_canonical_room(self):
+        """Messages sent by conversation id reach the group room; staff outsiders cannot send."""
+        conversation = Conversation.objects.create(conversation_type='group', group=self.group, title='Team')
+        staff = User.objects.create_user(username='staff', email='staff@test.com', password='testpass123', is_staff=True)
+
+        async def scenario():
+            layer = get_channel_layer()
+            listener = await layer.new_channel()
+            await layer.group_add(f'group_{self.group.id}', listener)
+
+            communicator = self.connect(self.user)
+            await communicator.connect()
+            await communicator.send_json_to({'type': 'subscribe', 'kind': 'conversation', 'id': str(conversation.id)})
+            await communicator.receive_json_from()
+            await communicator.send_json_to({
+                'type': 'send_message', 'kind': 'conversation', 'id': str(conversation.id),
+                'content': 'hello', 'temp_id': 'tmp-0',
+            })
+            event = await asyncio.wait_for(layer.receive(listener), timeout=3)
+            self.assertEqual((event['type'], event['message']['content']), ('new_message', 'hello'))
+            frames = [await communicator.receive_json_from(timeout=3) for _ in range(2)]
+            self.assertEqual(sorted(frame['type'] for frame in frames), ['ack', 'new_message'])
+            await communicator.disconnect()
+
+            watcher = self.connect(staff)
+            await watcher.connect()
+            await watcher.send_json_to({'type': 'subscribe', 'kind': 'conversation', 'id': str(conversation.id)})
+            self.assertEqual((await watcher.receive_json_from())['type'], 'subscribed')
+            await watcher.send_json_to({
+                'type': 'send_message', 'kind': 'conversation', 'id': str(conversation.id), 'content': 'intrusion',
+            })
+            reply = await watcher.receive_json_from()
+            self.assertEqual((reply['type'], reply['code']), ('error', 'forbidden'))
+            await watcher.disconnect()
+
+        async_to_sync(scenario)()
+        self.assertEqual(list(Message.objects.values_list('content', flat=True)), ['hello'])
+
+    def test_overlapping_subscriptions_share_a_room(self):
+        """A room two subscriptions share stays joined until both are gone; frames carry the oldest."""
+        conversation = Conversation.objects.create(conversation_type='group', group=self.group, title='Team')
+        Message.objects.create(conversation=conversation, sender=self.user, content='before')
+        group_room = f'group_{self.group.id}'
+
+        async def scenario():
+            layer = get_channel_layer()
+            communicator = self.connect(self.user)
+            await communicator.connect()
+            await communicator.send_json_to({'type': 'subscribe', 'kind': 'conversation', 'id': str(conversation.id)})
+            await communicator.receive_json_from()
+            await communicator.send_json_to({'type': 'subscribe', 'kind': 'group', 'id': str(self.group.id)})
+            await communicator.receive_json_from()
+
+            await communicator.send_json_to({'type': 'resume', 'conversations': {str(conversation.id): 0}})
+            replay = await communicator.receive_json_from(timeout=3)
+            self.assertEqual((replay['type'], replay['kind'], replay['id']), ('replay', 'conversation', str(conversation.id)))
+
+            await communicator.send_json_to({'type': 'unsubscribe', 'kind': 'conversation', 'id': str(conversation.id)})
+            await communicator.receive_json_from()
+            await layer.group_send(group_room, {'type': 'new_message', 'room': group_room, 'message': {'content': 'still here'}})
+            frame = await communicator.receive_json_from(timeout=3)
+            self.assertEqual((frame['kind'], frame['message']['content']), ('group', 'still here'))
+
+            await communicator.send_json_to({
+                'type': 'send_message', 'kind': 'group', 'id': str(self.group.id), 'content': 'on group',
+            })
+            frames = [await communicator.receive_json_from(timeout=3) for _ in range(2)]
+            self.assertEqual(sorted(frame['type'] for frame in frames), ['ack', 'new_message'])
+
+            await communicator.send_json_to({'type': 'unsubscribe', 'kind': 'group', 'id': str(self.group.id)})
+            await communicator.receive_json_from()
+            await layer.group_send(group_room, {'type': 'new_message', 'room': group_room, 'message': {'content': 'gone'}})
+            self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_staff_watcher_receives_conversation_messages(self):
+        """Staff outside a conversation join its broadcast room and get its messages."""
+        conversation = Conversation.objects.create(conversation_type='group', group=self.group, title='Team')
+        staff = User.objects.create_user(username='watcher', email='watcher@test.com', password='testpass123', is_staff=True)
+
+        async def scenario():
+            watcher = self.connect(staff)
+            await watcher.connect()
+            await watcher.send_json_to({'type': 'resume', 'conversations': {str(conversation.id): 0}})
+            subscribed = await watcher.receive_json_from()
+            self.assertEqual((subscribed['type'], subscribed['kind']), ('subscribed', 'conversation'))
+            replay = await watcher.receive_json_from()
+            self.assertEqual(replay['type'], 'replay')
+
+            communicator = self.connect(self.user)
+            await communicator.connect()
+            await communicator.send_json_to({'type': 'subscribe', 'kind': 'group', 'id': str(self.group.id)})
+            await communicator.receive_json_from()
+            await communicator.send_json_to({
+                'type': 'send_message', 'kind': 'group', 'id': str(self.group.id), 'content': 'hello',
+            })
+            frame = await watcher.receive_json_from(timeout=3)
+            self.assertEqual(
+                (frame['type'], frame['kind'], frame['message']['content']),
+                ('new_message', 'conversation', 'hello'),
+            )
+            await communicator.disconnect()
+            await watcher.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_resume_skips_replay_when_forbidden(self):
+        """A refused resume sends the error and no replay."""
+        conversation = Conversation.objects.create(conversation_type='group', group=self.group, title='Team')
+        Message.objects.create(conversation=conversation, sender=self.user, content='secret')
+
+        async def scenario():
+            communicator = self.connect(self.outsider)
+            await communicator.connect()
+            await communicator.send_json_to({'type': 'resume', 'conversations': {str(conversation.id): 0}})
+            reply = await communicator.receive_json_from()
+            self.assertEqual((reply['type'], reply['code']), ('error', 'forbidden'))
+            self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_resume_replays_messages_and_edits_after_last_seq(self):
+        """Resume replays only changes after the client's last sequence number."""
+        conversation = Conversation.objects.create(conversation_type='group', group=self.group, title='Team')
+        first = Message.objects.create(conversation=conversation, sender=self.user, content='first')
+        second = Message.objects.create(conversation=conversation, sender=self.user, content='second')
+        first.edit_content('first, edited')
+        self.assertEqual((first.seq, second.seq, first.updated_seq), (1, 2, 3))
+
+        async def scenario():
+            communicator = self.connect(self.user)
+            await communicator.connect()
+            await communicator.send_json_to({'type': 'resume', 'conversations': {str(conversation.id): 1}})
+            subscribed = await communicator.receive_json_from()
+            self.assertEqual((subscribed['type'], subscribed['kind']), ('subscribed', 'group'))
+            replay = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return replay
+
+        replay = async_to_sync(scenario)()
+        self.assertEqual(replay['type'], 'replay')
+        self.assertEqual([message['content'] for message in replay['messages']], ['second', 'first, edited'])
+        self.assertEqual(replay['last_seq'], 3)
+        self.assertFalse(replay['has_more'])
+
+    def test_subscribe_rejected_for_non_member(self):
+        """Users cannot subscribe to groups they do not belong to."""
+        async def scenario():
+            communicator = self.connect(self.outsider)
+            await communicator.connect()
+            await communicator.send_json_to({'type': 'subscribe', 'kind': 'group', 'id': str(self.group.id)})
+            reply = await communicator.receive_json_from()
+            self.assertEqual(reply['type'], 'error')
+            self.assertEqual(reply['code'], 'forbidden')
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+
+class ContactGraphTests(TestCase):
+    """Test that membership signals keep the cached contact graph current."""
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', email='alice@test.com', password='testpass123')
+        self.bob = User.objects.create_user(username='bob', email='bob@test.com', password='testpass123')
+        self.carol = User.objects.create_user(username='carol', email='carol@test.com', password='testpass123')
+
+    def test_cached_graph_reads_without_queries(self):
+        ContactService.get_graph(self.alice.id)
+        with self.assertNumQueries(0):
+            ContactService.get_graph(self.alice.id)
+
+    def test_conversation_participants_update_graph(self):
+        self.assertEqual(ContactService.get_graph(self.alice.id)['direct'], set())
+        conversation = Conversation.objects.create(conversation_type='individual')
+        conversation.participants.add(self.alice, self.bob)
+
+        graph = ContactService.get_graph(self.alice.id)
+        self.assertEqual(graph['direct'], {self.bob.id})
+        self.assertEqual(graph['contacts'], {self.bob.id})
+
+    def test_group_membership_updates_graph(self):
+        group = Group.objects.create(name='Team', created_by=self.alice)
+        group.add_member(self.alice, 'owner')
+        ContactService.get_graph(self.alice.id)
+
+        group.add_member(self.carol)
+        graph = ContactService.get_graph(self.alice.id)
+        self.assertEqual(graph['contacts'], {self.carol.id})
+        self.assertEqual(graph['groups'], {str(group.id)})
+
+        group.remove_member(self.carol)
+        self.assertEqual(ContactService.get_graph(self.alice.id)['contacts'], set())
+        self.assertEqual(ContactService.get_graph(self.carol.id)['groups'], set())
+
+
+class ConversationPairTests(TestCase):
+    """Test the canonical pair key of individual conversations."""
+
+    def test_pair_lookup_is_order_independent_and_unique(self):
+        alice = User.objects.create_user(username='alice', email='alice@test.com', password='testpass123')
+        bob = User.objects.create_user(username='bob', email='bob@test.com', password='testpass123')
+
+        conversation, created = Conversation.get_or_create_individual(bob.id, alice.id)
+        self.assertTrue(created)
+        self.assertEqual(set(conversation.participants.values_list('id', flat=True)), {alice.id, bob.id})
+
+        with self.assertNumQueries(1):
+            same, created = Conversation.get_or_create_individual(alice.id, bob.id)
+        self.assertFalse(created)
+        self.assertEqual(same.id, conversation.id)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Conversation.objects.create(conversation_type='individual', pair_low=alice.id, pair_high=bob.id)
+
+    def test_every_creation_path_uses_the_pair(self):
+        from rest_framework.test import APIRequestFactory
+        from chat.serializers import ConversationCreateSerializer
+
+        alice = User.objects.create_user(username='alice', email='alice@test.com', password='testpass123')
+        bob = User.objects.create_user(username='bob', email='bob@test.com', password='testpass123')
+        request = APIRequestFactory().post('/api/chat/conversations/')
+        request.user = alice
+
+        def create(participant_ids):
+            serializer = ConversationCreateSerializer(
+                data={'conversation_type': 'individual', 'participant_ids': participant_ids},
+                context={'request': request}
+            )
+            return serializer.save() if serializer.is_valid() else None
+
+        first = create([bob.id])
+        self.assertEqual(create([bob.id]).id, first.id)
+        self.assertIsNone(create([]))
+        self.assertIsNone(create([alice.id]))
+
+        # Completing a pair that already has a conversation is refused
+        stray = Conversation.objects.create(conversation_type='individual')
+        self.assertTrue(stray.add_participant(alice))
+        self.assertFalse(stray.add_participant(bob))
+        self.assertEqual(Conversation.objects.filter(pair_low__isnull=False).count(), 1)
+
+
+class MembershipCacheTests(TestCase):
+    """Test cached conversation and group permission checks."""
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', email='alice@test.com', password='testpass123')
+        self.bob = User.objects.create_user(username='bob', email='bob@test.com', password='testpass123')
+
+    def test_checks_are_cached_and_invalidated(self):
+        conversation = Conversation.objects.create(conversation_type='individual')
+        conversation.participants.add(self.alice)
+        group = Group.objects.create(name='team', created_by=self.alice)
+        group.add_member(self.alice, role='admin')
+
+        self.assertTrue(conversation.is_participant(self.alice))
+        with self.assertNumQueries(0):
+            self.assertTrue(conversation.is_participant(self.alice))
+            self.assertTrue(group.is_member(self.alice))
+            self.assertTrue(group.can_manage(self.alice))
+
+        conversation.participants.add(self.bob)
+        self.assertTrue(conversation.is_participant(self.bob))
+        conversation.participants.remove(self.alice)
+        self.assertFalse(conversation.is_participant(self.alice))
+
+        member = GroupMember.objects.get(group=group, user=self.alice)
+        member.role = GroupMember.MemberRole.MEMBER
+        member.save(update_fields=['role'])
+        self.assertFalse(group.can_manage(self.alice))
+        group.remove_member(self.alice)
+        self.assertFalse(group.is_member(self.alice))
+        self.assertEqual(group.get_member_role(self.alice), 'member')
+
+
+class InboxTests(APITestCase):
+    """Test the denormalized conversation inbox."""
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', email='alice@test.com', password='testpass123')
+        self.bob = User.objects.create_user(username='bob', email='bob@test.com', password='testpass123')
+        self.client.force_authenticate(user=self.alice)
+
+    def create_conversation(self, other):
+        conversation = Conversation.objects.create(conversation_type='individual')
+        conversation.participants.add(self.alice, other)
+        return conversation
+
+    def test_projection_follows_inserts_edits_and_deletes(self):
+        conversation = self.create_conversation(self.bob)
+        first = Message.objects.create(conversation=conversation, sender=self.bob, content='hello')
+        MessageWriteBuffer.write([
+            Message(conversation=conversation, sender=self.bob, content='second'),
+            Message(conversation=conversation, sender=self.alice, content='reply'),
+        ])
+
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.message_count, 3)
+        self.assertEqual(conversation.last_message_summary['content'], 'reply')
+        self.assertEqual(InboxEntry.objects.get(user=self.alice, conversation=conversation).unread_count, 2)
+        self.assertEqual(InboxEntry.objects.get(user=self.bob, conversation=conversation).unread_count, 1)
+
+        latest = Message.objects.get(content='reply')
+        latest.edit_content('edited reply')
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.last_message_summary['content'], 'edited reply')
+
+        latest.delete_message()
+        first.delete_message()
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.message_count, 1)
+        self.assertEqual(conversation.last_message_summary['content'], 'second')
+
+    def test_deleting_unread_message_lowers_unread_count(self):
+        conversation = self.create_conversation(self.bob)
+        first = Message.objects.create(conversation=conversation, sender=self.bob, content='first')
+        second = Message.objects.create(conversation=conversation, sender=self.bob, content='second')
+        entry = InboxEntry.objects.get(user=self.alice, conversation=conversation)
+        self.assertEqual(InboxEntry.objects.get(pk=entry.pk).unread_count, 2)
+
+        second.delete_message()
+        self.assertEqual(InboxEntry.objects.get(pk=entry.pk).unread_count, 1)
+        second.restore_message()
+        self.assertEqual(InboxEntry.objects.get(pk=entry.pk).unread_count, 2)
+
+        # Already-read messages do not touch the counter
+        InboxService.mark_read(self.alice.id, {str(conversation.id): first.seq})
+        first.delete_message()
+        self.assertEqual(InboxEntry.objects.get(pk=entry.pk).unread_count, 1)
+        self.assertEqual(InboxEntry.objects.get(user=self.bob, conversation=conversation).unread_count, 0)
+
+    def test_list_query_count_is_constant_and_read_only(self):
+        def list_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/api/chat/conversations/')
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse([q for q in queries if not q['sql'].lstrip().upper().startswith('SELECT')])
+            return response, len(queries)
+
+        conversation = self.create_conversation(self.bob)
+        Message.objects.create(conversation=conversation, sender=self.bob, content='hi')
+        list_queries()  # warm middleware caches
+        _, baseline = list_queries()
+
+        for index in range(5):
+            other = User.objects.create_user(username=f'user{index}', email=f'user{index}@test.com', password='testpass123')
+            Message.objects.create(conversation=self.create_conversation(other), sender=other, content='hi')
+        response, queries = list_queries()
+
+        self.assertEqual(queries, baseline)
+        self.assertEqual(response.data['count'], 6)
+        row = response.data['results'][-1]
+        self.assertEqual(row['last_message']['content'], 'hi')
+        self.assertEqual(row['unread_count'], 1)
+        self.assertEqual(row['participant_count'], 2)
+
+    def test_last_message_rendered_like_message_serializer_once_per_page(self):
+        def message_queries(conversations):
+            with CaptureQueriesContext(connection) as queries:
+                data = ConversationSerializer(conversations, many=True).data
+            return data, len([q for q in queries if 'FROM "messages"' in q['sql']])
+
+        for index in range(3):
+            other = User.objects.create_user(username=f'user{index}', email=f'user{index}@test.com', password='testpass123')
+            conversation = self.create_conversation(other)
+            Message.objects.create(conversation=conversation, sender=other, content='older')
+            Message.objects.create(conversation=conversation, sender=other, content=f'latest {index}')
+        conversations = list(Conversation.objects.order_by('created_at'))
+
+        data, queries = message_queries(conversations[:1])
+        self.assertEqual(queries, 1)
+        data, queries = message_queries(conversations)
+        self.assertEqual(queries, 1)
+        latest = Message.objects.get(content='latest 2')
+        self.assertEqual(data[-1]['last_message'], MessageSerializer(latest).data)
+        # A single conversation renders its own
+        self.assertEqual(ConversationSerializer(conversations[-1]).data['last_message'], MessageSerializer(latest).data)
+
+
+class ReadWatermarkTests(APITestCase):
+    """Test read watermarks and unread counts."""
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', email='alice@test.com', password='testpass123')
+        self.bob = User.objects.create_user(username='bob', email='bob@test.com', password='testpass123')
+        self.client.force_authenticate(user=self.alice)
+
+    def test_mark_many_read_and_total_unread(self):
+        direct = Conversation.objects.create(conversation_type='individual')
+        direct.participants.add(self.alice, self.bob)
+        group = Group.objects.create(name='Team', created_by=self.bob)
+        group.add_member(self.bob, 'owner')
+        group.add_member(self.alice)
+        group_conversation = Conversation.objects.create(conversation_type='group', group=group)
+
+        messages = [Message(conversation=direct, sender=self.bob, content=str(index)) for index in range(3)]
+        messages += [Message(conversation=group_conversation, sender=self.bob, content='hi') for _ in range(2)]
+        MessageWriteBuffer.write(messages)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(InboxService.total_unread(self.alice.id), 5)
+
+        # Partial read of the direct conversation: one message left
+        response = self.client.post(f'/api/chat/conversations/{direct.id}/read/', {'seq': 2}, format='json')
+        self.assertEqual(response.data['total_unread'], 3)
+
+        response = self.client.post('/api/chat/conversations/read/', {
+            'conversations': [str(direct.id), str(group_conversation.id)]
+        }, format='json')
+        self.assertEqual(response.data['updated'], 2)
+        self.assertEqual(response.data['total_unread'], 0)
+        entry = InboxEntry.objects.get(user=self.alice, conversation=group_conversation)
+        self.assertEqual(entry.last_read_seq, 2)
+
+        # Watermarks never move backwards
+        self.client.post(f'/api/chat/conversations/{direct.id}/read/', {'seq': 1}, format='json')
+        self.assertEqual(InboxEntry.objects.get(user=self.alice, conversation=direct).last_read_seq, 3)
+
+
+class MessageSearchTests(APITestCase):
+    """Test the full-text message search index."""
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', email='alice@test.com', password='testpass123')
+        self.bob = User.objects.create_user(username='bob', email='bob@test.com', password='testpass123')
+        self.carol = User.objects.create_user(username='carol', email='carol@test.com', password='testpass123')
+        self.conversation = Conversation.objects.create(conversation_type='individual')
+        self.conversation.participants.add(self.alice, self.bob)
+        self.client.force_authenticate(user=self.alice)
+
+    def search(self, query, cursor=None):
+        params = {'q': query, 'type': 'messages'}
+        if cursor:
+            params['cursor'] = cursor
+        response = self.client.get('/api/chat/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return [message['content'] for message in response.data['results']['messages']], response.data['next_cursor']
+
+    def test_index_follows_edits_deletes_and_membership(self):
+        other = Conversation.objects.create(conversation_type='individual')
+        other.participants.add(self.bob, self.carol)
+        Message.objects.create(conversation=other, sender=self.bob, content='quarterly report draft')
+        message = Message.objects.create(conversation=self.conversation, sender=self.bob, content='quarterly budget')
+        MessageWriteBuffer.write([Message(conversation=self.conversation, sender=self.bob, content='report is ready')])
+
+        self.assertEqual(self.search('quarterly')[0], ['quarterly budget'])
+        self.assertEqual(self.search('rep')[0], ['report is ready'])
+
+        message.edit_content('annual budget')
+        self.assertEqual(self.search('quarterly')[0], [])
+        message.delete_message()
+        self.assertEqual(self.search('budget')[0], [])
+        message.restore_message()
+        self.assertEqual(self.search('budget')[0], ['annual budget'])
+
+    def test_cursor_pagination_and_rebuild(self):
+        MessageWriteBuffer.write([
+            Message(conversation=self.conversation, sender=self.bob, content=f'deploy note {index}')
+            for index in range(60)
+        ])
+        MessageSearch.backend().clear()
+        call_command('rebuild_search_index', chunk_size=25, stdout=StringIO())
+
+        first, cursor = self.search('deploy')
+        second, last_cursor = self.search('deploy', cursor)
+        self.assertEqual(len(first), 50)
+        self.assertIsNone(last_cursor)
+        self.assertEqual(sorted(first + second), sorted(f'deploy note {index}' for index in range(60)))
+
+
+class MessageHistoryPaginationTests(APITestCase):
+    """Test keyset pagination of message history."""
+
+    def test_cursor_pages_walk_history_without_count(self):
+        alice = User.objects.create_user(username='alice', email='alice@test.com', password='testpass123')
+        conversation = Conversation.objects.create(conversation_type='individual')
+        conversation.participants.add(alice)
+        for index in range(120):
+            Message.objects.create(conversation=conversation, sender=alice, content=str(index))
+        self.client.force_authenticate(user=alice)
+
+        url = f'/api/chat/conversations/{conversation.id}/messages/?limit=50'
+        seen = []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            self.assertFalse([q for q in queries if 'COUNT(' in q['sql'].upper()])
+            seen.extend(message['content'] for message in response.data['results'])
+            url = response.data['next']
+
+        self.assertEqual(seen, [str(index) for index in reversed(range(120))])
+
+        # Walking forward from the oldest page returns the newer neighbours
+        response = self.client.get(response.data['previous'])
+        self.assertEqual(
+            [message['content'] for message in response.data['results']],
+            [str(index) for index in reversed(range(20, 70))]
+        )
+
+
+class MessageRendererTests(TestCase):
+    """Test that the values() read path matches MessageSerializer."""
+
+    def test_render_matches_serializer(self):
+        alice = User.objects.create_user(username='alice', email='alice@test.com', password='testpass123')
+        bob = User.objects.create_user(username='bob', email='bob@test.com', password='testpass123')
+        conversation = Conversation.objects.create(conversation_type='individual')
+        conversation.participants.add(alice, bob)
+        first = Message.objects.create(conversation=conversation, sender=alice, content='first')
+        reply = Message.objects.create(conversation=conversation, sender=bob, content='reply', reply_to=first)
+        forward = Message.objects.create(conversation=conversation, sender=alice, content='fwd', forwarded_from=reply)
+        forward.edit_content('edited')
+        Attachment.objects.create(message=reply, file='attachments/a b.png', file_name='a b.png',
+                                  file_type='image', file_size=2048, mime_type='image/png')
+        Attachment.objects.create(message=reply, file='attachments/clip.mp4', file_name='clip.mp4',
+                                  file_type='video', file_size=5 * 1024 * 1024, mime_type='video/mp4',
+                                  thumbnail='thumbnails/clip.jpg', width=640, height=360, duration=75)
+        messages = conversation.messages.order_by('-timestamp', '-id')
+        request = APIRequestFactory().get('/')
+
+        with self.assertNumQueries(2):
+            rendered = MessageRenderer.render(MessageRenderer.values(messages), request)
+        expected = MessageSerializer(messages, many=True, context={'request': request}).data
+        self.assertEqual(JSONRenderer().render(rendered), JSONRenderer().render(expected))
+        self.assertEqual(
+            JSONRenderer().render(MessageRenderer.render_ids([forward.id, first.id])),
+            JSONRenderer().render(MessageSerializer([forward, first], many=True).data)
+        )
+
+
+class ConditionalGetTests(APITestCase):
+    """Test ETags on the polled list endpoints."""
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', email='alice@test.com', password='testpass123')
+        self.bob = User.objects.create_user(username='bob', email='bob@test.com', password='testpass123')
+        self.conversation = Conversation.objects.create(conversation_type='individual')
+        self.conversation.participants.add(self.alice, self.bob)
+        self.client.force_authenticate(user=self.alice)
+
+    def assert_revalidates(self, url, change):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_unchanged_lists_return_not_modified(self):
+        Message.objects.create(conversation=self.conversation, sender=self.bob, content='hi')
+        messages_url = f'/api/chat/conversations/{self.conversation.id}/messages/'
+        self.assert_revalidates(messages_url, lambda: Message.objects.create(
+            conversation=self.conversation, sender=self.bob, content='again'
+        ))
+        self.assert_revalidates('/api/chat/conversations/', lambda: InboxService.mark_read(
+            self.alice.id, {str(self.conversation.id): None}
+        ))
+
+        group = Group.objects.create(name='team', created_by=self.alice)
+        group.add_member(self.alice, role='owner')
+        self.assert_revalidates('/api/chat/groups/', lambda: group.add_member(self.bob))
+
+
+class OutboxTests(APITestCase):
+    """Test deferred side effects of sending a message."""
+
+    def test_send_records_events_applied_by_drain(self):
+        from users.models import UserActivity
+        from users.models_notification import Notification
+
+        alice = User.objects.create_user(username='alice', email='alice@test.com', password='testpass123')
+        bob = User.objects.create_user(username='bob', email='bob@test.com', password='testpass123')
+        admin = User.objects.create_user(username='root', email='root@test.com', password='testpass123', role='admin')
+        conversation, _ = Conversation.get_or_create_individual(alice.id, bob.id)
+        Outbox.drain_all()
+        self.client.force_authenticate(user=alice)
+
+        response = self.client.post(f'/api/chat/conversations/{conversation.id}/messages/', {'content': 'hi'})
+        self.assertEqual(response.status_code, 201)
+        # Admins only hear about sent messages through the periodic digest
+        self.assertEqual(set(OutboxEvent.objects.values_list('kind', flat=True)), {'message_sent'})
+        self.assertFalse(UserActivity.objects.filter(user=alice, action='message_sent').exists())
+
+        self.assertEqual(Outbox.drain(), 1)
+        self.assertFalse(OutboxEvent.objects.exists())
+        alice.refresh_from_db()
+        self.assertEqual(alice.message_count, 1)
+        self.assertTrue(UserActivity.objects.filter(user=alice, action='message_sent').exists())
+        self.assertTrue(Notification.objects.filter(user=alice, title='Message Sent').exists())
+        self.assertFalse(Notification.objects.filter(user=admin, title='New Message').exists())
+
+
+class OutboundQueueTests(TestCase):
+    """Test the bounded priority send queue."""
+
+    def test_lower_classes_dropped_and_coalesced_when_full(self):
+        class SlowSocket(OutboundQueueMixin, AsyncWebsocketConsumer):
+            MAX_QUEUE_SIZE = 3
+
+        async def scenario():
+            consumer = SlowSocket()
+            consumer.channel_name = 'test'
+            unblock = asyncio.Event()
+
+            async def base_send(message):
+                await unblock.wait()
+
+            consumer.base_send = base_send
+            await consumer.send(text_data='m0')
+            await asyncio.sleep(0)  # writer picks up m0 and blocks
+
+            await consumer.send(text_data='t1', priority=PRIORITY_TYPING, coalesce_key='room')
+            await consumer.send(text_data='t2', priority=PRIORITY_TYPING, coalesce_key='room')
+            await consumer.send(text_data='p1', priority=PRIORITY_PRESENCE)
+            await consumer.send(text_data='m1')
+            await consumer.send(text_data='m2')  # full: the typing frame is dropped
+            await consumer.send(text_data='p2', priority=PRIORITY_PRESENCE)  # full: dropped itself
+
+            queued = [[frame[0] for _, frame in queue] for queue in consumer.outbound_queues]
+            consumer.stop_outbound()
+            return queued
+
+        self.assertEqual(async_to_sync(scenario)(), [['m1', 'm2'], ['p1'], []])
+
+
+class LocalFanoutChannelLayerTests(TestCase):
+    """Test per-node fan-out with the in-memory channel layer double."""
+
+    def test_large_group_published_once_per_node(self):
+        from offchat_backend.channel_layers import InMemoryLocalFanoutChannelLayer
+
+        async def scenario(members_per_node, threshold):
+            broker = {}
+            nodes = [InMemoryLocalFanoutChannelLayer(fanout_threshold=threshold, broker=broker) for _ in range(3)]
+            channels = []
+            for node in nodes:
+                for _ in range(members_per_node):
+                    channel = await node.new_channel()
+                    await node.group_add('group_1', channel)
+                    channels.append((node, channel))
+
+            await nodes[0].group_send('group_1', {'type': 'new.message', 'id': 1})
+            received = [await node.receive(channel) for node, channel in channels]
+            self.assertTrue(all(message['id'] == 1 for message in received))
+            return nodes[0].fanout_stats['publishes']
+
+        self.assertEqual(async_to_sync(scenario)(50, threshold=100), 3)
+        self.assertEqual(async_to_sync(scenario)(10, threshold=100), 30)
+
+    def test_group_with_members_on_plain_node_not_fanned_out(self):
+        """A member on a node without fan-out still gets large-group messages."""
+        from offchat_backend.channel_layers import InMemoryLocalFanoutChannelLayer
+
+        async def scenario():
+            broker = {}
+            registered = InMemoryLocalFanoutChannelLayer(fanout_threshold=2, broker=broker)
+            plain = InMemoryLocalFanoutChannelLayer(fanout_threshold=2, broker=broker, fanout_enabled=False)
+            members = []
+            for node in (registered, plain):
+                channel = await node.new_channel()
+                await node.group_add('group_1', channel)
+                members.append((node, channel))
+
+            await registered.group_send('group_1', {'type': 'new.message', 'id': 1})
+            received = [await asyncio.wait_for(node.receive(channel), timeout=1) for node, channel in members]
+            self.assertEqual([message['id'] for message in received], [1, 1])
+            self.assertEqual(registered.fanout_stats['fanout_sends'], 0)
+
+        async_to_sync(scenario)()
+
+
+class ChunkedUploadTests(APITestCase):
+    """Test resumable chunked uploads."""
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+
+        self.alice = User.objects.create_user(username='alice', email='alice@test.com', password='testpass123')
+        bob = User.objects.create_user(username='bob', email='bob@test.com', password='testpass123')
+        conversation, _ = Conversation.get_or_create_individual(self.alice.id, bob.id)
+        self.message = Message.objects.create(conversation=conversation, sender=self.alice, content='photo')
+        self.client.force_authenticate(user=self.alice)
+        self.content = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 1200
+
+    def start(self, content, mime_type='image/png'):
+        response = self.client.post('/api/chat/uploads/', {
+            'message_id': str(self.message.id), 'file_name': 'photo.png',
+            'file_size': len(content), 'mime_type': mime_type,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def put(self, session_id, offset, data):
+        return self.client.generic(
+            'PUT', f'/api/chat/uploads/{session_id}/', data,
+            content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset)
+        )
+
+    def test_resume_after_interrupted_chunk_and_finalize(self):
+        import io
+        import os
+        from chat.models import UploadSession
+        from chat.services.chunked_upload import ChunkedUploadService
+
+        session_id = self.start(self.content)
+        response = self.put(session_id, 0, self.content[:100000])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Upload-Offset'], '100000')
+
+        # Connection drops 5000 bytes into the next chunk
+        session = UploadSession.objects.get(id=session_id)
+        ChunkedUploadService.append(session, 100000, io.BytesIO(self.content[100000:105000]), 100000)
+        response = self.client.get(f'/api/chat/uploads/{session_id}/')
+        self.assertEqual(response.data['offset'], 105000)
+
+        response = self.put(session_id, 100000, self.content[100000:200000])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['offset'], 105000)
+        self.assertEqual(self.put(session_id, 105000, self.content[105000:]).status_code, 200)
+
+        response = self.client.post(f'/api/chat/uploads/{session_id}/complete/')
+        self.assertEqual(response.status_code, 201)
+        attachment = Attachment.objects.get(message=self.message)
+        self.assertEqual((attachment.file_type, attachment.file_size), ('image', len(self.content)))
+        with attachment.file.open('rb') as stored:
+            self.assertEqual(stored.read(), self.content)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.listdir(ChunkedUploadService.staging_dir()))
+
+    def test_incomplete_or_mislabelled_uploads_rejected(self):
+        session_id = self.start(self.content)
+        self.put(session_id, 0, self.content[:1000])
+        response = self.client.post(f'/api/chat/uploads/{session_id}/complete/')
+        self.assertEqual((response.status_code, response.data['offset']), (409, 1000))
+
+        fake = b'not a png' * 10
+        session_id = self.start(fake)
+        self.put(session_id, 0, fake)
+        response = self.client.post(f'/api/chat/uploads/{session_id}/complete/')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Attachment.objects.exists())
+
+
+class MediaIngestTests(APITestCase):
+    """Test single-pass upload ingest."""
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.alice = User.objects.create_user(username='alice', email='alice@test.com', password='testpass123')
+        bob = User.objects.create_user(username='bob', email='bob@test.com', password='testpass123')
+        conversation, _ = Conversation.get_or_create_individual(self.alice.id, bob.id)
+        self.message = Message.objects.create(conversation=conversation, sender=self.alice, content='photo')
+
+    def upload(self, name, content, mime_type):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from rest_framework.test import force_authenticate
+        from chat.views_enhanced_upload import EnhancedFileUploadView
+
+        request = APIRequestFactory().post('/api/chat/upload/', {
+            'message_id': str(self.message.id), 'file': SimpleUploadedFile(name, content, mime_type),
+        }, format='multipart')
+        force_authenticate(request, user=self.alice)
+        return EnhancedFileUploadView.as_view()(request)
+
+    def stored_files(self):
+        import os
+        return [name for _, _, names in os.walk(self.media_root) for name in names]
+
+    def test_upload_stored_with_hash_and_dimensions(self):
+        import hashlib
+        import io
+        from PIL import Image
+
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 48), 'red').save(buffer, 'PNG')
+        content = buffer.getvalue()
+
+        response = self.upload('photo.png', content, 'image/png')
+        self.assertEqual(response.status_code, 201)
+        info = response.data['file_info']
+        self.assertEqual(info['hash'], hashlib.sha256(content).hexdigest())
+        self.assertEqual((info['size'], info['width'], info['height']), (len(content), 64, 48))
+
+        attachment = Attachment.objects.get(message=self.message)
+        self.assertEqual((attachment.width, attachment.height), (64, 48))
+        with attachment.file.open('rb') as stored:
+            self.assertEqual(stored.read(), content)
+        self.assertEqual(self.stored_files(), [attachment.file.name.rsplit('/', 1)[-1]])
+
+    def test_rejected_uploads_leave_nothing_stored(self):
+        from chat.services.media_ingest import IngestError, MediaIngest
+        from django.core.files.storage import FileSystemStorage
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        response = self.upload('photo.png', b'not a png' * 10, 'image/png')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Attachment.objects.exists())
+
+        # Over the limit while streaming, after the first chunks were written
+        processors = MediaIngest.processors_for('application/pdf')
+        processors[0].max_size = 100 * 1024
+        oversized = SimpleUploadedFile('doc.pdf', b'%PDF-1.7\n' + b'\0' * 200 * 1024, 'application/pdf')
+        with self.assertRaises(IngestError):
+            MediaIngest.ingest(oversized, 'attachments/doc.pdf', FileSystemStorage(), processors)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_signature_check_rejects_unknown_or_mismatched_headers(self):
+        from chat.media_handler import MediaHandler
+
+        png = b'\x89PNG\r\n\x1a\n' + b'\0' * 8
+        self.assertTrue(MediaHandler.matches_signature(png, 'image/png'))
+        self.assertTrue(MediaHandler.matches_signature(b'plain words here', 'text/plain'))
+        self.assertFalse(MediaHandler.matches_signature(png, 'image/webp'))
+        self.assertFalse(MediaHandler.matches_signature(b'\0\0\0\x18ftypmp42', 'video/mp4'))
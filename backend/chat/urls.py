@@ -17,6 +17,8 @@ from . import views
 urlpatterns = [
     # Conversation endpoints
     path('conversations/', views.ConversationListCreateView.as_view(), name='conversation_list_create'),
+    path('conversations/read/', views.MarkConversationsReadView.as_view(), name='mark_conversations_read'),
+    path('unread/', views.UnreadCountView.as_view(), name='unread_count'),
     path('conversations/<uuid:conversation_id>/', views.ConversationDetailView.as_view(), name='conversation_detail'),
     path('conversations/<uuid:conversation_id>/messages/', views.MessageListCreateView.as_view(), name='message_list_create'),
     path('conversations/<uuid:conversation_id>/messages/<uuid:message_id>/', views.MessageDetailView.as_view(), name='message_detail'),
@@ -33,6 +35,9 @@ urlpatterns = [
     # File upload endpoints
     path('upload/', views.FileUploadView.as_view(), name='file_upload'),
     path('attachments/<uuid:attachment_id>/', views.AttachmentDetailView.as_view(), name='attachment_detail'),
+    path('uploads/', views.UploadSessionCreateView.as_view(), name='upload_session_create'),
+    path('uploads/<uuid:session_id>/', views.UploadSessionDetailView.as_view(), name='upload_session_detail'),
+    path('uploads/<uuid:session_id>/complete/', views.UploadSessionCompleteView.as_view(), name='upload_session_complete'),
     
     # Search endpoints
     path('search/', views.SearchView.as_view(), name='search'),
@@ -40,6 +45,7 @@ urlpatterns = [
     # User status and notifications endpoints
     path('status/', views.UserStatusView.as_view(), name='user_status'),
     path('notifications/', views.RealTimeNotificationView.as_view(), name='notifications'),
+    path('realtime/metrics/', views.RealtimeMetricsView.as_view(), name='realtime_metrics'),
     
     # File cleanup and storage management endpoints (temporarily disabled)
     # path('storage/info/', file_cleanup_views.storage_info_view, name='storage_info'),
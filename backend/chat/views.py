@@ -1,22 +1,34 @@
 """
 Views for chat app.
 """
+import uuid
 from rest_framework import status, permissions, filters
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.views.decorators.http import require_http_methods
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Q
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Count, Max, Q
 from django.utils import timezone
-from .models import Group, GroupMember, Conversation, Message, Attachment, ConversationParticipant
+from .models import Group, GroupMember, Conversation, Message, Attachment, ConversationParticipant, InboxEntry, UploadSession
 from .serializers import (
-    ConversationSerializer, ConversationCreateSerializer,
+    ConversationSerializer, ConversationCreateSerializer, InboxEntrySerializer,
     MessageSerializer, MessageCreateSerializer, MessageUpdateSerializer,
     GroupSerializer, GroupCreateSerializer, GroupMemberSerializer,
     AttachmentSerializer, SearchSerializer
 )
+from .etags import make_etag, not_modified, with_etag
+from .pagination import MessageCursorPagination
+from .services.chunked_upload import ChunkedUploadService, OffsetMismatch, UploadBusy, UploadError
+from .services.inbox_service import InboxService
+from .services.message_renderer import MessageRenderer
+from .services.message_search import MessageSearch
+from .services.outbox import MESSAGE_SENT, Outbox
 from users.models import UserActivity, User
+from users.services.presence_service import PresenceService
+from users.services.user_search_service import UserSearchService
 
 
 class IsConversationParticipant(permissions.BasePermission):
@@ -58,24 +70,40 @@ class ConversationListCreateView(APIView):
     
     def get(self, request):
         try:
-            conversations = Conversation.objects.filter(
-                is_deleted=False
-            ).filter(
-                Q(participants=request.user) |
-                Q(conversation_type='group', group__members__user=request.user, group__members__status='active')
-            ).distinct().order_by('-last_message_at', '-created_at')
-            
-            # Update status for each conversation based on participant online status
-            for conv in conversations:
-                conv.update_status()
+            # Rendered from the inbox projection: one indexed query per page
+            entries = InboxEntry.objects.filter(
+                user=request.user,
+                conversation__is_deleted=False
+            ).select_related('conversation__group__created_by').order_by('-last_activity_at', '-id')
             
             from rest_framework.pagination import PageNumberPagination
             paginator = PageNumberPagination()
             paginator.page_size = 20
-            result_page = paginator.paginate_queryset(conversations, request)
-            
-            serializer = ConversationSerializer(result_page, many=True, context={'request': request})
-            return paginator.get_paginated_response(serializer.data)
+            result_page = paginator.paginate_queryset(entries, request)
+            
+            member_ids = {
+                int(member['id'])
+                for entry in result_page
+                for member in (entry.conversation.participant_summary or {}).get('members', [])
+            }
+            presence = PresenceService.get_statuses(member_ids)
+            etag = make_etag(request, paginator.page.paginator.count, sorted(
+                (member_id, entry['online_status']) for member_id, entry in presence.items()
+            ), *(
+                (entry.id, entry.last_activity_at, entry.unread_count, entry.last_read_seq,
+                 entry.conversation.last_seq, entry.conversation.updated_at,
+                 entry.conversation.group.updated_at if entry.conversation.group else None)
+                for entry in result_page
+            ))
+            response = not_modified(request, etag)
+            if response is not None:
+                return response
+            
+            serializer = InboxEntrySerializer(result_page, many=True, context={
+                'request': request,
+                'presence': presence,
+            })
+            return with_etag(paginator.get_paginated_response(serializer.data), etag)
         except Exception as e:
             import logging
             logger = logging.getLogger(__name__)
@@ -129,9 +157,6 @@ class ConversationDetailView(APIView):
                     'error': 'Permission denied'
                 }, status=status.HTTP_403_FORBIDDEN)
             
-            # Update status based on current participant online status
-            conversation.update_status()
-            
             serializer = ConversationSerializer(conversation, context={'request': request})
             return Response(serializer.data)
         
@@ -217,20 +242,27 @@ class MessageListCreateView(APIView):
             conversation = Conversation.objects.get(id=conversation_id)
             self.check_object_permissions(request, conversation)
             
-            # Update conversation status
-            conversation.update_status()
-            
-            # Get messages for this conversation
-            messages = conversation.messages.filter(is_deleted=False).order_by('-timestamp')
-            
-            # Apply pagination
-            from rest_framework.pagination import PageNumberPagination
-            paginator = PageNumberPagination()
-            paginator.page_size = 50
+            # last_seq moves on every insert, edit and delete; updated_at on
+            # conversation and attachment changes
+            etag = make_etag(request, conversation.last_seq, conversation.updated_at)
+            response = not_modified(request, etag)
+            if response is not None:
+                return response
+            
+            # Get messages for this conversation as rows for MessageRenderer
+            messages = MessageRenderer.values(conversation.messages.filter(is_deleted=False))
+            
+            # Keyset pagination by default; ?page= keeps the old numbered pages
+            if 'page' in request.query_params:
+                from rest_framework.pagination import PageNumberPagination
+                paginator = PageNumberPagination()
+                paginator.page_size = 50
+                messages = messages.order_by('-timestamp', '-id')
+            else:
+                paginator = MessageCursorPagination()
             result_page = paginator.paginate_queryset(messages, request)
             
-            serializer = MessageSerializer(result_page, many=True)
-            return paginator.get_paginated_response(serializer.data)
+            return with_etag(paginator.get_paginated_response(MessageRenderer.render(result_page)), etag)
         
         except Conversation.DoesNotExist:
             return Response({
@@ -247,23 +279,18 @@ class MessageListCreateView(APIView):
                 context={'request': request, 'conversation_id': conversation_id}
             )
             if serializer.is_valid():
-                message = serializer.save()
-                
-                # Increment user's message count
-                request.user.increment_message_count()
-                
-                # Update conversation activity and status
-                conversation.update_activity()
-                conversation.update_status()
-                
-                # Log user activity
-                UserActivity.objects.create(
-                    user=request.user,
-                    action='message_sent',
-                    description=f'Sent message in {conversation}',
-                    ip_address=self.get_client_ip(request),
-                    user_agent=request.META.get('HTTP_USER_AGENT', '')
-                )
+                # Counters, activity and notifications are applied by the
+                # outbox worker after commit (chat.services.outbox)
+                with transaction.atomic():
+                    message = serializer.save()
+                    Outbox.record(MESSAGE_SENT, {
+                        'sender_id': request.user.id,
+                        'conversation_id': str(conversation.id),
+                        'group_id': str(conversation.group_id) if conversation.group_id else None,
+                        'sent_at': message.timestamp.isoformat(),
+                        'ip_address': self.get_client_ip(request),
+                        'user_agent': request.META.get('HTTP_USER_AGENT', ''),
+                    })
                 
                 serializer = MessageSerializer(message)
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -377,31 +404,22 @@ class MarkAsReadView(APIView):
     
     def post(self, request, conversation_id):
         try:
-            conversation = Conversation.objects.get(id=conversation_id)
+            conversation = Conversation.objects.select_related('group').get(id=conversation_id)
             self.check_object_permissions(request, conversation)
             
-            # Mark conversation as read for current user
-            if conversation.conversation_type == 'group':
-                # For group conversations, mark as read in group membership
-                try:
-                    member = conversation.group.members.get(user=request.user)
-                    member.mark_as_read()
-                except GroupMember.DoesNotExist:
-                    return Response({
-                        'error': 'You are not a member of this group'
-                    }, status=status.HTTP_403_FORBIDDEN)
-            else:
-                # For individual conversations, mark as read in participant record
-                try:
-                    participant = conversation.participants.get(id=request.user.id)
-                    participant.mark_as_read()
-                except ConversationParticipant.DoesNotExist:
-                    return Response({
-                        'error': 'You are not a participant in this conversation'
-                    }, status=status.HTTP_403_FORBIDDEN)
+            # Optional seq marks read up to that message; default is everything
+            seq = request.data.get('seq')
+            try:
+                seq = int(seq) if seq is not None else None
+            except (TypeError, ValueError):
+                return Response({
+                    'error': 'seq must be an integer'
+                }, status=status.HTTP_400_BAD_REQUEST)
             
+            InboxService.mark_read(request.user.id, {conversation.id: seq})
             return Response({
-                'message': 'Conversation marked as read'
+                'message': 'Conversation marked as read',
+                'total_unread': InboxService.total_unread(request.user.id)
             }, status=status.HTTP_200_OK)
         
         except Conversation.DoesNotExist:
@@ -410,6 +428,51 @@ class MarkAsReadView(APIView):
             }, status=status.HTTP_404_NOT_FOUND)
 
 
+class MarkConversationsReadView(APIView):
+    """
+    Mark many conversations read in one call.
+    
+    Accepts ``{"conversations": [id, ...]}`` (read up to the latest message)
+    or ``{"conversations": {id: seq_or_null, ...}}``. Only the caller's own
+    inbox entries are touched, so unknown ids are ignored.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    MAX_CONVERSATIONS = 500
+    
+    def post(self, request):
+        conversations = request.data.get('conversations')
+        if isinstance(conversations, list):
+            conversations = {conversation_id: None for conversation_id in conversations}
+        if not isinstance(conversations, dict) or len(conversations) > self.MAX_CONVERSATIONS:
+            return Response({
+                'error': f'conversations must be a list or mapping of at most {self.MAX_CONVERSATIONS} ids'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            watermarks = {
+                uuid.UUID(str(conversation_id)): int(seq) if seq is not None else None
+                for conversation_id, seq in conversations.items()
+            }
+        except (TypeError, ValueError):
+            return Response({
+                'error': 'Invalid conversation id or seq'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        updated = InboxService.mark_read(request.user.id, watermarks)
+        return Response({
+            'updated': updated,
+            'total_unread': InboxService.total_unread(request.user.id)
+        }, status=status.HTTP_200_OK)
+
+
+class UnreadCountView(APIView):
+    """Total unread messages across the user's conversations."""
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get(self, request):
+        return Response({'total_unread': InboxService.total_unread(request.user.id)})
+
+
 class GroupListCreateView(APIView):
     """Group list and create view."""
     permission_classes = [permissions.IsAuthenticated]
@@ -421,6 +484,20 @@ class GroupListCreateView(APIView):
             Q(created_by=request.user)
         ).filter(is_deleted=False).distinct().order_by('-last_activity', '-created_at')
         
+        # Stamp the groups and their memberships (GroupMember.last_activity is
+        # auto_now, so role and status changes move it) before serializing
+        group_ids = groups.values('id')
+        group_stamp = Group.objects.filter(id__in=group_ids).aggregate(
+            count=Count('id'), updated=Max('updated_at'), activity=Max('last_activity')
+        )
+        member_stamp = GroupMember.objects.filter(group_id__in=group_ids).aggregate(
+            count=Count('id'), changed=Max('last_activity'), users=Max('user__updated_at')
+        )
+        etag = make_etag(request, *group_stamp.values(), *member_stamp.values())
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+        
         # Apply pagination
         from rest_framework.pagination import PageNumberPagination
         paginator = PageNumberPagination()
@@ -428,7 +505,7 @@ class GroupListCreateView(APIView):
         result_page = paginator.paginate_queryset(groups, request)
         
         serializer = GroupSerializer(result_page, many=True, context={'request': request})
-        return paginator.get_paginated_response(serializer.data)
+        return with_etag(paginator.get_paginated_response(serializer.data), etag)
     
     def post(self, request):
         serializer = GroupCreateSerializer(
@@ -777,7 +854,7 @@ class FileUploadView(APIView):
             }, status=status.HTTP_400_BAD_REQUEST)
         
         try:
-            message = Message.objects.get(id=message_id)
+            message = Message.objects.select_related('conversation').get(id=message_id)
             if not message.conversation.is_participant(request.user):
                 return Response({
                     'file': ['Permission denied']
@@ -843,13 +920,153 @@ class FileUploadView(APIView):
         return ip
 
 
+def upload_session_data(session):
+    return {
+        'id': str(session.id),
+        'file_name': session.file_name,
+        'file_size': session.file_size,
+        'mime_type': session.mime_type,
+        'offset': session.offset,
+        'chunk_size': ChunkedUploadService.MAX_CHUNK_SIZE,
+    }
+
+
+def upload_error_response(error):
+    """Map a ChunkedUploadService error to a response; conflicts carry the offset to resume from."""
+    if isinstance(error, OffsetMismatch):
+        response = Response({'error': str(error), 'offset': error.offset}, status=status.HTTP_409_CONFLICT)
+        response['Upload-Offset'] = str(error.offset)
+        return response
+    if isinstance(error, UploadBusy):
+        return Response({'error': str(error)}, status=status.HTTP_409_CONFLICT)
+    return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class UploadSessionCreateView(APIView):
+    """Start a resumable chunked upload (see chat.services.chunked_upload)."""
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def post(self, request):
+        message_id = request.data.get('message_id')
+        file_name = request.data.get('file_name')
+        mime_type = request.data.get('mime_type') or 'application/octet-stream'
+        try:
+            file_size = int(request.data.get('file_size'))
+        except (TypeError, ValueError):
+            file_size = None
+        if not message_id or not file_name or file_size is None:
+            return Response({
+                'error': 'message_id, file_name and file_size are required'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            message = Message.objects.select_related('conversation').get(id=message_id)
+        except (Message.DoesNotExist, ValueError, ValidationError):
+            return Response({'error': 'Message not found'}, status=status.HTTP_404_NOT_FOUND)
+        if not message.conversation.is_participant(request.user):
+            return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+        
+        try:
+            session = ChunkedUploadService.create(request.user, message, file_name, mime_type, file_size)
+        except UploadError as e:
+            return upload_error_response(e)
+        return Response(upload_session_data(session), status=status.HTTP_201_CREATED)
+
+
+class UploadSessionDetailView(APIView):
+    """
+    Resume state (GET), chunk upload (PUT) and abort (DELETE) of an upload.
+    
+    PUT bodies are raw bytes (``application/octet-stream``) starting at the
+    ``Upload-Offset`` header; they are streamed to the staging file and never
+    read into memory as a whole.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_session(self, request, session_id):
+        try:
+            return UploadSession.objects.get(id=session_id, user=request.user)
+        except UploadSession.DoesNotExist:
+            return None
+    
+    def get(self, request, session_id):
+        session = self.get_session(request, session_id)
+        if session is None:
+            return Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+        response = Response(upload_session_data(session))
+        response['Upload-Offset'] = str(session.offset)
+        return response
+    
+    def put(self, request, session_id):
+        session = self.get_session(request, session_id)
+        if session is None:
+            return Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            offset = int(request.META['HTTP_UPLOAD_OFFSET'])
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except (KeyError, ValueError):
+            return Response({'error': 'Upload-Offset and Content-Length headers are required'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            # The Django request, not request.data: the body is streamed, never parsed
+            new_offset = ChunkedUploadService.append(session, offset, request._request, length)
+        except UploadError as e:
+            return upload_error_response(e)
+        response = Response({'offset': new_offset, 'file_size': session.file_size})
+        response['Upload-Offset'] = str(new_offset)
+        return response
+    
+    def delete(self, request, session_id):
+        session = self.get_session(request, session_id)
+        if session is None:
+            return Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+        ChunkedUploadService.discard(session)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UploadSessionCompleteView(APIView):
+    """Finalize a fully received upload into an Attachment."""
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def post(self, request, session_id):
+        try:
+            session = UploadSession.objects.get(id=session_id, user=request.user)
+        except UploadSession.DoesNotExist:
+            return Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        try:
+            attachment = ChunkedUploadService.finalize(session)
+        except UploadError as e:
+            return upload_error_response(e)
+        
+        UserActivity.objects.create(
+            user=request.user,
+            action='file_uploaded',
+            description=f'Uploaded file {attachment.file_name}',
+            ip_address=self.get_client_ip(request),
+            user_agent=request.META.get('HTTP_USER_AGENT', '')
+        )
+        
+        serializer = AttachmentSerializer(attachment, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    
+    def get_client_ip(self, request):
+        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+        if x_forwarded_for:
+            ip = x_forwarded_for.split(',')[0]
+        else:
+            ip = request.META.get('REMOTE_ADDR')
+        return ip
+
+
 class AttachmentDetailView(APIView):
     """Attachment detail view."""
     permission_classes = [permissions.IsAuthenticated]
     
     def get(self, request, attachment_id):
         try:
-            attachment = Attachment.objects.get(id=attachment_id)
+            attachment = Attachment.objects.select_related('message__conversation').get(id=attachment_id)
             
             # Check if user is participant in the conversation
             if not attachment.message.conversation.is_participant(request.user):
@@ -867,7 +1084,7 @@ class AttachmentDetailView(APIView):
     
     def delete(self, request, attachment_id):
         try:
-            attachment = Attachment.objects.get(id=attachment_id)
+            attachment = Attachment.objects.select_related('message__conversation').get(id=attachment_id)
             
             # Check if user is participant in the conversation
             if not attachment.message.conversation.is_participant(request.user):
@@ -876,7 +1093,7 @@ class AttachmentDetailView(APIView):
                 }, status=status.HTTP_403_FORBIDDEN)
             
             # Check if user can delete this attachment (message sender or admin)
-            if attachment.message.sender != request.user and not request.user.has_perm('chat.delete_attachment'):
+            if attachment.message.sender_id != request.user.id and not request.user.has_perm('chat.delete_attachment'):
                 return Response({
                     'error': 'You can only delete your own attachments or need appropriate permissions'
                 }, status=status.HTTP_403_FORBIDDEN)
@@ -945,15 +1162,19 @@ class SearchView(APIView):
                 context={'request': request}
             ).data
         
+        next_cursor = None
         if search_type in ['all', 'messages']:
-            # Search in messages
-            messages = Message.objects.filter(
-                conversation__participants=request.user,
-                is_deleted=False,
-                content__icontains=query
-            ).order_by('-timestamp')[:50]
+            # Full-text search over the caller's conversations, ranked
+            try:
+                message_ids, next_cursor = MessageSearch.search(
+                    request.user.id, query, limit=50, cursor=request.query_params.get('cursor')
+                )
+            except ValueError:
+                return Response({
+                    'error': 'Invalid cursor'
+                }, status=status.HTTP_400_BAD_REQUEST)
             
-            results['messages'] = MessageSerializer(messages, many=True).data
+            results['messages'] = MessageRenderer.render_ids(message_ids)
         
         if search_type in ['all', 'groups']:
             # Search in groups
@@ -974,12 +1195,11 @@ class SearchView(APIView):
         
         if search_type in ['all', 'users']:
             # Search in users
-            users = User.objects.filter(
-                Q(username__icontains=query) |
-                Q(first_name__icontains=query) |
-                Q(last_name__icontains=query) |
-                Q(email__icontains=query)
-            ).filter(is_active=True)[:20]
+            user_ids = UserSearchService.search_ids(query, limit=20)
+            users = sorted(
+                User.objects.filter(id__in=user_ids, is_active=True),
+                key=lambda user: user_ids.index(user.id)
+            )
             
             from users.serializers import UserSerializer
             results['users'] = UserSerializer(users, many=True).data
@@ -987,7 +1207,8 @@ class SearchView(APIView):
         return Response({
             'query': query,
             'search_type': search_type,
-            'results': results
+            'results': results,
+            'next_cursor': next_cursor
         })
 
 
@@ -1004,23 +1225,22 @@ class UserStatusView(APIView):
                 'error': 'user_ids parameter is required'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        from django.core.cache import cache
+        valid_ids = [int(user_id) for user_id in user_ids if str(user_id).isdigit()]
+        users = User.objects.filter(id__in=valid_ids).only('id', 'username', 'last_seen')
+        statuses = PresenceService.get_statuses(valid_ids)
         user_statuses = []
         
-        for user_id in user_ids:
-            try:
-                user = User.objects.get(id=user_id)
-                cache_key = f'user_online_{user_id}'
-                is_online = cache.get(cache_key, False)
-                
-                user_statuses.append({
-                    'user_id': int(user_id),
-                    'username': user.username,
-                    'is_online': is_online,
-                    'last_seen': user.last_seen.isoformat() if user.last_seen else None,
-                })
-            except User.DoesNotExist:
-                continue
+        for user in users:
+            entry = statuses.get(user.id)
+            online_status = entry['online_status'] if entry else 'offline'
+            last_seen = (entry and entry['last_seen']) or user.last_seen
+            
+            user_statuses.append({
+                'user_id': user.id,
+                'username': user.username,
+                'is_online': 'away' if online_status == 'away' else online_status == 'online',
+                'last_seen': last_seen.isoformat() if last_seen else None,
+            })
         
         return Response({
             'users': user_statuses
@@ -1035,20 +1255,11 @@ class UserStatusView(APIView):
                 'error': 'Invalid status action'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        from django.core.cache import cache
-        
-        cache_key = f'user_online_{request.user.id}'
-        
-        if status_action == 'online':
-            cache.set(cache_key, True, timeout=300)  # 5 minutes
-        elif status_action == 'away':
-            cache.set(cache_key, 'away', timeout=300)  # 5 minutes
-        else:  # offline
-            cache.delete(cache_key)
-        
-        # Update user's last_seen
-        request.user.last_seen = timezone.now()
-        request.user.save(update_fields=['last_seen'])
+        if status_action == 'offline':
+            PresenceService.mark_offline(request.user.id)
+        else:
+            PresenceService.heartbeat(request.user.id, status_action)
+        PresenceService.flush_if_due()
         
         return Response({
             'message': f'Status updated to {status_action}',
@@ -1056,49 +1267,64 @@ class UserStatusView(APIView):
         })
 
 
+class RealtimeMetricsView(APIView):
+    """WebSocket send queue metrics for every worker that reported recently."""
+    permission_classes = [permissions.IsAdminUser]
+    
+    def get(self, request):
+        from chat.services.send_queue import SendQueueMetrics
+        
+        return Response({
+            'workers': SendQueueMetrics.all_workers(),
+        })
+
+
 class RealTimeNotificationView(APIView):
-    """Real-time notification management view."""
+    """
+    Real-time notification management view.
+    
+    Serves the user's notification stream from NotificationInbox; new
+    entries are also pushed over the user's WebSocket, so clients only need
+    this on (re)connect.
+    """
     permission_classes = [permissions.IsAuthenticated]
     
     def get(self, request):
-        """Get unread notifications for user."""
-        from django.core.cache import cache
+        """Get the user's latest notifications and unread count."""
+        from users.services.notification_inbox import NotificationInbox
         
-        cache_key = f'notifications_{request.user.id}'
-        notifications = cache.get(cache_key, [])
+        notifications = NotificationInbox.recent(request.user.id)
+        unread_count = NotificationInbox.unread_count(request.user.id)
         
-        return Response({
+        etag = make_etag(request, unread_count, *((n['id'], n['is_read']) for n in notifications))
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+        
+        return with_etag(Response({
             'notifications': notifications,
-            'count': len(notifications)
-        })
+            'count': len(notifications),
+            'unread_count': unread_count,
+        }), etag)
     
     def post(self, request):
         """Mark notifications as read."""
-        notification_ids = request.data.get('notification_ids', [])
+        from users.services.notification_inbox import NotificationInbox
         
-        from django.core.cache import cache
-        cache_key = f'notifications_{request.user.id}'
-        notifications = cache.get(cache_key, [])
-        
-        # Mark notifications as read
-        for notification_id in notification_ids:
-            for notification in notifications:
-                if notification.get('id') == notification_id:
-                    notification['read'] = True
-                    break
-        
-        cache.set(cache_key, notifications, timeout=3600)  # 1 hour
+        notification_ids = request.data.get('notification_ids', [])
+        updated_count = NotificationInbox.mark_read(request.user.id, notification_ids)
         
         return Response({
             'message': 'Notifications marked as read',
-            'updated_count': len([n for n in notifications if n.get('read', False)])
+            'updated_count': updated_count,
+            'unread_count': NotificationInbox.unread_count(request.user.id),
         })
     
     def delete(self, request):
-        """Clear all notifications."""
-        from django.core.cache import cache
-        cache_key = f'notifications_{request.user.id}'
-        cache.delete(cache_key)
+        """Clear the notification stream; history stays available."""
+        from users.services.notification_inbox import NotificationInbox
+        
+        NotificationInbox.clear_stream(request.user.id)
         
         return Response({
             'message': 'All notifications cleared'
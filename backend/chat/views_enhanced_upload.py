@@ -6,14 +6,11 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
-import os
-import tempfile
-
 from .models import Message, Attachment
 from .serializers import AttachmentSerializer
 from .media_handler import MediaHandler, MediaCategory
+from .services.chunked_upload import ChunkedUploadService
+from .services.media_ingest import IngestError, MediaIngest
 from users.models import UserActivity
 
 
@@ -36,7 +33,7 @@ class EnhancedFileUploadView(APIView):
             }, status=status.HTTP_400_BAD_REQUEST)
         
         try:
-            message = Message.objects.get(id=message_id)
+            message = Message.objects.select_related('conversation').get(id=message_id)
             if not message.conversation.is_participant(request.user):
                 return Response({
                     'error': 'Permission denied'
@@ -71,67 +68,54 @@ class EnhancedFileUploadView(APIView):
                 'file_size_mb': round(file.size / (1024 * 1024), 2)
             }, status=status.HTTP_400_BAD_REQUEST)
         
+        # Single pass: size, signature, hash and image dimensions are taken
+        # while the upload streams into its final storage path
+        attachment = Attachment(
+            message=message,
+            file_name=file.name,
+            file_type=ChunkedUploadService.FILE_TYPES.get(category, 'other'),
+            file_size=file.size,
+            mime_type=mime_type
+        )
+        name = Attachment._meta.get_field('file').generate_filename(attachment, file.name)
+        storage = attachment.file.storage
         try:
-            # Validate magic number
-            with tempfile.NamedTemporaryFile(delete=False) as tmp:
-                for chunk in file.chunks():
-                    tmp.write(chunk)
-                tmp_path = tmp.name
-            
-            is_valid, error_msg = MediaHandler.validate_file(
-                tmp_path, mime_type, file.size
-            )
-            
-            if not is_valid:
-                os.unlink(tmp_path)
-                return Response({
-                    'error': error_msg
-                }, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Get file info
-            file_info = MediaHandler.get_file_info(tmp_path, mime_type)
-            
-            # Determine file type
-            file_type = 'image' if category == MediaCategory.IMAGE else \
-                       'video' if category == MediaCategory.VIDEO else \
-                       'audio' if category == MediaCategory.AUDIO else \
-                       'document' if category == MediaCategory.DOCUMENT else \
-                       'other'
-            
-            # Create attachment
-            attachment = Attachment.objects.create(
-                message=message,
-                file=file,
-                file_name=file.name,
-                file_type=file_type,
-                file_size=file.size,
-                mime_type=mime_type
-            )
-            
-            # Log activity
-            UserActivity.objects.create(
-                user=request.user,
-                action='file_uploaded',
-                description=f'Uploaded {category.value}: {attachment.file_name}',
-                ip_address=self.get_client_ip(request),
-                user_agent=request.META.get('HTTP_USER_AGENT', '')
-            )
-            
-            # Clean up temp file
-            os.unlink(tmp_path)
-            
-            serializer = AttachmentSerializer(attachment, context={'request': request})
+            result = MediaIngest.ingest(file, name, storage, MediaIngest.processors_for(mime_type))
+        except IngestError as e:
+            return Response({
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
             return Response({
-                'attachment': serializer.data,
-                'file_info': file_info
-            }, status=status.HTTP_201_CREATED)
+                'error': f'Upload failed: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
+        try:
+            attachment.file.name = result['name']
+            attachment.file_size = result['size']
+            attachment.width = result.get('width')
+            attachment.height = result.get('height')
+            attachment.save()
         except Exception as e:
-            if os.path.exists(tmp_path):
-                os.unlink(tmp_path)
+            storage.delete(result['name'])
             return Response({
                 'error': f'Upload failed: {str(e)}'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        # Log activity
+        UserActivity.objects.create(
+            user=request.user,
+            action='file_uploaded',
+            description=f'Uploaded {category.value}: {attachment.file_name}',
+            ip_address=self.get_client_ip(request),
+            user_agent=request.META.get('HTTP_USER_AGENT', '')
+        )
+        
+        serializer = AttachmentSerializer(attachment, context={'request': request})
+        return Response({
+            'attachment': serializer.data,
+            'file_info': MediaIngest.file_info(file, mime_type, result)
+        }, status=status.HTTP_201_CREATED)
     
     def get_client_ip(self, request):
         x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
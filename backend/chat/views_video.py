@@ -30,7 +30,7 @@ class VideoUploadView(APIView):
             }, status=status.HTTP_400_BAD_REQUEST)
         
         try:
-            message = Message.objects.get(id=message_id)
+            message = Message.objects.select_related('conversation').get(id=message_id)
             if not message.conversation.is_participant(request.user):
                 return Response({
                     'file': ['Permission denied']
@@ -102,7 +102,7 @@ class VideoDownloadView(APIView):
     
     def get(self, request, attachment_id):
         try:
-            attachment = Attachment.objects.get(id=attachment_id)
+            attachment = Attachment.objects.select_related('message__conversation').get(id=attachment_id)
             
             if attachment.file_type != 'video':
                 return Response({
@@ -15,7 +15,23 @@ app.autodiscover_tasks()
 app.conf.beat_schedule = {
     'cleanup-online-status': {
         'task': 'users.tasks.cleanup_online_status',
-        'schedule': 10.0,  # Run every 10 seconds
+        'schedule': 30.0,  # Matches PRESENCE_FLUSH_INTERVAL
+    },
+    'drain-outbox': {
+        'task': 'chat.tasks.drain_outbox',
+        'schedule': 5.0,  # Catches events whose on-commit drain was lost
+    },
+    'flush-admin-digests': {
+        'task': 'users.tasks.flush_admin_digests',
+        'schedule': 60.0,  # Closes digest windows when no new activity arrives
+    },
+    'cleanup-stale-uploads': {
+        'task': 'chat.tasks.cleanup_stale_uploads',
+        'schedule': 3600.0,  # Removes staging files of abandoned chunked uploads
+    },
+    'cleanup-old-notifications': {
+        'task': 'users.notification_tasks.cleanup_old_notifications',
+        'schedule': crontab(hour=3, minute=30),  # Chunked purge of read notifications
     },
 }
 
@@ -0,0 +1,242 @@
+"""
+Channel layers that fan large groups out locally on each ASGI node.
+
+``RedisChannelLayer.group_send`` writes one copy of the message per member
+channel. For groups with thousands of members that is thousands of Redis
+writes per chat message. Groups with at least ``fanout_threshold`` members
+are instead published once to every node that has a local member; the node
+copies the message into the receive buffers of its own channels. Smaller
+groups keep the normal per-channel behaviour.
+
+Membership is still recorded in the regular group sorted set. A group only
+takes the fan-out path when every member channel belongs to a node that
+registered for fan-out; while any member is on a node still running plain
+``RedisChannelLayer`` the group gets per-channel sends, so the layer can be
+rolled out node by node without dropping messages.
+``InMemoryLocalFanoutChannelLayer`` implements the same behaviour across
+in-process "nodes" for tests and load experiments without Redis.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer
+from channels_redis.core import RedisChannelLayer
+
+logger = logging.getLogger(__name__)
+
+FANOUT_GROUP_KEY = '__fanout_group__'
+FANOUT_NODE_SUFFIX = 'fanout'
+
+
+def node_prefix(channel):
+    """The ``specific.<client prefix>!`` part shared by a node's channels."""
+    return channel[:channel.index('!') + 1] if '!' in channel else None
+
+
+class LocalFanoutMixin:
+    """
+    Bookkeeping shared by the Redis layer and its in-memory double.
+
+    ``local_groups`` maps each group to the channels of this node that are
+    members of it; ``fanout_stats`` counts cross-node publishes and local
+    deliveries so the two send paths can be compared.
+    """
+
+    DEFAULT_FANOUT_THRESHOLD = 100
+
+    def setup_fanout(self, fanout_threshold=None):
+        self.fanout_threshold = fanout_threshold or self.DEFAULT_FANOUT_THRESHOLD
+        self.local_groups = {}
+        self.fanout_stats = Counter()
+
+    def track_local(self, group, channel):
+        """Record a local member; returns True if it is the node's first one."""
+        members = self.local_groups.setdefault(group, set())
+        first = not members
+        members.add(channel)
+        return first
+
+    def untrack_local(self, group, channel):
+        """Forget a local member; returns True if the node has none left."""
+        members = self.local_groups.get(group)
+        if not members or channel not in members:
+            return False
+        members.discard(channel)
+        if members:
+            return False
+        del self.local_groups[group]
+        return True
+
+    async def deliver_local(self, group, message):
+        """Hand a fanned-out message to every local member of the group."""
+        for channel in list(self.local_groups.get(group, ())):
+            try:
+                await self.deliver(channel, dict(message))
+                self.fanout_stats['local_deliveries'] += 1
+            except ChannelFull:
+                logger.debug(f"Dropped fan-out message for full channel {channel}")
+
+
+class LocalFanoutRedisChannelLayer(LocalFanoutMixin, RedisChannelLayer):
+    """
+    RedisChannelLayer publishing large groups once per node.
+
+    Every node with a local member of a group keeps its node channel in
+    ``<prefix>:fanout:<group>``. The node channel shares the process-local
+    Redis list with the node's consumer channels, so whichever coroutine is
+    reading that list picks the message up and a background task copies it
+    to the local members.
+    """
+
+    def __init__(self, *args, fanout_threshold=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.setup_fanout(fanout_threshold)
+        self.node_channel = f'specific.{self.client_prefix}!{FANOUT_NODE_SUFFIX}'
+        self.fanout_task = None
+
+    def _fanout_key(self, group):
+        return f'{self.prefix}:fanout:{group}'.encode('utf8')
+
+    def is_local_channel(self, channel):
+        return '!' in channel and self.non_local_name(channel).endswith(self.client_prefix + '!')
+
+    async def group_add(self, group, channel):
+        await super().group_add(group, channel)
+        if not self.is_local_channel(channel):
+            return
+        self.track_local(group, channel)
+        # Refresh the node entry on every join so it outlives group_expiry
+        connection = self.connection(self.consistent_hash(group))
+        key = self._fanout_key(group)
+        await connection.zadd(key, {self.node_channel: time.time()})
+        await connection.expire(key, self.group_expiry)
+        self.ensure_fanout_receiver()
+
+    async def group_discard(self, group, channel):
+        await super().group_discard(group, channel)
+        if self.untrack_local(group, channel):
+            connection = self.connection(self.consistent_hash(group))
+            await connection.zrem(self._fanout_key(group), self.node_channel)
+
+    async def group_send(self, group, message):
+        assert self.valid_group_name(group), "Group name not valid"
+        connection = self.connection(self.consistent_hash(group))
+        group_key = self._group_key(group)
+        fanout_key = self._fanout_key(group)
+        expired = int(time.time()) - self.group_expiry
+        pipe = connection.pipeline()
+        pipe.zremrangebyscore(group_key, min=0, max=expired)
+        pipe.zrange(group_key, 0, -1)
+        pipe.zremrangebyscore(fanout_key, min=0, max=expired)
+        pipe.zrange(fanout_key, 0, -1)
+        _, members, _, nodes = await pipe.execute()
+
+        if len(members) < self.fanout_threshold or not self.all_on_fanout_nodes(members, nodes):
+            self.fanout_stats['publishes'] += len(members)
+            await super().group_send(group, message)
+            return
+
+        self.fanout_stats['fanout_sends'] += 1
+        for node in nodes:
+            try:
+                await self.send(node.decode('utf8'), {**message, FANOUT_GROUP_KEY: group})
+                self.fanout_stats['publishes'] += 1
+            except ChannelFull:
+                logger.warning(f"Fan-out node channel full, dropped {group} message for {node!r}")
+
+    @staticmethod
+    def all_on_fanout_nodes(members, nodes):
+        """True if every member channel lives on a node registered for fan-out."""
+        prefixes = {node_prefix(node.decode('utf8')) for node in nodes}
+        return bool(prefixes) and all(node_prefix(member.decode('utf8')) in prefixes for member in members)
+
+    async def deliver(self, channel, message):
+        self.receive_buffer[channel].put_nowait(message)
+
+    def ensure_fanout_receiver(self):
+        if self.fanout_task is None or self.fanout_task.done():
+            self.fanout_task = asyncio.get_running_loop().create_task(self.receive_fanout())
+
+    async def receive_fanout(self):
+        while self.local_groups:
+            message = await self.receive(self.node_channel)
+            group = message.pop(FANOUT_GROUP_KEY, None)
+            if group is not None:
+                await self.deliver_local(group, message)
+
+    async def flush(self):
+        if self.fanout_task is not None:
+            self.fanout_task.cancel()
+            self.fanout_task = None
+        self.local_groups = {}
+        await super().flush()
+
+
+class InMemoryLocalFanoutChannelLayer(LocalFanoutMixin, InMemoryChannelLayer):
+    """
+    In-memory double of LocalFanoutRedisChannelLayer.
+
+    Each instance acts as one node; instances sharing a ``broker`` dict see
+    each other's group members, the way nodes share Redis. ``fanout_stats``
+    counts ``publishes`` exactly as the Redis layer would issue writes. A
+    node created with ``fanout_enabled=False`` stands in for one still on
+    plain ``RedisChannelLayer``: its members count, but it takes no fan-out.
+    """
+
+    shared_broker = {}
+
+    def __init__(self, *args, fanout_threshold=None, broker=None, fanout_enabled=True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.setup_fanout(fanout_threshold)
+        self.fanout_enabled = fanout_enabled
+        # group -> {node: set of channels}
+        self.broker = self.shared_broker if broker is None else broker
+
+    async def group_add(self, group, channel):
+        await super().group_add(group, channel)
+        self.track_local(group, channel)
+        self.broker.setdefault(group, {})[self] = self.local_groups[group]
+
+    async def group_discard(self, group, channel):
+        await super().group_discard(group, channel)
+        if self.untrack_local(group, channel):
+            nodes = self.broker.get(group, {})
+            nodes.pop(self, None)
+            if not nodes:
+                self.broker.pop(group, None)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        assert self.valid_group_name(group), "Invalid group name"
+        nodes = list(self.broker.get(group, {}).items())
+        size = sum(len(channels) for _, channels in nodes)
+
+        if size < self.fanout_threshold or not all(node.fanout_enabled for node, _ in nodes):
+            for node, channels in nodes:
+                for channel in list(channels):
+                    self.fanout_stats['publishes'] += 1
+                    try:
+                        await node.send(channel, message)
+                    except ChannelFull:
+                        pass
+            return
+
+        self.fanout_stats['fanout_sends'] += 1
+        for node, _ in nodes:
+            self.fanout_stats['publishes'] += 1
+            await node.deliver_local(group, message)
+
+    async def deliver(self, channel, message):
+        await self.send(channel, message)
+
+    async def flush(self):
+        for group in list(self.local_groups):
+            nodes = self.broker.get(group, {})
+            nodes.pop(self, None)
+            if not nodes:
+                self.broker.pop(group, None)
+        self.local_groups = {}
+        await super().flush()
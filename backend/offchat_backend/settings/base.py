@@ -158,6 +158,15 @@ SIMPLE_JWT = {
     'TOKEN_TYPE_CLAIM': 'token_type',
 }
 
+# Message search backend (chat.services.message_search)
+MESSAGE_SEARCH_BACKEND = 'chat.services.message_search.SQLiteFTSSearchBackend'
+
+# Worker applying deferred side effects (chat.services.outbox): 'thread', 'celery' or 'sync'
+OUTBOX_WORKER = 'thread'
+
+# Seconds of routine admin activity summed into one digest notification (users.services.admin_activity_digest)
+ADMIN_DIGEST_WINDOW = 300
+
 # Celery Configuration
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
@@ -184,8 +193,10 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
 # File Upload Settings
-FILE_UPLOAD_MAX_MEMORY_SIZE = 2147483648  # 2048MB
-DATA_UPLOAD_MAX_MEMORY_SIZE = 2147483648  # 2048MB
+# Uploads above 2.5MB are spooled to a temporary file, not held in worker memory;
+# large files use the chunked upload API (chat.services.chunked_upload)
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5MB
+DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
 FILE_UPLOAD_PERMISSIONS = 0o644
 FILE_UPLOAD_DIRECTORY_PERMISSIONS = 0o755
 
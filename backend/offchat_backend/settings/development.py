@@ -111,8 +111,10 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
 # File Upload Settings (Development)
-FILE_UPLOAD_MAX_MEMORY_SIZE = 2147483648  # 2048MB
-DATA_UPLOAD_MAX_MEMORY_SIZE = 2147483648  # 2048MB
+# Uploads above 2.5MB are spooled to a temporary file, not held in worker memory;
+# large files use the chunked upload API (chat.services.chunked_upload)
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5MB
+DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
 
 # Logging Configuration
 LOGGING = {
@@ -44,9 +44,11 @@ REDIS_URL = config('REDIS_URL')
 # WebSocket channel layer configuration
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'BACKEND': 'offchat_backend.channel_layers.LocalFanoutRedisChannelLayer',
         'CONFIG': {
             "hosts": [REDIS_URL],
+            # Groups at least this large are published once per node
+            "fanout_threshold": config('CHANNEL_FANOUT_THRESHOLD', default=100, cast=int),
         },
     },
 }
@@ -60,6 +62,9 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 
+# Deferred side effects are drained by Celery workers
+OUTBOX_WORKER = 'celery'
+
 # Cache Configuration
 CACHES = {
     'default': {
@@ -12,7 +12,11 @@ logger = logging.getLogger(__name__)
 class InputValidationMiddleware(MiddlewareMixin):
     """Validate and sanitize incoming requests."""
     
+    # Multipart uploads still carry whole files up to the MediaHandler limits
+    # (500MB video); lower this once clients use chunked uploads (/api/chat/uploads/)
     MAX_BODY_SIZE = 2147483648  # 2048MB
+    # Endpoints that take raw byte bodies (upload chunks) or none at all (finalize)
+    RAW_BODY_PATHS = ('/api/chat/uploads/',)
     DANGEROUS_PATTERNS = [
         '<script',
         'javascript:',
@@ -39,7 +43,10 @@ class InputValidationMiddleware(MiddlewareMixin):
         # Validate JSON content type for API endpoints
         if request.path.startswith('/api/') and request.method in ['POST', 'PUT', 'PATCH']:
             content_type = request.META.get('CONTENT_TYPE', '')
-            if 'application/json' not in content_type and 'multipart/form-data' not in content_type:
+            raw_body = request.path.startswith(self.RAW_BODY_PATHS) and (
+                'application/octet-stream' in content_type or not request.META.get('CONTENT_LENGTH')
+            )
+            if 'application/json' not in content_type and 'multipart/form-data' not in content_type and not raw_body:
                 logger.warning(f"Invalid content type: {content_type} from {request.META.get('REMOTE_ADDR')}")
                 return JsonResponse(
                     {'error': 'Invalid content type. Use application/json or multipart/form-data'},
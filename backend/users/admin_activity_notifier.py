@@ -2,9 +2,10 @@
 Admin Activity Notification Service
 Sends notifications to admins for all system activities
 """
-from users.notification_utils import send_notification
 from users.models import User
 from utils.json_utils import prepare_metadata
+from chat.services.outbox import ADMIN_ACTIVITY, Outbox
+from users.services.admin_activity_digest import AdminActivityDigest
 import logging
 
 logger = logging.getLogger(__name__)
@@ -20,25 +21,29 @@ class AdminActivityNotifier:
             'type': 'system',
             'title': 'User Login',
             'message': '{username} logged in',
-            'priority': 'low'
+            'priority': 'low',
+            'digest': ('user login', 'user logins')
         },
         'USER_LOGOUT': {
             'type': 'system',
             'title': 'User Logout',
             'message': '{username} logged out',
-            'priority': 'low'
+            'priority': 'low',
+            'digest': ('user logout', 'user logouts')
         },
         'USER_CREATED': {
             'type': 'system',
             'title': 'New User Created',
             'message': 'New user {username} created',
-            'priority': 'medium'
+            'priority': 'medium',
+            'digest': ('new user created', 'new users created')
         },
         'USER_APPROVED': {
             'type': 'system',
             'title': 'User Approved',
             'message': 'User {username} has been approved',
-            'priority': 'medium'
+            'priority': 'medium',
+            'digest': ('user approved', 'users approved')
         },
         'USER_SUSPENDED': {
             'type': 'system',
@@ -58,37 +63,43 @@ class AdminActivityNotifier:
             'type': 'message',
             'title': 'New Message',
             'message': '{username} sent a message in {conversation}',
-            'priority': 'low'
+            'priority': 'low',
+            'digest': ('message sent', 'messages sent')
         },
         'MESSAGE_DELETED': {
             'type': 'message',
             'title': 'Message Deleted',
             'message': 'Message deleted in {conversation}',
-            'priority': 'medium'
+            'priority': 'medium',
+            'digest': ('message deleted', 'messages deleted')
         },
         'CONVERSATION_CREATED': {
             'type': 'system',
             'title': 'Conversation Created',
             'message': 'New conversation created: {conversation}',
-            'priority': 'low'
+            'priority': 'low',
+            'digest': ('conversation created', 'conversations created')
         },
         'GROUP_CREATED': {
             'type': 'system',
             'title': 'Group Created',
             'message': 'New group created: {group_name}',
-            'priority': 'medium'
+            'priority': 'medium',
+            'digest': ('group created', 'groups created')
         },
         'GROUP_JOINED': {
             'type': 'system',
             'title': 'Group Joined',
             'message': '{username} joined group {group_name}',
-            'priority': 'low'
+            'priority': 'low',
+            'digest': ('group join', 'group joins')
         },
         'MEMBER_ADDED': {
             'type': 'system',
             'title': 'Member Added',
             'message': '{username} added to {group_name}',
-            'priority': 'low'
+            'priority': 'low',
+            'digest': ('member added to a group', 'members added to groups')
         },
         
         # Security activities
@@ -108,7 +119,8 @@ class AdminActivityNotifier:
             'type': 'warning',
             'title': 'Rate Limit Exceeded',
             'message': 'Rate limit exceeded from {ip_address}',
-            'priority': 'medium'
+            'priority': 'medium',
+            'digest': ('rate limit hit', 'rate limit hits')
         },
         
         # Admin actions
@@ -122,21 +134,41 @@ class AdminActivityNotifier:
             'type': 'system',
             'title': 'Role Changed',
             'message': 'User {username} role changed to {new_role}',
-            'priority': 'medium'
+            'priority': 'medium',
+            'digest': ('role change', 'role changes')
         },
         'SYSTEM_SETTINGS_CHANGED': {
             'type': 'system',
             'title': 'System Settings Changed',
             'message': 'System settings updated',
-            'priority': 'medium'
+            'priority': 'medium',
+            'digest': ('settings change', 'settings changes')
         },
     }
     
+    # Severities that are always notified per event, even for digested activity types
+    IMMEDIATE_SEVERITIES = {'critical', 'error', 'high'}
+    
+    @classmethod
+    def is_digested(cls, activity_type, severity=None):
+        """Whether the activity is counted into a periodic digest instead of notified per event"""
+        config = cls.ACTIVITY_NOTIFICATIONS.get(activity_type)
+        return bool(
+            config and 'digest' in config
+            and config['priority'] != 'high'
+            and severity not in cls.IMMEDIATE_SEVERITIES
+        )
+    
     @classmethod
     def notify_admins(cls, activity_type, actor=None, target_type=None, 
                      target_id=None, metadata=None, severity=None):
         """
-        Send notification to all admins about an activity (synchronous)
+        Queue a notification to all admins about an activity
+        
+        The notification is recorded in the outbox with the caller's
+        transaction and fanned out to admins by ``deliver_admin_activity``.
+        Routine activity types are only counted; admins get one digest per
+        type and window from ``AdminActivityDigest``.
         
         Args:
             activity_type: Type of activity (e.g., 'USER_LOGIN')
@@ -152,6 +184,10 @@ class AdminActivityNotifier:
             if not config:
                 return
             
+            if cls.is_digested(activity_type, severity):
+                AdminActivityDigest.add(activity_type)
+                return
+            
             # Build notification message
             message_data = metadata or {}
             if actor:
@@ -164,31 +200,19 @@ class AdminActivityNotifier:
                 logger.warning(f"Failed to format notification message for {activity_type}: {str(e)}")
                 return
             
-            # Get all admin users
-            admins = User.objects.filter(role='admin', is_active=True).only('id', 'username')
-            
-            if not admins.exists():
-                return
-            
-            # Send notifications synchronously (no Celery/Redis needed)
-            for admin in admins:
-                try:
-                    send_notification(
-                        user=admin,
-                        notification_type=config['type'],
-                        title=title,
-                        message=message,
-                        data=prepare_metadata({
-                            'activity_type': activity_type,
-                            'actor_id': actor.id if actor else None,
-                            'target_type': target_type,
-                            'target_id': target_id,
-                            'severity': severity,
-                            'metadata': metadata or {}
-                        })
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to notify admin {admin.id}: {str(e)}", exc_info=False)
+            Outbox.record(ADMIN_ACTIVITY, {
+                'notification_type': config['type'],
+                'title': title,
+                'message': message,
+                'data': prepare_metadata({
+                    'activity_type': activity_type,
+                    'actor_id': actor.id if actor else None,
+                    'target_type': target_type,
+                    'target_id': target_id,
+                    'severity': severity,
+                    'metadata': metadata or {}
+                })
+            })
         
         except Exception as e:
             logger.error(f"Error in notify_admins: {str(e)}", exc_info=False)
@@ -212,10 +236,14 @@ class AdminActivityNotifier:
         if not message or not hasattr(message, 'conversation'):
             return
         try:
-            conversation_name = str(message.conversation)
             sender = actor or message.sender
             if not sender:
                 return
+            if cls.is_digested(activity_type):
+                # Digests only count events; skip the participant lookups of str(conversation)
+                AdminActivityDigest.add(activity_type)
+                return
+            conversation_name = str(message.conversation)
             cls.notify_admins(
                 activity_type=activity_type,
                 actor=sender,
@@ -269,3 +297,16 @@ class AdminActivityNotifier:
             metadata=data,
             severity='high'
         )
+
+
+def deliver_admin_activity(payloads):
+    """Outbox handler: one bulk insert of every queued notification for every active admin."""
+    from users.models_notification import Notification
+    from users.services.notification_inbox import NotificationInbox
+
+    admin_ids = list(User.objects.filter(role='admin', is_active=True).values_list('id', flat=True))
+    NotificationInbox.record(Notification.objects.bulk_create([
+        Notification(user_id=admin_id, **payload)
+        for payload in payloads
+        for admin_id in admin_ids
+    ], batch_size=1000))
@@ -5,79 +5,114 @@ from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
 from django.utils import timezone
-from rest_framework_simplejwt.tokens import AccessToken
+from users.services.presence_service import PresenceService
+from users.services.notification_inbox import NotificationInbox
+from chat.services.send_queue import OutboundQueueMixin, PRIORITY_PRESENCE
+import asyncio
 import json
 
 User = get_user_model()
 
 
-class PresenceConsumer(AsyncWebsocketConsumer):
+class PresenceDiffMixin:
+    """
+    Coalesce ``presence_update`` events into at most one ``presence_diff``
+    frame per socket every PRESENCE_DIFF_INTERVAL seconds.
+    """
+
+    PRESENCE_DIFF_INTERVAL = 1.0
+
+    async def presence_update(self, event):
+        if not hasattr(self, 'pending_presence'):
+            self.pending_presence = {}
+            self.presence_flush_task = None
+        # Later changes for the same user replace earlier ones
+        self.pending_presence[event["user_id"]] = {
+            "user_id": event["user_id"],
+            "username": event["username"],
+            "online_status": event["online_status"],
+        }
+        if self.presence_flush_task is None:
+            self.presence_flush_task = asyncio.ensure_future(self.flush_presence_diff())
+
+    async def flush_presence_diff(self):
+        await asyncio.sleep(self.PRESENCE_DIFF_INTERVAL)
+        changes = list(self.pending_presence.values())
+        self.pending_presence = {}
+        self.presence_flush_task = None
+        if changes:
+            await self.send_presence_diff(changes)
+
+    async def send_presence_diff(self, changes):
+        await self.send(text_data=json.dumps({
+            "type": "presence_diff",
+            "changes": changes,
+        }), priority=PRIORITY_PRESENCE)
+
+    def cancel_presence_diff(self):
+        task = getattr(self, 'presence_flush_task', None)
+        if task is not None:
+            task.cancel()
+            self.presence_flush_task = None
+
+    async def announce_presence(self, user, online_status):
+        """Send a presence change to the presence group of each of the user's contacts."""
+        contact_ids = await get_contact_ids(user.id)
+        for contact_id in contact_ids:
+            room = f"presence_{contact_id}"
+            await self.channel_layer.group_send(room, {
+                "type": "presence_update",
+                "room": room,
+                "user_id": str(user.id),
+                "username": user.username,
+                "online_status": online_status,
+            })
+
+
+@database_sync_to_async
+def get_contact_ids(user_id):
+    from chat.services.contact_service import ContactService
+    return ContactService.get_contact_ids(user_id)
+
+
+class PresenceConsumer(OutboundQueueMixin, PresenceDiffMixin, AsyncWebsocketConsumer):
+    """
+    Tracks a user's presence and streams changes for their contacts only.
+
+    Each socket joins ``presence_{user_id}``. Presence changes are sent to
+    the groups of the subject's contacts (users sharing a conversation or
+    group), and only on the first connect / last disconnect across workers.
+
+    The socket also joins the user's notification group and relays new
+    notifications and read changes, so clients do not poll for them.
+    """
+
     async def connect(self):
-        # Get token from query string
-        query_string = self.scope.get("query_string", b"").decode()
-        token = None
-        
-        if "token=" in query_string:
-            token = query_string.split("token=")[1].split("&")[0]
-        
-        if not token:
-            await self.close()
-            return
-        
-        try:
-            access_token = AccessToken(token)
-            user_id = access_token['user_id']
-            self.user = await self.get_user(user_id)
-            
-            if not self.user:
-                await self.close()
-                return
-
-            token_version = access_token.get('tv')
-            if token_version is None or int(token_version) != int(getattr(self.user, 'token_version', 0)):
-                await self.close()
-                return
-        except Exception as e:
-            print(f"Token validation error: {e}")
+        # Authenticated from the handshake token by JWTAuthMiddleware
+        self.user = self.scope.get("user")
+        if self.user is None or not self.user.is_authenticated:
             await self.close()
             return
         
         self.user_id = str(self.user.id)
         self.group_name = f"presence_{self.user_id}"
+        self.notification_group = NotificationInbox.GROUP.format(user_id=self.user_id)
         
         await self.channel_layer.group_add(self.group_name, self.channel_name)
-        await self.channel_layer.group_add("presence_broadcast", self.channel_name)
+        await self.channel_layer.group_add(self.notification_group, self.channel_name)
         await self.accept()
         
-        # Set user online
-        await self.set_user_online()
-        
-        # Broadcast user online
-        await self.channel_layer.group_send(
-            "presence_broadcast",
-            {
-                "type": "user_status_change",
-                "user_id": self.user_id,
-                "username": self.user.username,
-                "online_status": "online",
-            }
-        )
+        # Only the user's first open socket announces them online
+        if await self.set_user_online() == 1:
+            await self.announce_presence(self.user, "online")
     
     async def disconnect(self, close_code):
+        self.cancel_presence_diff()
         if hasattr(self, 'user_id'):
-            await self.set_user_offline()
-            await self.channel_layer.group_send(
-                "presence_broadcast",
-                {
-                    "type": "user_status_change",
-                    "user_id": self.user_id,
-                    "username": self.user.username,
-                    "online_status": "offline",
-                }
-            )
+            if await self.set_user_offline() == 0:
+                await self.announce_presence(self.user, "offline")
             await self.channel_layer.group_discard(self.group_name, self.channel_name)
-        
-        await self.channel_layer.group_discard("presence_broadcast", self.channel_name)
+            await self.channel_layer.group_discard(self.notification_group, self.channel_name)
     
     async def receive(self, text_data):
         try:
@@ -88,32 +123,33 @@ class PresenceConsumer(AsyncWebsocketConsumer):
         except:
             pass
     
-    async def user_status_change(self, event):
+    async def notification_new(self, event):
         await self.send(text_data=json.dumps({
-            "type": "user_status_change",
-            "user_id": event["user_id"],
-            "username": event["username"],
-            "online_status": event["online_status"],
+            "type": "notification",
+            "notification": event["notification"],
+            "unread_count": event["unread_count"],
         }))
     
-    @database_sync_to_async
-    def get_user(self, user_id):
-        try:
-            return User.objects.get(id=user_id)
-        except User.DoesNotExist:
-            return None
+    async def notification_read(self, event):
+        await self.send(text_data=json.dumps({
+            "type": "notification_read",
+            "notification_ids": event["notification_ids"],
+            "unread_count": event["unread_count"],
+        }))
     
     @database_sync_to_async
     def set_user_online(self):
-        user = User.objects.get(id=self.user.id)
-        user.set_online()
+        PresenceService.heartbeat(self.user.id)
+        return PresenceService.connection_opened(self.user.id)
     
     @database_sync_to_async
     def set_user_offline(self):
-        user = User.objects.get(id=self.user.id)
-        user.set_offline()
+        remaining = PresenceService.connection_closed(self.user.id)
+        if remaining == 0:
+            PresenceService.mark_offline(self.user.id)
+        return remaining
     
     @database_sync_to_async
     def update_last_seen(self):
-        user = User.objects.get(id=self.user.id)
-        user.update_last_seen()
+        PresenceService.heartbeat(self.user.id)
+        PresenceService.flush_if_due()
@@ -2,17 +2,23 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import timedelta
 from users.models import User
+from users.services.presence_service import PresenceService
 
 
 class Command(BaseCommand):
-    help = 'Mark users as offline if no heartbeat for 20 seconds'
+    help = 'Flush cached presence to the users table and mark stale users offline'
 
     def handle(self, *args, **options):
-        cutoff = timezone.now() - timedelta(seconds=20)
+        flushed = PresenceService.flush()
+
+        # Rows left online by a previous process that the presence store never saw
+        cutoff = timezone.now() - timedelta(seconds=PresenceService.ONLINE_TIMEOUT)
         updated = User.objects.filter(
             online_status__in=['online', 'away'],
             last_seen__lt=cutoff
+        ).exclude(
+            id__in=PresenceService.online_user_ids()
         ).update(online_status='offline')
         self.stdout.write(
-            self.style.SUCCESS(f'Marked {updated} users as offline (no heartbeat for 20+ seconds)')
+            self.style.SUCCESS(f'Flushed presence for {flushed} users, marked {updated} stale users as offline')
         )
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.7 on 2026-10-17 05:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_tokens(apps, schema_editor):
+    from users.services.user_search_service import SEARCH_FIELDS, tokenize
+
+    User = apps.get_model('users', 'User')
+    UserSearchToken = apps.get_model('users', 'UserSearchToken')
+    tokens = []
+    for user in User.objects.only('id', *SEARCH_FIELDS).iterator():
+        tokens.extend(
+            UserSearchToken(user_id=user.id, kind=kind, token=token)
+            for kind, token in tokenize(*(getattr(user, field) for field in SEARCH_FIELDS))
+        )
+        if len(tokens) >= 5000:
+            UserSearchToken.objects.bulk_create(tokens)
+            tokens = []
+    UserSearchToken.objects.bulk_create(tokens)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0021_seed_default_moderator_roles'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('w', 'Word'), ('t', 'Trigram')], max_length=1)),
+                ('token', models.CharField(max_length=150)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'User Search Token',
+                'verbose_name_plural': 'User Search Tokens',
+                'db_table': 'user_search_tokens',
+                'indexes': [models.Index(fields=['kind', 'token', 'user'], name='user_search_kind_49697b_idx'), models.Index(fields=['user'], name='user_search_user_id_081b3e_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_tokens, migrations.RunPython.noop),
+    ]
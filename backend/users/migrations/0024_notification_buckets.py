@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:05
+
+import datetime
+
+from django.db import migrations, models
+from django.db.models.functions import ExtractMonth, ExtractYear
+import users.services.notification_retention
+
+
+def backfill_buckets(apps, schema_editor):
+    Notification = apps.get_model('users', 'Notification')
+    # In UTC, like bucket_for() on the stored (UTC) created_at, whatever TIME_ZONE is
+    utc = datetime.timezone.utc
+    Notification.objects.update(
+        bucket=ExtractYear('created_at', tzinfo=utc) * 100 + ExtractMonth('created_at', tzinfo=utc)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0023_notification_history_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='bucket',
+            field=models.PositiveIntegerField(default=users.services.notification_retention.current_bucket, editable=False),
+        ),
+        migrations.RunPython(backfill_buckets, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'is_read'], name='notificatio_user_id_a4dd5c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['bucket', 'is_read'], name='notificatio_bucket_d8a5b6_idx'),
+        ),
+    ]
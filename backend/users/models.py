@@ -195,26 +195,33 @@ class User(AbstractBaseUser, PermissionsMixin):
         return self.status
     
     def update_last_seen(self):
-        """Update the last seen timestamp."""
+        """Update the last seen timestamp (flushed to the database in batches)."""
+        from users.services.presence_service import PresenceService
         self.last_seen = timezone.now()
-        self.save(update_fields=['last_seen'])
+        PresenceService.record_activity(self.pk)
     
     def set_online(self):
         """Set user as online."""
+        from users.services.presence_service import PresenceService
         self.online_status = 'online'
         self.last_seen = timezone.now()
         self.save(update_fields=['online_status', 'last_seen'])
+        PresenceService.heartbeat(self.pk)
     
     def set_away(self):
         """Set user as away."""
+        from users.services.presence_service import PresenceService
         self.online_status = 'away'
         self.save(update_fields=['online_status'])
+        PresenceService.heartbeat(self.pk, 'away')
     
     def set_offline(self):
         """Set user as offline."""
+        from users.services.presence_service import PresenceService
         self.online_status = 'offline'
         self.last_seen = timezone.now()
         self.save(update_fields=['online_status', 'last_seen'])
+        PresenceService.mark_offline(self.pk)
     
     def increment_message_count(self):
         """Increment user's message count."""
@@ -353,6 +360,35 @@ class UserActivity(models.Model):
         return f"{self.user.username} - {self.action} - {self.timestamp}"
 
 
+class UserSearchToken(models.Model):
+    """
+    Normalized search tokens for the user directory.
+    
+    Word tokens serve prefix lookups and trigram tokens fuzzy lookups; both
+    are range or equality scans on the (kind, token) index. Maintained by
+    UserSearchService from User post_save.
+    """
+    
+    KIND_WORD = 'w'
+    KIND_TRIGRAM = 't'
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='search_tokens')
+    kind = models.CharField(max_length=1, choices=[(KIND_WORD, 'Word'), (KIND_TRIGRAM, 'Trigram')])
+    token = models.CharField(max_length=150)
+    
+    class Meta:
+        db_table = 'user_search_tokens'
+        verbose_name = 'User Search Token'
+        verbose_name_plural = 'User Search Tokens'
+        indexes = [
+            models.Index(fields=['kind', 'token', 'user']),
+            models.Index(fields=['user']),
+        ]
+    
+    def __str__(self):
+        return f"{self.token} ({self.kind}) -> {self.user_id}"
+
+
 class BlacklistedToken(models.Model):
     """
     Model to track blacklisted JWT tokens for secure logout.
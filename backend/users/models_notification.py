@@ -3,6 +3,7 @@ Notification models for OffChat application.
 """
 from django.db import models
 from django.contrib.auth import get_user_model
+from users.services.notification_retention import current_bucket
 import uuid
 
 User = get_user_model()
@@ -33,6 +34,8 @@ class Notification(models.Model):
     is_read = models.BooleanField(default=False)
     data = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # YYYYMM of creation; retention purges whole months through (bucket, is_read)
+    bucket = models.PositiveIntegerField(default=current_bucket, editable=False)
     
     class Meta:
         db_table = 'notifications'
@@ -43,11 +46,18 @@ class Notification(models.Model):
             models.Index(fields=['user']),
             models.Index(fields=['is_read']),
             models.Index(fields=['created_at']),
+            # Keyset history (NotificationInbox.history)
+            models.Index(fields=['user', 'created_at', 'id']),
+            # Unread counts seeding NotificationInbox's counter
+            models.Index(fields=['user', 'is_read']),
+            # Retention (NotificationRetention.purge)
+            models.Index(fields=['bucket', 'is_read']),
         ]
     
     def __str__(self):
         return f"{self.title} - {self.user.username}"
     
     def mark_as_read(self):
+        from users.services.notification_inbox import NotificationInbox
+        NotificationInbox.mark_read(self.user_id, [self.pk])
         self.is_read = True
-        self.save(update_fields=['is_read'])
@@ -60,17 +60,11 @@ def send_bulk_notification_async(user_ids=None, notification_type=None, title=No
 
 @shared_task
 def cleanup_old_notifications(days=30):
-    """Clean up old read notifications older than specified days."""
-    from django.utils import timezone
-    from datetime import timedelta
-    from users.models_notification import Notification
+    """Clean up old read notifications older than specified days, in bounded chunks."""
+    from users.services.notification_retention import NotificationRetention
     
     try:
-        cutoff_date = timezone.now() - timedelta(days=days)
-        deleted_count, _ = Notification.objects.filter(
-            is_read=True,
-            created_at__lt=cutoff_date
-        ).delete()
+        deleted_count = NotificationRetention.purge(days=days)
         return f"Deleted {deleted_count} old notifications"
     except Exception as e:
         logger.error(f"Error cleaning up old notifications: {str(e)}")
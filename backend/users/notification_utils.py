@@ -1,4 +1,5 @@
 from .models_notification import Notification
+from .services.notification_inbox import NotificationInbox
 
 
 def send_notification(user, notification_type, title, message, data=None):
@@ -24,4 +25,7 @@ def send_bulk_notification(users, notification_type, title, message, data=None):
         )
         for user in users
     ]
-    return Notification.objects.bulk_create(notifications)
+    notifications = Notification.objects.bulk_create(notifications)
+    # bulk_create skips the post_save receiver that feeds the inbox
+    NotificationInbox.record(notifications)
+    return notifications
@@ -4,6 +4,7 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from .models_notification import Notification
 from .notification_serializers import NotificationSerializer
+from .services.notification_inbox import NotificationInbox
 
 
 class NotificationViewSet(viewsets.ModelViewSet):
@@ -18,6 +19,7 @@ class NotificationViewSet(viewsets.ModelViewSet):
         try:
             notification = self.get_object()
             notification.delete()
+            NotificationInbox.forget(request.user.id, 0 if notification.is_read else 1)
             return Response({'status': 'notification deleted'}, status=status.HTTP_204_NO_CONTENT)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
@@ -27,6 +29,7 @@ class NotificationViewSet(viewsets.ModelViewSet):
         """Delete all notifications for the user."""
         try:
             self.get_queryset().delete()
+            NotificationInbox.forget(request.user.id)
             return Response({'status': 'all notifications deleted'}, status=status.HTTP_204_NO_CONTENT)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
@@ -43,8 +46,7 @@ class NotificationViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def unread_count(self, request):
         try:
-            count = self.get_queryset().filter(is_read=False).count()
-            return Response({'unread_count': count})
+            return Response({'unread_count': NotificationInbox.unread_count(request.user.id)})
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
@@ -60,11 +62,22 @@ class NotificationViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['post'])
     def mark_all_as_read(self, request):
         try:
-            self.get_queryset().filter(is_read=False).update(is_read=True)
+            NotificationInbox.mark_read(request.user.id)
             return Response({'status': 'all marked as read'})
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
+    @action(detail=False, methods=['get'])
+    def history(self, request):
+        """Keyset-paginated history, newest first: ``?before=<cursor>&limit=<n>``."""
+        try:
+            limit = int(request.query_params.get('limit', NotificationInbox.HISTORY_PAGE_SIZE))
+            return Response(NotificationInbox.history(
+                request.user.id, before=request.query_params.get('before'), limit=limit
+            ))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
     @action(detail=False, methods=['get'])
     def by_type(self, request):
         """Filter notifications by type."""
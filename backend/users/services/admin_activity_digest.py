@@ -0,0 +1,133 @@
+"""
+Windowed digests of admin activity notifications.
+
+Routine activity (logins, messages, group joins...) is not notified per
+event. ``AdminActivityDigest.add`` bumps a cache counter for the activity
+type in the current window of ``ADMIN_DIGEST_WINDOW`` seconds. Once a window
+has closed, every counter in it becomes one notification per admin
+("312 messages sent in the last 5 minutes"), queued through the outbox,
+which bulk-inserts them. Admin notification volume is therefore bounded by
+the number of activity types per window rather than by traffic.
+High-priority and critical activity bypasses the digest; see
+``AdminActivityNotifier.is_digested``.
+
+Closed windows are flushed after the first event that follows them, and by
+the ``users.tasks.flush_admin_digests`` beat task when traffic stops.
+"""
+import logging
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+
+def describe_window(seconds: int) -> str:
+    if seconds % 3600 == 0:
+        hours = seconds // 3600
+        return 'hour' if hours == 1 else f'{hours} hours'
+    if seconds % 60 == 0:
+        minutes = seconds // 60
+        return 'minute' if minutes == 1 else f'{minutes} minutes'
+    return f'{seconds} seconds'
+
+
+class AdminActivityDigest:
+    """
+    Service counting digested admin activity and flushing closed windows.
+    """
+
+    DEFAULT_WINDOW = 300  # seconds
+    GRACE = 5  # seconds a closed window still accepts in-flight increments
+    BACKLOG = 12  # windows kept; counters older than this expire unflushed
+    COUNT_KEY = 'admin_digest:{window}:{activity_type}'
+    NEXT_KEY = 'admin_digest:next_window'
+    LOCK_KEY = 'admin_digest:lock'
+
+    @classmethod
+    def window_length(cls) -> int:
+        return getattr(settings, 'ADMIN_DIGEST_WINDOW', cls.DEFAULT_WINDOW)
+
+    @classmethod
+    def window_start(cls, now: float) -> int:
+        length = cls.window_length()
+        return int(now // length * length)
+
+    @classmethod
+    def add(cls, activity_type: str, now: float = None) -> None:
+        """Count one event of ``activity_type`` into the current window."""
+        now = time.time() if now is None else now
+        key = cls.COUNT_KEY.format(window=cls.window_start(now), activity_type=activity_type)
+        timeout = cls.window_length() * cls.BACKLOG
+        cache.add(key, 0, timeout)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Evicted between add and incr
+            cache.set(key, 1, timeout)
+
+        if cls.due_window(now) > cache.get(cls.NEXT_KEY, 0):
+            # Flush after commit so the queued digests do not depend on the caller's transaction
+            transaction.on_commit(cls.flush_due)
+
+    @classmethod
+    def due_window(cls, now: float) -> int:
+        """Windows starting before this one are closed."""
+        return cls.window_start(now - cls.GRACE)
+
+    @classmethod
+    def flush_due(cls, now: float = None) -> int:
+        """Queue digests for every closed window not flushed yet; returns how many were queued."""
+        now = time.time() if now is None else now
+        length = cls.window_length()
+        due = cls.due_window(now)
+        oldest = due - length * cls.BACKLOG
+        window = max(cache.get(cls.NEXT_KEY) or oldest, oldest)
+        if window >= due or not cache.add(cls.LOCK_KEY, True, 60):
+            return 0
+
+        queued = 0
+        try:
+            while window < due:
+                queued += cls.flush_window(window)
+                window += length
+            cache.set(cls.NEXT_KEY, due, None)
+        finally:
+            cache.delete(cls.LOCK_KEY)
+        return queued
+
+    @classmethod
+    def flush_window(cls, window: int) -> int:
+        from chat.services.outbox import ADMIN_ACTIVITY, Outbox
+        from users.admin_activity_notifier import AdminActivityNotifier
+
+        keys = {
+            cls.COUNT_KEY.format(window=window, activity_type=activity_type): activity_type
+            for activity_type, config in AdminActivityNotifier.ACTIVITY_NOTIFICATIONS.items()
+            if 'digest' in config
+        }
+        counts = {key: count for key, count in cache.get_many(list(keys)).items() if count}
+        if not counts:
+            return 0
+        cache.delete_many(list(counts))
+
+        length = cls.window_length()
+        period = describe_window(length)
+        for key, count in counts.items():
+            activity_type = keys[key]
+            config = AdminActivityNotifier.ACTIVITY_NOTIFICATIONS[activity_type]
+            singular, plural = config['digest']
+            Outbox.record(ADMIN_ACTIVITY, {
+                'notification_type': config['type'],
+                'title': config['title'],
+                'message': f"{count} {singular if count == 1 else plural} in the last {period}",
+                'data': {
+                    'activity_type': activity_type,
+                    'digest': True,
+                    'count': count,
+                    'window_start': window,
+                    'window_end': window + length,
+                },
+            })
+        return len(counts)
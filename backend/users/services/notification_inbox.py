@@ -0,0 +1,355 @@
+"""
+Per-user notification inbox.
+
+The ``notifications`` table stays the source of truth. Next to it the inbox
+keeps the paths clients hit constantly:
+
+- a capped, append-only stream of each user's newest notifications, a Redis
+  list with django-redis and an in-process deque otherwise;
+- an unread counter per user in the cache, changed with atomic incr/decr and
+  seeded from the table on a miss;
+- keyset-paginated history read from the table by ``(created_at, id)``;
+- a push of each new notification and read change to the
+  ``notifications_{user_id}`` channel-layer group, joined by the presence
+  socket and by multiplexed sockets subscribed to ``notifications``.
+
+New rows reach the inbox through ``NotificationInbox.record`` once their
+transaction commits: the ``post_save`` receiver in ``users.signals`` covers
+single inserts, and ``bulk_create`` call sites call it themselves.
+"""
+import base64
+import binascii
+import json
+import logging
+import threading
+import uuid
+from collections import defaultdict, deque
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+# Formats exactly like NotificationSerializer's created_at
+_datetime = serializers.DateTimeField()
+
+
+class LocalInboxStore:
+    """In-process streams used when the cache is not Redis."""
+
+    def __init__(self, length):
+        self._lock = threading.Lock()
+        self._length = length
+        self._streams = {}
+
+    def push_many(self, entries_by_user: Dict[int, List[str]]):
+        with self._lock:
+            for user_id, entries in entries_by_user.items():
+                stream = self._streams.setdefault(user_id, deque(maxlen=self._length))
+                stream.extendleft(entries)
+
+    def recent(self, user_id, count):
+        with self._lock:
+            return list(self._streams.get(user_id, ()))[:count]
+
+    def delete(self, user_id):
+        with self._lock:
+            self._streams.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._streams.clear()
+
+
+class RedisInboxStore:
+    """Streams kept as capped Redis lists, newest first, shared by all workers."""
+
+    STREAM_KEY = 'notifications:stream:{user_id}'
+    STREAM_TTL = 60 * 60 * 24 * 7
+
+    def __init__(self, connection, length):
+        self.redis = connection
+        self._length = length
+
+    def push_many(self, entries_by_user: Dict[int, List[str]]):
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id, entries in entries_by_user.items():
+            key = self.STREAM_KEY.format(user_id=user_id)
+            pipe.lpush(key, *entries)
+            pipe.ltrim(key, 0, self._length - 1)
+            pipe.expire(key, self.STREAM_TTL)
+        pipe.execute()
+
+    def recent(self, user_id, count):
+        return [entry.decode() for entry in self.redis.lrange(self.STREAM_KEY.format(user_id=user_id), 0, count - 1)]
+
+    def delete(self, user_id):
+        self.redis.delete(self.STREAM_KEY.format(user_id=user_id))
+
+    def clear(self):
+        keys = list(self.redis.scan_iter(self.STREAM_KEY.format(user_id='*')))
+        if keys:
+            self.redis.delete(*keys)
+
+
+class NotificationInbox:
+    """Single entry point for delivering and reading user notifications."""
+
+    STREAM_LENGTH = getattr(settings, 'NOTIFICATION_STREAM_LENGTH', 100)
+    HISTORY_PAGE_SIZE = 20
+    HISTORY_MAX_PAGE_SIZE = 100
+    UNREAD_KEY = 'notifications:unread:{user_id}'
+    UNREAD_TIMEOUT = 60 * 60 * 24
+    GROUP = 'notifications_{user_id}'
+
+    _store = None
+    _store_lock = threading.Lock()
+
+    @classmethod
+    def get_store(cls):
+        if cls._store is None:
+            with cls._store_lock:
+                if cls._store is None:
+                    cls._store = cls._create_store()
+        return cls._store
+
+    @classmethod
+    def _create_store(cls):
+        backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+        if backend.startswith('django_redis'):
+            try:
+                from django_redis import get_redis_connection
+                return RedisInboxStore(get_redis_connection('default'), cls.STREAM_LENGTH)
+            except Exception as e:
+                logger.error(f"Redis notification store unavailable, using local store: {e}")
+        return LocalInboxStore(cls.STREAM_LENGTH)
+
+    @staticmethod
+    def to_entry(notification) -> Dict:
+        """The NotificationSerializer representation, without a serializer per row."""
+        return {
+            'id': str(notification.id),
+            'notification_type': notification.notification_type,
+            'title': notification.title,
+            'message': notification.message,
+            'is_read': notification.is_read,
+            'data': notification.data,
+            'created_at': _datetime.to_representation(notification.created_at),
+        }
+
+    # Writers
+
+    @classmethod
+    def record(cls, notifications: Iterable) -> None:
+        """Deliver freshly inserted notifications once the current transaction commits."""
+        notifications = list(notifications)
+        if notifications:
+            transaction.on_commit(lambda: cls.deliver(notifications))
+
+    @classmethod
+    def deliver(cls, notifications: Iterable) -> None:
+        """Append to the owners' streams, bump their unread counters and push to their sockets."""
+        entries_by_user = defaultdict(list)
+        unread_by_user = defaultdict(int)
+        for notification in notifications:
+            entries_by_user[notification.user_id].append(cls.to_entry(notification))
+            if not notification.is_read:
+                unread_by_user[notification.user_id] += 1
+        if not entries_by_user:
+            return
+
+        try:
+            cls.get_store().push_many({
+                user_id: [json.dumps(entry) for entry in entries]
+                for user_id, entries in entries_by_user.items()
+            })
+        except Exception as e:
+            logger.error(f"Could not append notifications to streams: {str(e)}")
+
+        unseeded = set()
+        for user_id, count in unread_by_user.items():
+            try:
+                cache.incr(cls.UNREAD_KEY.format(user_id=user_id), count)
+            except ValueError:
+                unseeded.add(user_id)
+
+        pushes = {}
+        for user_id, entries in entries_by_user.items():
+            # A missing counter is left for readers to seed: the table may
+            # already hold rows committed with these whose delivery is still
+            # pending, and seeding now would count them twice
+            unread = cls.count_unread(user_id) if user_id in unseeded else cls.unread_count(user_id)
+            pushes[user_id] = [
+                {'type': 'notification_new', 'notification': entry, 'unread_count': unread}
+                for entry in entries
+            ]
+        cls._push(pushes)
+
+    @classmethod
+    def mark_read(cls, user_id, notification_ids: Optional[Iterable] = None) -> int:
+        """Mark the user's notifications (all of them by default) as read; returns how many changed."""
+        from users.models_notification import Notification
+
+        unread = Notification.objects.filter(user_id=user_id, is_read=False)
+        if notification_ids is not None:
+            notification_ids = cls._valid_ids(notification_ids)
+            unread = unread.filter(id__in=notification_ids)
+        updated = unread.update(is_read=True)
+        if not updated:
+            return 0
+
+        key = cls.UNREAD_KEY.format(user_id=user_id)
+        if notification_ids is None:
+            cache.set(key, 0, cls.UNREAD_TIMEOUT)
+        else:
+            cls._decr_unread(key, updated)
+        cls._push({user_id: [{
+            'type': 'notification_read',
+            'notification_ids': notification_ids,
+            'unread_count': cls.unread_count(user_id),
+        }]})
+        return updated
+
+    @classmethod
+    def forget(cls, user_id, unread_deleted: Optional[int] = None) -> None:
+        """
+        Account for deleted notifications: ``unread_deleted`` unread ones, or
+        all of the user's by default. Stream entries of deleted rows are
+        skipped by ``recent``.
+        """
+        key = cls.UNREAD_KEY.format(user_id=user_id)
+        if unread_deleted is None:
+            cache.set(key, 0, cls.UNREAD_TIMEOUT)
+            cls.clear_stream(user_id)
+        elif unread_deleted:
+            cls._decr_unread(key, unread_deleted)
+
+    @classmethod
+    def clear_stream(cls, user_id) -> None:
+        cls.get_store().delete(user_id)
+
+    @classmethod
+    def reset(cls):
+        """Drop all streams (used by tests)."""
+        cls.get_store().clear()
+
+    # Readers
+
+    @classmethod
+    def unread_count(cls, user_id) -> int:
+        key = cls.UNREAD_KEY.format(user_id=user_id)
+        count = cache.get(key)
+        if count is None:
+            count = cls.count_unread(user_id)
+            # add() keeps a value another worker already seeded and incremented
+            if not cache.add(key, count, cls.UNREAD_TIMEOUT):
+                count = cache.get(key, count)
+        return count
+
+    @staticmethod
+    def count_unread(user_id) -> int:
+        """The unread count from the table, bypassing the counter."""
+        from users.models_notification import Notification
+
+        return Notification.objects.filter(user_id=user_id, is_read=False).count()
+
+    @classmethod
+    def recent(cls, user_id, limit: int = None) -> List[Dict]:
+        """
+        The newest notifications from the user's stream, with read flags
+        from the table. Entries whose rows were deleted are left out.
+        """
+        from users.models_notification import Notification
+
+        entries = [json.loads(entry) for entry in cls.get_store().recent(user_id, limit or cls.STREAM_LENGTH)]
+        if not entries:
+            return []
+        read = dict(Notification.objects.filter(
+            user_id=user_id, id__in=[entry['id'] for entry in entries]
+        ).values_list('id', 'is_read'))
+        read = {str(notification_id): is_read for notification_id, is_read in read.items()}
+        for entry in entries:
+            entry['is_read'] = read.get(entry['id'])
+        return [entry for entry in entries if entry['is_read'] is not None]
+
+    @classmethod
+    def history(cls, user_id, before: str = None, limit: int = None) -> Dict:
+        """
+        One page of the user's notifications, newest first, older than the
+        ``before`` cursor. Returns ``{'results': [...], 'next': cursor or None}``.
+        """
+        from users.models_notification import Notification
+
+        limit = max(1, min(limit or cls.HISTORY_PAGE_SIZE, cls.HISTORY_MAX_PAGE_SIZE))
+        notifications = Notification.objects.filter(user_id=user_id)
+        if before:
+            created_at, notification_id = cls.decode_cursor(before)
+            notifications = notifications.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=notification_id)
+            )
+        page = list(notifications.order_by('-created_at', '-id')[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+        return {
+            'results': [cls.to_entry(notification) for notification in page],
+            'next': cls.encode_cursor(page[-1]) if has_more else None,
+        }
+
+    @staticmethod
+    def encode_cursor(notification) -> str:
+        raw = f'{notification.created_at.isoformat()}|{notification.id}'
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor: str):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            created_at, notification_id = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+            return datetime.fromisoformat(created_at), notification_id
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise ValueError('Invalid cursor')
+
+    # Helpers
+
+    @staticmethod
+    def _valid_ids(notification_ids) -> List[str]:
+        valid = []
+        for notification_id in notification_ids:
+            try:
+                valid.append(str(uuid.UUID(str(notification_id))))
+            except ValueError:
+                continue
+        return valid
+
+    @classmethod
+    def _decr_unread(cls, key, count) -> None:
+        try:
+            if cache.decr(key, count) < 0:
+                # Out of step with the table; reseed on the next read
+                cache.delete(key)
+        except ValueError:
+            pass
+
+    @classmethod
+    def _push(cls, events_by_user: Dict[int, List[Dict]]) -> None:
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+
+        async def send_all():
+            for user_id, events in events_by_user.items():
+                room = cls.GROUP.format(user_id=user_id)
+                for event in events:
+                    await channel_layer.group_send(room, {**event, 'room': room})
+
+        try:
+            async_to_sync(send_all)()
+        except Exception as e:
+            logger.warning(f"Could not push notifications: {str(e)}")
@@ -0,0 +1,71 @@
+"""
+Retention for the notifications table.
+
+Every notification carries a monthly ``bucket`` (``YYYYMM`` of its creation
+time) indexed together with ``is_read``. The purge finds expired read rows
+through that index, fully expired months by bucket alone, and deletes them
+in short chunks. Each chunk is its own transaction, so on SQLite the write
+lock is released between chunks and request handlers keep writing while a
+large backlog is purged.
+"""
+import logging
+import time
+from datetime import timedelta
+from django.db.models import Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def bucket_for(moment) -> int:
+    """Monthly bucket of a datetime, as ``YYYYMM``."""
+    return moment.year * 100 + moment.month
+
+
+def current_bucket() -> int:
+    return bucket_for(timezone.now())
+
+
+class NotificationRetention:
+    """
+    Service purging old read notifications in bounded chunks.
+    """
+
+    DEFAULT_DAYS = 30
+    CHUNK_SIZE = 500
+    PAUSE = 0.05  # seconds between chunks, for writers waiting on the lock
+
+    @classmethod
+    def expired(cls, days: int = DEFAULT_DAYS):
+        """Read notifications created more than ``days`` ago."""
+        from users.models_notification import Notification
+
+        cutoff = timezone.now() - timedelta(days=days)
+        cutoff_bucket = bucket_for(cutoff)
+        return Notification.objects.filter(
+            Q(bucket__lt=cutoff_bucket) | Q(bucket=cutoff_bucket, created_at__lt=cutoff),
+            is_read=True,
+        )
+
+    @classmethod
+    def purge(cls, days: int = DEFAULT_DAYS, chunk_size: int = None, pause: float = None) -> int:
+        """Delete expired read notifications chunk by chunk; returns how many were deleted."""
+        from users.models_notification import Notification
+
+        chunk_size = chunk_size or cls.CHUNK_SIZE
+        pause = cls.PAUSE if pause is None else pause
+        expired = cls.expired(days)
+        total = 0
+        while True:
+            ids = list(expired.order_by().values_list('pk', flat=True)[:chunk_size])
+            if not ids:
+                break
+            deleted, _ = Notification.objects.filter(pk__in=ids).delete()
+            total += deleted
+            if len(ids) < chunk_size:
+                break
+            if pause:
+                time.sleep(pause)
+        if total:
+            logger.info(f"Purged {total} read notifications older than {days} days")
+        return total
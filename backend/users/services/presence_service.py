@@ -0,0 +1,420 @@
+"""
+Cache-backed presence tracking with write-behind flush to the users table.
+
+Heartbeats, request activity and WebSocket pings only touch the presence
+store. A periodic flush copies ``online_status``/``last_seen`` for the users
+that changed since the previous flush into the ``users`` table in batches.
+
+With django-redis configured the store is a Redis sorted set scored by the
+last heartbeat time, shared by every worker. Otherwise the same state is
+kept in the Django cache. LocMem, the development cache, is per process:
+there the web process flushes through ``flush_if_due`` (called from
+heartbeats and presence sockets) and the Celery ``cleanup_online_status``
+task only sees heartbeats when the cache is shared, e.g. Redis.
+"""
+import threading
+import time
+import logging
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class CachePresenceStore:
+    """
+    Presence store kept in the Django cache, used when the cache is not Redis.
+
+    Every process sharing the cache backend sees the same state. Updates to
+    the id sets are read-modify-write, serialized only within a process,
+    which is acceptable for development but not for a busy deployment.
+    """
+
+    ENTRY_KEY = 'presence:entry:{user_id}'
+    KNOWN_KEY = 'presence:known'
+    ONLINE_KEY = 'presence:online'
+    DIRTY_KEY = 'presence:dirty'
+
+    def __init__(self, backend=None):
+        self.cache = backend or cache
+        self._lock = threading.Lock()
+
+    def _key(self, user_id):
+        return self.ENTRY_KEY.format(user_id=user_id)
+
+    def _entries(self, user_ids):
+        user_ids = list(user_ids)
+        found = self.cache.get_many([self._key(user_id) for user_id in user_ids])
+        return {user_id: found[self._key(user_id)] for user_id in user_ids if self._key(user_id) in found}
+
+    def _put(self, user_id, entry):
+        self.cache.set(self._key(user_id), entry, None)
+
+    def _update_ids(self, key, add=(), remove=()):
+        ids = self.cache.get(key) or set()
+        updated = (ids | set(add)) - set(remove)
+        if updated != ids:
+            self.cache.set(key, updated, None)
+
+    def touch(self, user_id, status, now):
+        with self._lock:
+            self._put(user_id, {'score': now, 'status': status, 'last_seen': now})
+            self._update_ids(self.KNOWN_KEY, add=[user_id])
+            self._update_ids(self.ONLINE_KEY, add=[user_id])
+            self._update_ids(self.DIRTY_KEY, add=[user_id])
+
+    def record_activity(self, user_id, now):
+        with self._lock:
+            entry = self._entries([user_id]).get(user_id) or {'score': None, 'status': None}
+            if entry['score'] is not None:
+                entry['score'] = now
+            entry['last_seen'] = now
+            self._put(user_id, entry)
+            self._update_ids(self.KNOWN_KEY, add=[user_id])
+            self._update_ids(self.DIRTY_KEY, add=[user_id])
+
+    def remove(self, user_id, now):
+        with self._lock:
+            self._put(user_id, {'score': None, 'status': None, 'last_seen': now})
+            self._update_ids(self.KNOWN_KEY, add=[user_id])
+            self._update_ids(self.ONLINE_KEY, remove=[user_id])
+            self._update_ids(self.DIRTY_KEY, add=[user_id])
+
+    def get_many(self, user_ids, cutoff):
+        result = {}
+        for user_id, entry in self._entries(user_ids).items():
+            score, last_seen = entry['score'], entry.get('last_seen')
+            if score is not None and score >= cutoff:
+                result[user_id] = (entry['status'] or 'online', last_seen)
+            elif last_seen is not None:
+                result[user_id] = ('offline', last_seen)
+        return result
+
+    def online_ids(self, cutoff):
+        entries = self._entries(self.cache.get(self.ONLINE_KEY) or ())
+        return [user_id for user_id, entry in entries.items() if entry['score'] is not None and entry['score'] >= cutoff]
+
+    def expire(self, cutoff):
+        with self._lock:
+            entries = self._entries(self.cache.get(self.ONLINE_KEY) or ())
+            expired = [user_id for user_id, entry in entries.items() if entry['score'] is None or entry['score'] < cutoff]
+            for user_id in expired:
+                self._put(user_id, {**entries[user_id], 'score': None, 'status': None})
+            if expired:
+                self._update_ids(self.ONLINE_KEY, remove=expired)
+                self._update_ids(self.DIRTY_KEY, add=expired)
+        return expired
+
+    def pop_dirty(self, count):
+        with self._lock:
+            dirty = self.cache.get(self.DIRTY_KEY) or set()
+            user_ids = list(dirty)[:count]
+            if not user_ids:
+                return {}
+            self._update_ids(self.DIRTY_KEY, remove=user_ids)
+            entries = self._entries(user_ids)
+
+        batch = {}
+        for user_id in user_ids:
+            entry = entries.get(user_id) or {'score': None, 'status': None}
+            status = (entry['status'] or 'online') if entry['score'] is not None else 'offline'
+            batch[user_id] = (status, entry.get('last_seen'))
+        return batch
+
+    def clear(self):
+        with self._lock:
+            known = self.cache.get(self.KNOWN_KEY) or set()
+            self.cache.delete_many([self._key(user_id) for user_id in known])
+            self.cache.delete_many([self.KNOWN_KEY, self.ONLINE_KEY, self.DIRTY_KEY])
+
+
+class RedisPresenceStore:
+    """Presence store backed by a Redis sorted set shared by all workers."""
+
+    ONLINE_KEY = 'presence:online'
+    STATUS_KEY = 'presence:status'
+    LAST_SEEN_KEY = 'presence:last_seen'
+    DIRTY_KEY = 'presence:dirty'
+
+    def __init__(self, connection):
+        self.redis = connection
+
+    def touch(self, user_id, status, now):
+        pipe = self.redis.pipeline()
+        pipe.zadd(self.ONLINE_KEY, {user_id: now})
+        pipe.hset(self.STATUS_KEY, user_id, status)
+        pipe.hset(self.LAST_SEEN_KEY, user_id, now)
+        pipe.sadd(self.DIRTY_KEY, user_id)
+        pipe.execute()
+
+    def record_activity(self, user_id, now):
+        pipe = self.redis.pipeline()
+        pipe.zadd(self.ONLINE_KEY, {user_id: now}, xx=True)
+        pipe.hset(self.LAST_SEEN_KEY, user_id, now)
+        pipe.sadd(self.DIRTY_KEY, user_id)
+        pipe.execute()
+
+    def remove(self, user_id, now):
+        pipe = self.redis.pipeline()
+        pipe.zrem(self.ONLINE_KEY, user_id)
+        pipe.hdel(self.STATUS_KEY, user_id)
+        pipe.hset(self.LAST_SEEN_KEY, user_id, now)
+        pipe.sadd(self.DIRTY_KEY, user_id)
+        pipe.execute()
+
+    def get_many(self, user_ids, cutoff):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        pipe = self.redis.pipeline()
+        for user_id in user_ids:
+            pipe.zscore(self.ONLINE_KEY, user_id)
+        pipe.hmget(self.STATUS_KEY, user_ids)
+        pipe.hmget(self.LAST_SEEN_KEY, user_ids)
+        replies = pipe.execute()
+        scores, statuses, last_seen = replies[:-2], replies[-2], replies[-1]
+
+        result = {}
+        for user_id, score, status, seen in zip(user_ids, scores, statuses, last_seen):
+            seen = float(seen) if seen is not None else None
+            if score is not None and score >= cutoff:
+                result[user_id] = (status.decode() if status else 'online', seen)
+            elif seen is not None:
+                result[user_id] = ('offline', seen)
+        return result
+
+    def online_ids(self, cutoff):
+        return [int(user_id) for user_id in self.redis.zrangebyscore(self.ONLINE_KEY, cutoff, '+inf')]
+
+    def expire(self, cutoff):
+        candidates = self.redis.zrangebyscore(self.ONLINE_KEY, '-inf', f'({cutoff}')
+        if not candidates:
+            return []
+        pipe = self.redis.pipeline()
+        for user_id in candidates:
+            pipe.zrem(self.ONLINE_KEY, user_id)
+        removed = pipe.execute()
+
+        # Only the worker whose ZREM succeeded reports the user as expired
+        expired = [int(user_id) for user_id, ok in zip(candidates, removed) if ok]
+        if expired:
+            pipe = self.redis.pipeline()
+            pipe.hdel(self.STATUS_KEY, *expired)
+            pipe.sadd(self.DIRTY_KEY, *expired)
+            pipe.execute()
+        return expired
+
+    def pop_dirty(self, count):
+        user_ids = [int(user_id) for user_id in self.redis.spop(self.DIRTY_KEY, count) or []]
+        if not user_ids:
+            return {}
+        pipe = self.redis.pipeline()
+        for user_id in user_ids:
+            pipe.zscore(self.ONLINE_KEY, user_id)
+        pipe.hmget(self.STATUS_KEY, user_ids)
+        pipe.hmget(self.LAST_SEEN_KEY, user_ids)
+        replies = pipe.execute()
+        scores, statuses, last_seen = replies[:-2], replies[-2], replies[-1]
+
+        batch = {}
+        for user_id, score, status, seen in zip(user_ids, scores, statuses, last_seen):
+            status = (status.decode() if status else 'online') if score is not None else 'offline'
+            batch[user_id] = (status, float(seen) if seen is not None else None)
+        return batch
+
+    def clear(self):
+        self.redis.delete(self.ONLINE_KEY, self.STATUS_KEY, self.LAST_SEEN_KEY, self.DIRTY_KEY)
+
+
+class PresenceService:
+    """Single entry point for reading and writing user presence."""
+
+    ONLINE_TIMEOUT = getattr(settings, 'PRESENCE_ONLINE_TIMEOUT', 60)  # seconds without heartbeat
+    FLUSH_INTERVAL = getattr(settings, 'PRESENCE_FLUSH_INTERVAL', 30)  # seconds between DB flushes
+    FLUSH_BATCH_SIZE = 500
+    FLUSH_LOCK_KEY = 'presence_flush_lock'
+    CONNECTIONS_KEY = 'presence_connections:{user_id}'
+    CONNECTIONS_TIMEOUT = 60 * 60 * 24
+    STATUSES = ('online', 'away')
+
+    _store = None
+    _store_lock = threading.Lock()
+
+    @classmethod
+    def get_store(cls):
+        if cls._store is None:
+            with cls._store_lock:
+                if cls._store is None:
+                    cls._store = cls._create_store()
+        return cls._store
+
+    @staticmethod
+    def _create_store():
+        backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+        if backend.startswith('django_redis'):
+            try:
+                from django_redis import get_redis_connection
+                return RedisPresenceStore(get_redis_connection('default'))
+            except Exception as e:
+                logger.error(f"Redis presence store unavailable, using local store: {e}")
+        return CachePresenceStore()
+
+    @classmethod
+    def _cutoff(cls, now=None):
+        return (now or time.time()) - cls.ONLINE_TIMEOUT
+
+    @staticmethod
+    def _to_datetime(timestamp):
+        if timestamp is None:
+            return None
+        return datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+
+    # Writers
+
+    @classmethod
+    def heartbeat(cls, user_id, status='online'):
+        """Mark a user online (or away) and refresh their expiry."""
+        if status not in cls.STATUSES:
+            raise ValueError(f"Invalid presence status: {status}")
+        cls.get_store().touch(int(user_id), status, time.time())
+
+    @classmethod
+    def mark_offline(cls, user_id):
+        """Mark a user offline immediately."""
+        cls.get_store().remove(int(user_id), time.time())
+
+    @classmethod
+    def record_activity(cls, user_id):
+        """Update last_seen for a user without changing their status."""
+        cls.get_store().record_activity(int(user_id), time.time())
+
+    @classmethod
+    def connection_opened(cls, user_id):
+        """Count an open presence socket; returns how many the user now has."""
+        key = cls.CONNECTIONS_KEY.format(user_id=user_id)
+        cache.add(key, 0, cls.CONNECTIONS_TIMEOUT)
+        try:
+            return cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, cls.CONNECTIONS_TIMEOUT)
+            return 1
+
+    @classmethod
+    def connection_closed(cls, user_id):
+        """Release a presence socket; returns how many the user still has open."""
+        key = cls.CONNECTIONS_KEY.format(user_id=user_id)
+        try:
+            remaining = cache.decr(key)
+        except ValueError:
+            return 0
+        if remaining <= 0:
+            cache.delete(key)
+            return 0
+        return remaining
+
+    # Readers
+
+    @classmethod
+    def get_statuses(cls, user_ids):
+        """
+        Return ``{user_id: {'online_status': ..., 'last_seen': datetime}}``
+        for the users the store knows about.
+        """
+        entries = cls.get_store().get_many([int(user_id) for user_id in user_ids], cls._cutoff())
+        return {
+            user_id: {'online_status': status, 'last_seen': cls._to_datetime(last_seen)}
+            for user_id, (status, last_seen) in entries.items()
+        }
+
+    @classmethod
+    def get_status(cls, user_id):
+        return cls.get_statuses([user_id]).get(int(user_id))
+
+    @classmethod
+    def is_online(cls, user_id):
+        entry = cls.get_status(user_id)
+        return bool(entry) and entry['online_status'] in cls.STATUSES
+
+    @classmethod
+    def online_user_ids(cls, status=None):
+        """Return ids of users currently online, optionally filtered by status."""
+        user_ids = cls.get_store().online_ids(cls._cutoff())
+        if status is None:
+            return user_ids
+        statuses = cls.get_statuses(user_ids)
+        return [user_id for user_id, entry in statuses.items() if entry['online_status'] == status]
+
+    @classmethod
+    def online_count(cls, status=None):
+        return len(cls.online_user_ids(status))
+
+    @classmethod
+    def overlay(cls, rows):
+        """
+        Overwrite ``online_status``/``last_seen`` on user dicts (e.g. from
+        ``values()``) with the live presence state.
+        """
+        rows = list(rows)
+        statuses = cls.get_statuses([row['id'] for row in rows])
+        for row in rows:
+            entry = statuses.get(row['id'])
+            if entry:
+                row['online_status'] = entry['online_status']
+                if entry['last_seen']:
+                    row['last_seen'] = entry['last_seen']
+            elif row.get('online_status') in cls.STATUSES:
+                # Not heard from since the last restart/expiry
+                row['online_status'] = 'offline'
+        return rows
+
+    # Write-behind
+
+    @classmethod
+    def flush(cls, batch_size=None):
+        """Expire stale users and write changed presence to the users table."""
+        from users.models import User
+
+        batch_size = batch_size or cls.FLUSH_BATCH_SIZE
+        store = cls.get_store()
+        store.expire(cls._cutoff())
+
+        flushed = 0
+        while True:
+            batch = store.pop_dirty(batch_size)
+            if not batch:
+                break
+            users = []
+            for user_id, (status, last_seen) in batch.items():
+                user = User(id=user_id, online_status=status)
+                user.last_seen = cls._to_datetime(last_seen)
+                users.append(user)
+
+            with_last_seen = [user for user in users if user.last_seen is not None]
+            without_last_seen = [user for user in users if user.last_seen is None]
+            if with_last_seen:
+                User.objects.bulk_update(with_last_seen, ['online_status', 'last_seen'], batch_size=batch_size)
+            if without_last_seen:
+                User.objects.bulk_update(without_last_seen, ['online_status'], batch_size=batch_size)
+            flushed += len(users)
+
+        if flushed:
+            logger.info(f"Flushed presence for {flushed} users")
+        return flushed
+
+    @classmethod
+    def flush_if_due(cls):
+        """Flush at most once per FLUSH_INTERVAL across all workers."""
+        if not cache.add(cls.FLUSH_LOCK_KEY, True, cls.FLUSH_INTERVAL):
+            return 0
+        try:
+            return cls.flush()
+        except Exception as e:
+            logger.error(f"Error flushing presence: {e}")
+            return 0
+
+    @classmethod
+    def reset(cls):
+        """Drop all presence state (used by tests)."""
+        cls.get_store().clear()
+        cache.delete(cls.FLUSH_LOCK_KEY)
@@ -19,6 +19,8 @@ except ImportError:
     # Fallback to get_user_model if direct import fails
     User = get_user_model()
 
+from users.services.user_search_service import UserSearchService
+
 logger = logging.getLogger(__name__)
 
 
@@ -45,12 +47,7 @@ class UserManagementService:
             # Apply search filter
             search = request_params.get('search', '').strip()
             if search:
-                queryset = queryset.filter(
-                    Q(username__icontains=search) |
-                    Q(email__icontains=search) |
-                    Q(first_name__icontains=search) |
-                    Q(last_name__icontains=search)
-                )
+                queryset = UserSearchService.filter_queryset(queryset, search)
             
             # Apply status filter
             status = request_params.get('status')
@@ -471,7 +468,8 @@ class UserManagementService:
             )
             
             # Online users
-            online_users = User.objects.filter(online_status='online').count()
+            from users.services.presence_service import PresenceService
+            online_users = PresenceService.online_count('online')
             
             # Recent activity
             last_24h = timezone.now() - timedelta(days=1)
@@ -681,7 +679,10 @@ class UserManagementService:
             Dict with online users and pagination
         """
         try:
-            queryset = User.objects.filter(online_status='online').order_by('-last_seen')
+            from users.services.presence_service import PresenceService
+            queryset = User.objects.filter(
+                id__in=PresenceService.online_user_ids('online')
+            ).order_by('-last_seen')
             
             paginator = Paginator(queryset, per_page)
             users_page = paginator.get_page(page)
@@ -0,0 +1,212 @@
+"""
+Indexed user directory search.
+
+Each user's username, names and email are normalized into ``UserSearchToken``
+rows: whole words for prefix lookups and trigrams for fuzzy ones. A query is
+answered from range scans on the token index instead of four-way
+``icontains`` scans of ``users``. Autocomplete (``search_ids``) is capped at
+MAX_RESULTS and hot queries are served from a small per-process LRU that is
+invalidated through a version counter in the shared cache whenever a user's
+searchable fields change. Paginated lists use ``filter_queryset``, which
+filters through the token table with uncapped subqueries.
+"""
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import List, Set, Tuple
+from django.core.cache import cache
+from django.db.models import Count
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+SEARCH_FIELDS = ('username', 'first_name', 'last_name', 'email')
+
+
+def normalize(value: str) -> str:
+    """Lowercase and strip accents so 'José' and 'jose' match."""
+    value = unicodedata.normalize('NFKD', value or '')
+    return ''.join(ch for ch in value if not unicodedata.combining(ch)).lower().strip()
+
+
+def trigrams(word: str) -> Set[str]:
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def tokenize(username='', first_name='', last_name='', email='') -> Set[Tuple[str, str]]:
+    """Return the ``(kind, token)`` pairs indexed for a user."""
+    from users.models import UserSearchToken
+
+    email = normalize(email)
+    values = [normalize(username), normalize(first_name), normalize(last_name), email]
+    words = set()
+    for value in values:
+        if value:
+            # Whole values so 'john.doe@ex' style prefixes work, plus their words
+            words.add(value[:150])
+            words.update(word[:150] for word in WORD_RE.findall(value))
+
+    tokens = {(UserSearchToken.KIND_WORD, word) for word in words}
+    for value in (normalize(username), normalize(first_name), normalize(last_name), email.split('@')[0]):
+        for word in WORD_RE.findall(value):
+            tokens.update((UserSearchToken.KIND_TRIGRAM, gram) for gram in trigrams(word))
+    return tokens
+
+
+class UserSearchService:
+    """
+    Service for prefix and fuzzy user lookups.
+    """
+
+    MAX_RESULTS = 50
+    FUZZY_MIN_LENGTH = 3
+    FUZZY_MIN_SHARED = 0.5  # fraction of the query's trigrams a match must share
+    LRU_SIZE = 1024
+    LRU_TTL = 60  # seconds
+    VERSION_KEY = 'user_search:version'
+
+    _lru = OrderedDict()
+    _lock = threading.Lock()
+
+    # Index maintenance
+
+    @classmethod
+    def index_user(cls, user) -> None:
+        from users.models import UserSearchToken
+
+        tokens = tokenize(*(getattr(user, field) for field in SEARCH_FIELDS))
+        UserSearchToken.objects.filter(user_id=user.pk).delete()
+        UserSearchToken.objects.bulk_create([
+            UserSearchToken(user_id=user.pk, kind=kind, token=token) for kind, token in tokens
+        ])
+        cls.invalidate()
+
+    @classmethod
+    def invalidate(cls) -> None:
+        """Expire cached results in every process."""
+        try:
+            cache.incr(cls.VERSION_KEY)
+        except ValueError:
+            cache.set(cls.VERSION_KEY, 1, None)
+        with cls._lock:
+            cls._lru.clear()
+
+    # Lookups
+
+    @classmethod
+    def search_ids(cls, query: str, limit: int = None, fuzzy: bool = True) -> List[int]:
+        """Return ids of users matching ``query``, best matches first."""
+        limit = min(limit or cls.MAX_RESULTS, cls.MAX_RESULTS)
+        words = WORD_RE.findall(normalize(query))
+        if not words:
+            return []
+
+        key = (cache.get(cls.VERSION_KEY, 0), ' '.join(words), limit, fuzzy)
+        now = time.monotonic()
+        with cls._lock:
+            entry = cls._lru.get(key)
+            if entry is not None and entry[1] > now:
+                cls._lru.move_to_end(key)
+                return list(entry[0])
+
+        ids = cls.prefix_ids(words, limit)
+        if fuzzy and len(ids) < limit:
+            ids += [user_id for user_id in cls.fuzzy_ids(words, limit) if user_id not in ids]
+            ids = ids[:limit]
+
+        with cls._lock:
+            cls._lru[key] = (tuple(ids), now + cls.LRU_TTL)
+            cls._lru.move_to_end(key)
+            while len(cls._lru) > cls.LRU_SIZE:
+                cls._lru.popitem(last=False)
+        return ids
+
+    @classmethod
+    def prefix_matches(cls, words: List[str]):
+        """``user_id`` values of users with a word token starting with every query word."""
+        from users.models import UserSearchToken
+
+        def matching(word):
+            # A range instead of LIKE 'word%' so SQLite can use the index
+            return UserSearchToken.objects.filter(
+                kind=UserSearchToken.KIND_WORD, token__gte=word, token__lt=word + '\U0010ffff'
+            ).values('user_id')
+
+        queryset = matching(words[0])
+        for word in words[1:]:
+            queryset = queryset.filter(user_id__in=matching(word))
+        return queryset
+
+    @classmethod
+    def fuzzy_matches(cls, words: List[str]):
+        """``user_id`` values of users sharing enough trigrams with the query, or None."""
+        from users.models import UserSearchToken
+
+        grams = set()
+        for word in words:
+            if len(word) >= cls.FUZZY_MIN_LENGTH:
+                grams |= trigrams(word)
+        if not grams:
+            return None
+        return UserSearchToken.objects.filter(
+            kind=UserSearchToken.KIND_TRIGRAM, token__in=grams
+        ).values('user_id').annotate(
+            shared=Count('token', distinct=True)
+        ).filter(shared__gte=max(1, int(len(grams) * cls.FUZZY_MIN_SHARED)))
+
+    @classmethod
+    def prefix_ids(cls, words: List[str], limit: int) -> List[int]:
+        return list(cls.prefix_matches(words).order_by('user_id').values_list('user_id', flat=True).distinct()[:limit])
+
+    @classmethod
+    def fuzzy_ids(cls, words: List[str], limit: int) -> List[int]:
+        """Most shared trigrams first."""
+        matches = cls.fuzzy_matches(words)
+        if matches is None:
+            return []
+        return list(matches.order_by('-shared', 'user_id').values_list('user_id', flat=True)[:limit])
+
+    @classmethod
+    def filter_queryset(cls, queryset, query: str, fuzzy: bool = True):
+        """
+        Restrict a User queryset to every search match, for paginated lists.
+
+        Unlike ``search_ids`` there is no cap: the token lookups run as
+        subqueries, so other filters, counts and pagination see all matches.
+        Fuzzy matches are used only when nothing matches by prefix.
+        """
+        words = WORD_RE.findall(normalize(query))
+        if not words:
+            return queryset.none()
+        matched = queryset.filter(id__in=cls.prefix_matches(words))
+        if fuzzy and not matched.exists():
+            fuzzy_matches = cls.fuzzy_matches(words)
+            if fuzzy_matches is not None:
+                return queryset.filter(id__in=fuzzy_matches.values('user_id'))
+        return matched
+
+    @classmethod
+    def rebuild(cls, chunk_size: int = 1000) -> int:
+        """Re-tokenize every user; returns the number indexed."""
+        from users.models import User, UserSearchToken
+
+        total = 0
+        last_id = 0
+        while True:
+            users = list(User.objects.filter(id__gt=last_id).order_by('id').only('id', *SEARCH_FIELDS)[:chunk_size])
+            if not users:
+                break
+            UserSearchToken.objects.filter(user_id__in=[user.id for user in users]).delete()
+            UserSearchToken.objects.bulk_create([
+                UserSearchToken(user_id=user.id, kind=kind, token=token)
+                for user in users
+                for kind, token in tokenize(*(getattr(user, field) for field in SEARCH_FIELDS))
+            ], batch_size=5000)
+            total += len(users)
+            last_id = users[-1].id
+        cls.invalidate()
+        return total
@@ -1,11 +1,54 @@
+from django.db import transaction
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from users.models import UserActivity
+from users.models import UserActivity, User, BlacklistedToken
+from users.models_notification import Notification
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+@receiver(post_save, sender=User)
+def invalidate_socket_user_cache(sender, instance, update_fields=None, **kwargs):
+    """Drop cached WebSocket auth state when token_version or account status may have changed."""
+    if update_fields is not None and not {'token_version', 'is_active', 'status'} & set(update_fields):
+        return
+    from users.websocket_auth import SocketUserCache
+    SocketUserCache.invalidate(instance.pk, instance.token_version)
+
+
+@receiver(post_save, sender=User)
+def update_user_search_tokens(sender, instance, update_fields=None, **kwargs):
+    """Re-tokenize a user for directory search when a searchable field may have changed."""
+    from users.services.user_search_service import SEARCH_FIELDS, UserSearchService
+
+    if update_fields is not None and not set(SEARCH_FIELDS) & set(update_fields):
+        return
+    try:
+        # Savepoint so a failed index write never breaks the caller's transaction
+        with transaction.atomic():
+            UserSearchService.index_user(instance)
+    except Exception as e:
+        logger.error(f"Error indexing user {instance.pk} for search: {str(e)}")
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def cache_blacklisted_token(sender, instance, created, **kwargs):
+    """Make newly blacklisted tokens visible to WebSocket handshakes immediately."""
+    if created:
+        from django.core.cache import cache
+        from users.websocket_auth import SocketUserCache
+        cache.set(SocketUserCache.blacklist_key(instance.token), True, SocketUserCache.BLACKLIST_TIMEOUT)
+
+
+@receiver(post_save, sender=Notification)
+def deliver_notification(sender, instance, created, **kwargs):
+    """Append new notifications to the owner's inbox stream and push them after commit."""
+    if created:
+        from users.services.notification_inbox import NotificationInbox
+        NotificationInbox.record([instance])
+
+
 ACTIVITY_NOTIFICATION_MAP = {
     'login': {
         'type': 'system',
@@ -10,10 +10,21 @@ logger = logging.getLogger(__name__)
 
 @shared_task
 def cleanup_online_status():
-    """Mark users as offline if no heartbeat for 20 seconds."""
+    """Flush cached presence to the database and mark stale users offline."""
     try:
         out = call_command('cleanup_online_status')
         return out
     except Exception as e:
         logger.error(f"Error in cleanup_online_status task: {str(e)}")
         return f"Error: {str(e)}"
+
+
+@shared_task
+def flush_admin_digests():
+    """Queue admin activity digests for closed windows."""
+    from users.services.admin_activity_digest import AdminActivityDigest
+    try:
+        return AdminActivityDigest.flush_due()
+    except Exception as e:
+        logger.error(f"Error in flush_admin_digests task: {str(e)}")
+        return f"Error: {str(e)}"
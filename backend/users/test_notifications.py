@@ -1,7 +1,8 @@
 """
 Comprehensive test suite for the notification system.
 """
-from django.test import TestCase, Client
+from channels.db import database_sync_to_async
+from django.test import TestCase, TransactionTestCase, Client, override_settings
 from django.contrib.auth import get_user_model
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
@@ -379,3 +380,288 @@ class NotificationPerformanceTests(TestCase):
         ).order_by().count()
         
         self.assertEqual(unread_count, 500)
+
+
+class NotificationInboxTests(TestCase):
+    """Test the per-user stream, unread counter, history and push."""
+    
+    def setUp(self):
+        from django.core.cache import cache
+        from users.services.notification_inbox import NotificationInbox
+        cache.clear()
+        self.inbox = NotificationInbox
+        self.inbox.reset()
+        self.user = User.objects.create_user(
+            username='inboxuser',
+            email='inbox@example.com',
+            password='testpass123'
+        )
+    
+    def test_new_notifications_streamed_counted_and_pushed(self):
+        """Committed notifications reach the stream, the counter and the user's sockets."""
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+        
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(self.inbox.GROUP.format(user_id=self.user.id), channel)
+        self.assertEqual(self.inbox.unread_count(self.user.id), 0)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            first = send_notification(self.user, 'system', 'First', 'first')
+            send_bulk_notification([self.user], 'system', 'Second', 'second')
+        
+        self.assertEqual([n['title'] for n in self.inbox.recent(self.user.id)], ['Second', 'First'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.inbox.unread_count(self.user.id), 2)
+        event = async_to_sync(layer.receive)(channel)
+        self.assertEqual(event['type'], 'notification_new')
+        self.assertEqual(event['notification']['title'], 'First')
+        
+        self.assertEqual(self.inbox.mark_read(self.user.id, [first.id, 'not-a-uuid']), 1)
+        self.assertEqual(self.inbox.unread_count(self.user.id), 1)
+        self.assertEqual([n['is_read'] for n in self.inbox.recent(self.user.id)], [False, True])
+        
+        first.delete()
+        self.assertEqual([n['title'] for n in self.inbox.recent(self.user.id)], ['Second'])
+    
+    def test_history_pages_by_keyset(self):
+        """History pages follow (created_at, id) cursors without gaps or repeats."""
+        now = timezone.now()
+        for i in range(5):
+            notification = Notification.objects.create(
+                user=self.user, notification_type='system', title=f'N{i}', message='m'
+            )
+            # Two rows share a timestamp to exercise the id tie-break
+            Notification.objects.filter(pk=notification.pk).update(created_at=now - timedelta(minutes=i // 2))
+        
+        titles, cursor = [], None
+        while True:
+            page = self.inbox.history(self.user.id, before=cursor, limit=2)
+            titles.extend(n['title'] for n in page['results'])
+            cursor = page['next']
+            if cursor is None:
+                break
+        self.assertEqual(sorted(titles), [f'N{i}' for i in range(5)])
+        with self.assertRaises(ValueError):
+            self.inbox.history(self.user.id, before='garbage')
+
+    
+    def test_mark_read_and_forget_keep_counter_in_step(self):
+        """Counter and pushes follow delivery, mark-read (by id and all) and deletes."""
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+        
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(self.inbox.GROUP.format(user_id=self.user.id), channel)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            notifications = [
+                send_notification(self.user, 'system', f'N{i}', 'm') for i in range(4)
+            ]
+        for _ in notifications:
+            async_to_sync(layer.receive)(channel)
+        self.assertEqual(self.inbox.unread_count(self.user.id), 4)
+        
+        self.assertEqual(self.inbox.mark_read(self.user.id, [notifications[0].id]), 1)
+        event = async_to_sync(layer.receive)(channel)
+        self.assertEqual(
+            (event['type'], event['notification_ids'], event['unread_count']),
+            ('notification_read', [str(notifications[0].id)], 3)
+        )
+        # Already read: nothing changes and nothing is pushed
+        self.assertEqual(self.inbox.mark_read(self.user.id, [notifications[0].id]), 0)
+        
+        self.assertEqual(self.inbox.mark_read(self.user.id), 3)
+        event = async_to_sync(layer.receive)(channel)
+        self.assertEqual((event['notification_ids'], event['unread_count']), (None, 0))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.inbox.unread_count(self.user.id), 0)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            extra = send_notification(self.user, 'system', 'Extra', 'm')
+        self.assertEqual(self.inbox.unread_count(self.user.id), 1)
+        extra.delete()
+        self.inbox.forget(self.user.id, unread_deleted=1)
+        self.assertEqual(self.inbox.unread_count(self.user.id), 0)
+        self.assertEqual([n['title'] for n in self.inbox.recent(self.user.id)], ['N3', 'N2', 'N1', 'N0'])
+        
+        Notification.objects.filter(user=self.user).delete()
+        self.inbox.forget(self.user.id)
+        self.assertEqual(self.inbox.recent(self.user.id), [])
+        self.assertEqual(self.inbox.unread_count(self.user.id), 0)
+    
+    def test_recent_skips_deleted_rows_and_reads_flags_from_table(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            notifications = [
+                send_notification(self.user, 'system', f'N{i}', 'm') for i in range(3)
+            ]
+        Notification.objects.filter(pk=notifications[0].pk).delete()
+        Notification.objects.filter(pk=notifications[2].pk).update(is_read=True)
+        
+        recent = self.inbox.recent(self.user.id)
+        self.assertEqual([(n['title'], n['is_read']) for n in recent], [('N2', True), ('N1', False)])
+        self.assertEqual([n['title'] for n in self.inbox.recent(self.user.id, limit=1)], ['N2'])
+    
+    def test_history_cursor_round_trips(self):
+        notifications = [
+            Notification.objects.create(user=self.user, notification_type='system', title=f'N{i}', message='m')
+            for i in range(3)
+        ]
+        newest_first = sorted(notifications, key=lambda n: (n.created_at, str(n.id)), reverse=True)
+        
+        first = self.inbox.history(self.user.id, limit=1)
+        self.assertEqual(first['results'][0]['id'], str(newest_first[0].id))
+        self.assertEqual(self.inbox.decode_cursor(first['next']), (newest_first[0].created_at, str(newest_first[0].id)))
+        
+        rest = self.inbox.history(self.user.id, before=first['next'], limit=5)
+        self.assertEqual([n['id'] for n in rest['results']], [str(n.id) for n in newest_first[1:]])
+        self.assertIsNone(rest['next'])
+
+
+class NotificationSocketTests(TransactionTestCase):
+    """Test that inbox pushes reach sockets in the user's notification group."""
+    
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='socketuser',
+            email='socket@example.com',
+            password='testpass123'
+        )
+    
+    def test_presence_socket_receives_new_and_read_notifications(self):
+        from asgiref.sync import async_to_sync
+        from channels.routing import URLRouter
+        from channels.testing import WebsocketCommunicator
+        from users.routing import websocket_urlpatterns
+        from users.services.notification_inbox import NotificationInbox
+        
+        async def scenario():
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/presence/')
+            communicator.scope['user'] = self.user
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            
+            # Delivered by the post_save receiver once the insert commits
+            await database_sync_to_async(send_notification)(self.user, 'system', 'Hello', 'm')
+            frame = await communicator.receive_json_from(timeout=3)
+            self.assertEqual(
+                (frame['type'], frame['notification']['title'], frame['unread_count']),
+                ('notification', 'Hello', 1)
+            )
+            
+            await database_sync_to_async(NotificationInbox.mark_read)(self.user.id)
+            frame = await communicator.receive_json_from(timeout=3)
+            self.assertEqual((frame['type'], frame['unread_count']), ('notification_read', 0))
+            await communicator.disconnect()
+        
+        async_to_sync(scenario)()
+
+
+class NotificationRetentionTests(TestCase):
+    """Test bucketed, chunked purging of old read notifications."""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='retention',
+            email='retention@example.com',
+            password='testpass123'
+        )
+    
+    def create(self, age_days, is_read):
+        from users.services.notification_retention import bucket_for
+        notification = Notification.objects.create(
+            user=self.user, notification_type='system', title='T', message='m', is_read=is_read
+        )
+        created_at = timezone.now() - timedelta(days=age_days)
+        # created_at is auto_now_add; backdate the row directly
+        Notification.objects.filter(pk=notification.pk).update(created_at=created_at, bucket=bucket_for(created_at))
+        return notification
+    
+    def test_purge_deletes_expired_read_rows_in_chunks(self):
+        from users.services.notification_retention import NotificationRetention, current_bucket
+        
+        expired = [self.create(age, True) for age in (31, 45, 90, 400, 400)]
+        kept = [self.create(31, False), self.create(5, True), self.create(29, True)]
+        fresh = Notification.objects.create(user=self.user, notification_type='system', title='T', message='m')
+        self.assertEqual(fresh.bucket, current_bucket())
+        kept.append(fresh)
+        
+        self.assertEqual(NotificationRetention.purge(days=30, chunk_size=2, pause=0), len(expired))
+        self.assertEqual(
+            set(Notification.objects.values_list('pk', flat=True)),
+            {notification.pk for notification in kept}
+        )
+    
+    def create_at(self, created_at, is_read=True):
+        from users.services.notification_retention import bucket_for
+        notification = Notification.objects.create(
+            user=self.user, notification_type='system', title='T', message='m', is_read=is_read
+        )
+        Notification.objects.filter(pk=notification.pk).update(created_at=created_at, bucket=bucket_for(created_at))
+        return notification
+    
+    def test_purge_splits_the_cutoff_month_on_created_at(self):
+        """Rows in the cutoff's own bucket are purged only when older than the cutoff."""
+        from datetime import datetime, timezone as dt_timezone
+        from unittest import mock
+        from users.services.notification_retention import NotificationRetention
+        
+        now = datetime(2026, 3, 15, 12, 0, tzinfo=dt_timezone.utc)
+        # days=30 puts the cutoff at 2026-02-13 12:00, inside bucket 202602
+        expired = [
+            self.create_at(datetime(2026, 2, 13, 11, 0, tzinfo=dt_timezone.utc)),
+            self.create_at(datetime(2026, 2, 1, 0, 0, tzinfo=dt_timezone.utc)),
+            self.create_at(datetime(2026, 1, 31, 23, 59, tzinfo=dt_timezone.utc)),
+            self.create_at(datetime(2025, 12, 1, tzinfo=dt_timezone.utc)),
+            self.create_at(datetime(2025, 12, 2, tzinfo=dt_timezone.utc)),
+        ]
+        kept = [
+            self.create_at(datetime(2026, 2, 13, 13, 0, tzinfo=dt_timezone.utc)),
+            self.create_at(datetime(2026, 2, 28, tzinfo=dt_timezone.utc)),
+            self.create_at(datetime(2026, 3, 1, tzinfo=dt_timezone.utc)),
+            self.create_at(datetime(2026, 1, 1, tzinfo=dt_timezone.utc), is_read=False),
+            self.create_at(datetime(2026, 2, 13, 11, 0, tzinfo=dt_timezone.utc), is_read=False),
+        ]
+        
+        with mock.patch('users.services.notification_retention.timezone.now', return_value=now):
+            self.assertEqual(
+                set(NotificationRetention.expired(days=30).values_list('pk', flat=True)),
+                {notification.pk for notification in expired}
+            )
+            # Three chunks of two
+            self.assertEqual(NotificationRetention.purge(days=30, chunk_size=2, pause=0), len(expired))
+        self.assertEqual(
+            set(Notification.objects.values_list('pk', flat=True)),
+            {notification.pk for notification in kept}
+        )
+    
+    @override_settings(TIME_ZONE='Asia/Kabul')
+    def test_migration_backfill_matches_bucket_for(self):
+        """The 0024 backfill computes the same buckets as bucket_for(created_at)."""
+        import importlib
+        from datetime import datetime, timezone as dt_timezone
+        from django.apps import apps
+        from users.services.notification_retention import bucket_for
+        
+        migration = importlib.import_module('users.migrations.0024_notification_buckets')
+        moments = [
+            datetime(2025, 12, 31, 23, 30, tzinfo=dt_timezone.utc),  # already January in Kabul
+            datetime(2026, 1, 31, 21, 0, tzinfo=dt_timezone.utc),
+            datetime(2026, 2, 1, 0, 0, tzinfo=dt_timezone.utc),
+            datetime(2026, 7, 15, 12, 0, tzinfo=dt_timezone.utc),
+        ]
+        for moment in moments:
+            self.create_at(moment)
+        Notification.objects.update(bucket=0)
+        
+        migration.backfill_buckets(apps, None)
+        
+        rows = list(Notification.objects.values_list('created_at', 'bucket'))
+        self.assertEqual(len(rows), len(moments))
+        for created_at, bucket in rows:
+            self.assertEqual(bucket, bucket_for(created_at))
+        self.assertEqual(sorted(bucket for _, bucket in rows), [202512, 202601, 202602, 202607])
@@ -2,7 +2,7 @@
 Test suite for moderator role system.
 Run with: python manage.py test users.tests.ModeratorTests
 """
-from django.test import TestCase, Client
+from django.test import TestCase, TransactionTestCase, Client
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from datetime import timedelta
@@ -405,3 +405,222 @@ class ModeratorIntegrationTests(TestCase):
         
         # Lead can ban
         self.assertTrue(ModeratorPermissionHelper.can_ban_user(lead))
+
+
+class PresenceServiceTests(TestCase):
+    """Test the cache-backed presence store and its flush to the users table."""
+
+    def setUp(self):
+        from users.services.presence_service import PresenceService
+        self.presence = PresenceService
+        self.presence.reset()
+        self.user = User.objects.create_user(
+            username='presence',
+            email='presence@test.com',
+            password='testpass123'
+        )
+
+    def test_heartbeat_is_not_written_until_flush(self):
+        """Heartbeats stay in the store until the periodic flush."""
+        self.presence.heartbeat(self.user.id)
+        self.assertTrue(self.presence.is_online(self.user.id))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.online_status, 'offline')
+
+        self.assertEqual(self.presence.flush(), 1)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.online_status, 'online')
+        self.assertIsNotNone(self.user.last_seen)
+
+    def test_expired_users_flushed_offline(self):
+        """Users without a heartbeat inside the timeout are flushed as offline."""
+        self.presence.heartbeat(self.user.id)
+        self.presence.flush()
+
+        store = self.presence.get_store()
+        store.touch(self.user.id, 'online', 0)
+        self.assertFalse(self.presence.is_online(self.user.id))
+        self.presence.flush()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.online_status, 'offline')
+
+
+    def test_flush_sees_heartbeats_from_another_store_instance(self):
+        """The store lives in the cache, so a flush outside the heartbeat's process writes it."""
+        from users.services.presence_service import CachePresenceStore
+
+        self.presence.heartbeat(self.user.id, 'away')
+        self.presence._store = CachePresenceStore()
+        try:
+            self.assertEqual(self.presence.flush_if_due(), 1)
+            self.user.refresh_from_db()
+            self.assertEqual(self.user.online_status, 'away')
+
+            # A second flush inside the interval is skipped
+            self.presence.heartbeat(self.user.id)
+            self.assertEqual(self.presence.flush_if_due(), 0)
+            self.assertEqual(self.presence.online_user_ids(), [self.user.id])
+        finally:
+            self.presence._store = None
+
+class WebSocketJWTAuthTests(TransactionTestCase):
+    """Test JWT authentication of WebSocket handshakes."""
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='socket',
+            email='socket@test.com',
+            password='testpass123'
+        )
+
+    def token_for(self, user):
+        from rest_framework_simplejwt.tokens import RefreshToken
+        access = RefreshToken.for_user(user).access_token
+        access['tv'] = user.token_version
+        return str(access)
+
+    def handshake(self, token):
+        from asgiref.sync import async_to_sync
+        from channels.routing import URLRouter
+        from channels.testing import WebsocketCommunicator
+        from users.routing import websocket_urlpatterns
+        from users.websocket_auth import JWTAuthMiddlewareStack
+
+        async def scenario():
+            communicator = WebsocketCommunicator(
+                JWTAuthMiddlewareStack(URLRouter(websocket_urlpatterns)),
+                f'/ws/presence/?token={token}'
+            )
+            connected, _ = await communicator.connect()
+            await communicator.disconnect()
+            return connected
+
+        return async_to_sync(scenario)()
+
+    def test_valid_token_connects_and_revoked_token_is_rejected(self):
+        token = self.token_for(self.user)
+        self.assertTrue(self.handshake(token))
+
+        self.user.token_version += 1
+        self.user.save(update_fields=['token_version'])
+        self.assertFalse(self.handshake(token))
+
+    def test_invalid_token_is_rejected(self):
+        self.assertFalse(self.handshake('not-a-token'))
+
+    def test_version_bump_seen_while_user_cached_in_process(self):
+        """A shared-cache miss reads token_version from the database, not the cached user row."""
+        from django.core.cache import cache
+        from django.db.models import F
+        from users.websocket_auth import SocketUserCache
+
+        token = self.token_for(self.user)
+        self.assertTrue(self.handshake(token))
+        self.assertIn(self.user.id, SocketUserCache._users)
+
+        # "Log out all devices" handled by another worker: the DB moves on,
+        # the shared key is cleared and this process keeps its stale row
+        User.objects.filter(id=self.user.id).update(token_version=F('token_version') + 1)
+        cache.delete(SocketUserCache.TOKEN_VERSION_KEY.format(user_id=self.user.id))
+
+        self.assertFalse(self.handshake(token))
+        self.user.refresh_from_db()
+        self.assertTrue(self.handshake(self.token_for(self.user)))
+        self.assertEqual(cache.get(SocketUserCache.TOKEN_VERSION_KEY.format(user_id=self.user.id)), self.user.token_version)
+
+
+class UserSearchTests(TestCase):
+    """Test the indexed user directory search."""
+
+    def setUp(self):
+        from users.services.user_search_service import UserSearchService
+        self.service = UserSearchService
+        self.jose = User.objects.create_user(
+            username='jose.garcia', email='jgarcia@example.com', password='testpass123',
+            first_name='José', last_name='García'
+        )
+        self.jane = User.objects.create_user(
+            username='jane', email='jane.doe@example.com', password='testpass123',
+            first_name='Jane', last_name='Doe'
+        )
+
+    def test_prefix_and_fuzzy_lookups(self):
+        self.assertEqual(self.service.search_ids('gar'), [self.jose.id])
+        self.assertEqual(self.service.search_ids('jane do'), [self.jane.id])
+        self.assertEqual(set(self.service.search_ids('j')), {self.jose.id, self.jane.id})
+        # Misspelled: no prefix match, found through shared trigrams
+        self.assertEqual(self.service.search_ids('garcai'), [self.jose.id])
+
+    def test_tokens_follow_profile_changes_and_cache(self):
+        self.service.search_ids('smith')
+        with self.assertNumQueries(0):
+            self.service.search_ids('smith')
+
+        self.jane.last_name = 'Smith'
+        self.jane.save(update_fields=['last_name'])
+        self.assertEqual(self.service.search_ids('smith'), [self.jane.id])
+        self.assertEqual(self.service.search_ids('doe', fuzzy=False), [self.jane.id])  # still in email
+
+    def test_list_filter_is_not_capped(self):
+        users = [
+            User.objects.create_user(username=f'smith{i}', email=f'smith{i}@example.com', password='testpass123')
+            for i in range(self.service.MAX_RESULTS + 10)
+        ]
+        self.assertEqual(len(self.service.search_ids('smith')), self.service.MAX_RESULTS)
+
+        matches = self.service.filter_queryset(User.objects.all(), 'smith')
+        self.assertEqual(matches.count(), len(users))
+        # Later filters see every match, not the first MAX_RESULTS ids
+        User.objects.filter(id=users[-1].id).update(role='admin')
+        self.assertEqual(list(matches.filter(role='admin').values_list('id', flat=True)), [users[-1].id])
+        self.assertEqual(list(self.service.filter_queryset(User.objects.all(), 'garcai').values_list('id', flat=True)), [self.jose.id])
+
+
+class AdminActivityDigestTests(TestCase):
+    """Test windowed digests of routine admin notifications."""
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.admins = [
+            User.objects.create_user(username=f'admin{i}', email=f'admin{i}@test.com', password='testpass123', role='admin')
+            for i in range(2)
+        ]
+        self.actor = User.objects.create_user(username='actor', email='actor@test.com', password='testpass123')
+
+    def test_routine_activity_delivered_as_one_digest_per_admin(self):
+        import time
+        from chat.services.outbox import Outbox
+        from users.admin_activity_notifier import AdminActivityNotifier
+        from users.models_notification import Notification
+        from users.services.admin_activity_digest import AdminActivityDigest
+
+        for _ in range(3):
+            AdminActivityNotifier.notify_on_user_activity(self.actor, 'USER_LOGIN')
+        AdminActivityNotifier.notify_on_user_activity(self.actor, 'USER_CREATED')
+        Outbox.drain_all()
+        self.assertFalse(Notification.objects.filter(user__in=self.admins).exists())
+
+        self.assertEqual(AdminActivityDigest.flush_due(now=time.time() + 2 * AdminActivityDigest.window_length()), 2)
+        Outbox.drain_all()
+        for admin in self.admins:
+            messages = set(Notification.objects.filter(user=admin).values_list('message', flat=True))
+            self.assertEqual(messages, {'3 user logins in the last 5 minutes', '1 new user created in the last 5 minutes'})
+        # Counters are consumed by the flush
+        self.assertEqual(AdminActivityDigest.flush_due(now=time.time() + 3 * AdminActivityDigest.window_length()), 0)
+
+    def test_high_severity_stays_immediate(self):
+        from chat.services.outbox import Outbox
+        from users.admin_activity_notifier import AdminActivityNotifier
+        from users.models_notification import Notification
+
+        AdminActivityNotifier.notify_on_security_event('RATE_LIMIT_EXCEEDED', ip_address='10.0.0.1')
+        AdminActivityNotifier.notify_on_user_activity(self.actor, 'USER_SUSPENDED')
+        Outbox.drain_all()
+        for admin in self.admins:
+            self.assertEqual(
+                set(Notification.objects.filter(user=admin).values_list('title', flat=True)),
+                {'Rate Limit Exceeded', 'User Suspended'}
+            )
@@ -18,6 +18,7 @@ from users.serializers import (
     UserProfileUpdateSerializer, UserSessionSerializer,
     UserActivitySerializer, UserStatisticsSerializer
 )
+from users.services.user_search_service import UserSearchService
 
 User = get_user_model()
 
@@ -499,12 +500,7 @@ class AdminUserListView(APIView):
             queryset = queryset.filter(role=role_filter)
         
         if search:
-            queryset = queryset.filter(
-                Q(username__icontains=search) |
-                Q(email__icontains=search) |
-                Q(first_name__icontains=search) |
-                Q(last_name__icontains=search)
-            )
+            queryset = UserSearchService.filter_queryset(queryset, search)
         
         # Apply pagination
         from rest_framework.pagination import PageNumberPagination
@@ -781,12 +777,7 @@ class AdminUserCreateView(APIView):
             queryset = queryset.filter(role=role_filter)
         
         if search:
-            queryset = queryset.filter(
-                Q(username__icontains=search) |
-                Q(email__icontains=search) |
-                Q(first_name__icontains=search) |
-                Q(last_name__icontains=search)
-            )
+            queryset = UserSearchService.filter_queryset(queryset, search)
         
         from rest_framework.pagination import PageNumberPagination
         paginator = PageNumberPagination()
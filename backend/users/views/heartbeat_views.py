@@ -1,11 +1,10 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 import json
-from users.models import User
+from users.services.presence_service import PresenceService
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -14,6 +13,8 @@ class HeartbeatView(APIView):
     Receive heartbeat from active users to keep them marked as online.
     Expected to be called every 10 seconds from the frontend.
     Supports POST with logout flag for page unload.
+    Heartbeats only touch the presence store; the users table is updated
+    by the periodic presence flush.
     """
     permission_classes = [IsAuthenticated]
 
@@ -29,20 +30,26 @@ class HeartbeatView(APIView):
                 pass
 
         if logout:
-            user.set_offline()
+            PresenceService.mark_offline(user.id)
         else:
-            user.set_online()
+            PresenceService.heartbeat(user.id)
+        PresenceService.flush_if_due()
 
+        presence = PresenceService.get_status(user.id)
         return Response({
             'message': 'Heartbeat recorded',
-            'online_status': user.online_status,
-            'last_seen': user.last_seen.isoformat()
+            'online_status': presence['online_status'],
+            'last_seen': presence['last_seen'].isoformat()
         })
 
     def get(self, request):
         """Return current online status and last_seen."""
         user = request.user
-        return Response({
+        presence = PresenceService.get_status(user.id) or {
             'online_status': user.online_status,
-            'last_seen': user.last_seen.isoformat()
+            'last_seen': user.last_seen,
+        }
+        return Response({
+            'online_status': presence['online_status'],
+            'last_seen': presence['last_seen'].isoformat()
         })
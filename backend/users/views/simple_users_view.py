@@ -16,17 +16,18 @@ logger = logging.getLogger(__name__)
 def get_all_users_with_status(request):
     """
     Get all users with their current online status.
-    Returns fresh data directly from database.
+    Presence comes from the live presence store, profile fields from the database.
     """
     try:
         from users.models import User
+        from users.services.presence_service import PresenceService
         users = User.objects.all().values(
             'id', 'username', 'email', 'first_name', 'last_name',
             'online_status', 'last_seen', 'role', 'status', 'is_active', 'created_at'
         ).order_by('-created_at')
         
         users_list = []
-        for user in users:
+        for user in PresenceService.overlay(users):
             # If account is inactive or not active, force offline
             if not user['is_active'] or user['status'] in ['inactive', 'suspended', 'banned']:
                 user['online_status'] = 'offline'
@@ -576,13 +576,17 @@ def get_online_users_view(request):
     """
     try:
         from users.models import User
-        users = User.objects.filter(online_status='online').values(
+        from users.services.presence_service import PresenceService
+        users = PresenceService.overlay(User.objects.filter(
+            id__in=PresenceService.online_user_ids('online')
+        ).values(
             'id', 'username', 'email', 'online_status', 'last_seen', 'role', 'status'
-        ).order_by('-last_seen')
+        ))
+        users.sort(key=lambda user: user['last_seen'] or timezone.now(), reverse=True)
         
         return Response({
-            'online_users': list(users),
-            'count': len(list(users))
+            'online_users': users,
+            'count': len(users)
         }, status=status.HTTP_200_OK)
         
     except Exception as e:
@@ -0,0 +1,164 @@
+"""
+JWT authentication for WebSocket connections.
+
+The token is taken from the ``token`` query-string parameter (or an
+``Authorization: Bearer`` header) and validated once per handshake. Its
+``tv`` claim is checked against the user's ``token_version``, which is kept
+in the shared cache and invalidated when it changes, so "log out all devices"
+takes effect on the next handshake. Resolved users are kept in a short-TTL
+per-process cache so reconnect storms do not hit the ``users`` table once
+per socket. Connections without a token fall back to session auth.
+"""
+import copy
+import hashlib
+import logging
+import threading
+import time
+from urllib.parse import parse_qs
+from channels.auth import AuthMiddlewareStack
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import AccessToken
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+
+class SocketUserCache:
+    """
+    Resolves users for WebSocket handshakes.
+
+    ``token_version`` lives in the shared cache; the user rows themselves are
+    kept per process for USER_TTL seconds, loaded with only the fields the
+    consumers read.
+    """
+
+    USER_TTL = 30  # seconds
+    TOKEN_VERSION_TIMEOUT = 300  # seconds
+    TOKEN_VERSION_KEY = 'token_version:{user_id}'
+    BLACKLIST_KEY = 'token_blacklisted:{digest}'
+    BLACKLIST_TIMEOUT = 60  # seconds
+    USER_FIELDS = (
+        'id', 'username', 'first_name', 'last_name', 'email', 'is_active',
+        'is_staff', 'is_superuser', 'role', 'status', 'token_version',
+    )
+
+    _users = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_user(cls, user_id):
+        """Return a lightweight User instance, or None if it does not exist or is inactive."""
+        now = time.monotonic()
+        with cls._lock:
+            entry = cls._users.get(user_id)
+        if entry is not None and entry[1] > now:
+            user = entry[0]
+        else:
+            user = User.objects.only(*cls.USER_FIELDS).filter(id=user_id, is_active=True).first()
+            if user is None:
+                return None
+            with cls._lock:
+                cls._users[user_id] = (user, now + cls.USER_TTL)
+        # Each connection gets its own copy so consumers cannot affect each other
+        return copy.copy(user)
+
+    @classmethod
+    def get_token_version(cls, user_id):
+        key = cls.TOKEN_VERSION_KEY.format(user_id=user_id)
+        token_version = cache.get(key)
+        if token_version is None:
+            # Always from the database: a per-process user row may predate a bump
+            token_version = User.objects.filter(id=user_id).values_list('token_version', flat=True).first() or 0
+            cache.set(key, token_version, cls.TOKEN_VERSION_TIMEOUT)
+        return int(token_version)
+
+    @classmethod
+    def invalidate(cls, user_id, token_version=None):
+        """
+        Forget cached state for a user after their token_version or account
+        changes. A known new ``token_version`` is written to the shared cache
+        rather than deleted, so no worker can repopulate an older value.
+        """
+        key = cls.TOKEN_VERSION_KEY.format(user_id=user_id)
+        if token_version is None:
+            cache.delete(key)
+        else:
+            cache.set(key, token_version, cls.TOKEN_VERSION_TIMEOUT)
+        with cls._lock:
+            cls._users.pop(user_id, None)
+
+    @classmethod
+    def blacklist_key(cls, raw_token):
+        digest = hashlib.sha256(raw_token.encode()).hexdigest()
+        return cls.BLACKLIST_KEY.format(digest=digest)
+
+    @classmethod
+    def is_blacklisted(cls, raw_token):
+        from users.models import BlacklistedToken
+
+        key = cls.blacklist_key(raw_token)
+        blacklisted = cache.get(key)
+        if blacklisted is None:
+            blacklisted = BlacklistedToken.is_token_blacklisted(raw_token)
+            cache.set(key, blacklisted, cls.BLACKLIST_TIMEOUT)
+        return blacklisted
+
+    @classmethod
+    def authenticate(cls, raw_token):
+        """Validate an access token and return its user, or None."""
+        try:
+            access_token = AccessToken(raw_token)
+        except TokenError:
+            return None
+
+        user_id = access_token.get('user_id')
+        token_version = access_token.get('tv')
+        if user_id is None or token_version is None:
+            return None
+
+        if cls.is_blacklisted(raw_token):
+            return None
+
+        user = cls.get_user(user_id)
+        if user is None:
+            return None
+        if int(token_version) != cls.get_token_version(user_id):
+            return None
+        return user
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Populate ``scope['user']`` from a JWT passed on the WebSocket handshake.
+    """
+
+    async def __call__(self, scope, receive, send):
+        raw_token = self.get_token(scope)
+        if raw_token:
+            scope = dict(scope)
+            user = await database_sync_to_async(SocketUserCache.authenticate)(raw_token)
+            scope['user'] = user or AnonymousUser()
+        return await super().__call__(scope, receive, send)
+
+    @staticmethod
+    def get_token(scope):
+        query = parse_qs(scope.get('query_string', b'').decode())
+        if query.get('token'):
+            return query['token'][0]
+        for name, value in scope.get('headers', []):
+            if name == b'authorization':
+                value = value.decode()
+                if value.startswith('Bearer '):
+                    return value[len('Bearer '):]
+        return None
+
+
+def JWTAuthMiddlewareStack(inner):
+    """JWT auth, falling back to Django session auth when no token is sent."""
+    return AuthMiddlewareStack(JWTAuthMiddleware(inner))
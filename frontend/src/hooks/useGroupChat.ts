@@ -30,7 +30,7 @@ export const useGroupChat = (currentUserId: string = "1") => {
             isPrivate: conv.group?.is_private || false,
             members: conv.group?.members || [],
             lastActivity: conv.group?.last_activity ? new Date(conv.group.last_activity) : new Date(conv.created_at),
-            unreadCount: 0
+            unreadCount: conv.unread_count || 0
           }));
         
         setGroups(groupConversations);
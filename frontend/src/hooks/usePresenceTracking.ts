@@ -27,8 +27,13 @@ export const usePresenceTracking = () => {
       wsRef.current.onmessage = (event) => {
         try {
           const data = JSON.parse(event.data);
-          if (data.type === 'user_status_change') {
-            window.dispatchEvent(new CustomEvent('userStatusChange', { detail: data }));
+          if (data.type === 'presence_diff') {
+            // Contacts' presence changes arrive batched, at most once per second
+            data.changes.forEach((change: Record<string, unknown>) => {
+              window.dispatchEvent(new CustomEvent('userStatusChange', {
+                detail: { type: 'user_status_change', ...change },
+              }));
+            });
           }
         } catch (e) {
           console.error('Failed to parse presence message:', e);
@@ -100,7 +100,7 @@ export const useUnifiedChat = (): UnifiedChatData => {
               type: isGroup ? 'group' : 'individual' as const,
               participants,
               lastActivity: new Date(conv.last_message_at || conv.created_at),
-              unreadCount: 0,
+              unreadCount: conv.unread_count || 0,
               groupId: isGroup ? (conv.group?.id || conv.id) : undefined,
               groupName: isGroup ? (conv.group?.name || conv.title) : undefined,
               userId: otherUserId